@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks of all plug-ins on synthetic projects, executed inside headless GIMP.
+# Use benchmarks/run-benchmarks.py to start it, it calls run_suite() with the configuration:
+#
+#   {
+#       "root": "/path/to/repository",
+#       "workdir": "/tmp/pixel-art-benchmarks",
+#       "output": "results.json",
+#       "layers": 256,              # tileset project
+#       "groups": 40,               # spritesheet project
+#       "frames_per_group": 50,
+#       "frame_size": 32,
+#       "only": []                  # benchmark names, empty runs everything
+#   }
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+from gi.repository import Gegl
+from gi.repository import Gio
+import importlib.util
+import json
+import os
+import resource
+import sys
+import time
+
+BENCHMARK_PROPERTIES = {
+    "groups-are-animations": True,
+    "upscale-factor": 1,
+    "xoffset": 0,
+    "yoffset": 0,
+    "xspacing": 0,
+    "yspacing": 0,
+    "enforce-row-count": False,
+    "enforced-tiles-per-row": 0,
+    "invert-order": False,
+    "worker-count": 1,
+    "incremental": False,
+    "packing-strategy": "greedy",
+    "tileset-packing": "grid",
+    "trim-tiles": False,
+    "power-of-two": False,
+    "max-atlas-size": 0,
+    "optimize-frames": False,
+    "streaming-png": False,
+    "binary-annotations": False
+}
+
+def load_plugin_module(root: str, name: str):
+    path = os.path.join(root, "plug-ins", name, f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def reset_peak_rss():
+    # Linux only, resets VmHWM of this process
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        pass
+
+def get_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def get_peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def fill_layer(layer: Gimp.Layer, width: int, height: int):
+    buffer = layer.get_buffer()
+    buffer.set(Gegl.Rectangle.new(0, 0, width, height), "R'G'B'A u8", os.urandom(width * height * 4))
+    buffer.flush()
+
+def create_layer(image: Gimp.Image, name: str, size: int) -> Gimp.Layer:
+    return Gimp.Layer.new(image, name, size, size, Gimp.ImageType.RGBA_IMAGE, 100, Gimp.LayerMode.NORMAL)
+
+def create_tileset_project(filename: str, layer_count: int, frame_size: int):
+    image = Gimp.Image.new(frame_size, frame_size, Gimp.ImageBaseType.RGB)
+    image.undo_disable()
+    for idx in range(layer_count):
+        layer = create_layer(image, f"tile_{idx}", frame_size)
+        image.insert_layer(layer, None, 0)
+        fill_layer(layer, frame_size, frame_size)
+    Gimp.file_save(Gimp.RunMode.NONINTERACTIVE, image, Gio.File.new_for_path(filename), None)
+    image.delete()
+
+def create_spritesheet_project(filename: str, group_count: int, frames_per_group: int, frame_size: int):
+    image = Gimp.Image.new(frame_size, frame_size, Gimp.ImageBaseType.RGB)
+    image.undo_disable()
+    for group_idx in range(group_count):
+        group = Gimp.GroupLayer.new(image, f"clip_{group_idx}")
+        image.insert_layer(group, None, 0)
+        for frame_idx in range(frames_per_group):
+            layer = create_layer(image, f"frame_{group_idx}_{frame_idx}", frame_size)
+            image.insert_layer(layer, group, 0)
+            fill_layer(layer, frame_size, frame_size)
+    Gimp.file_save(Gimp.RunMode.NONINTERACTIVE, image, Gio.File.new_for_path(filename), None)
+    image.delete()
+
+def load_project(filename: str) -> Gimp.Image:
+    return Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(filename))
+
+def bench_spritesheetize(ctx: dict, worker_count: int = 1):
+    spritesheetize = load_plugin_module(ctx["root"], "spritesheetize")
+    image = load_project(ctx["spritesheet_project"])
+    yield
+    spritesheetize.export_image(image,
+                                Gio.File.new_for_path(os.path.join(ctx["workdir"], "spritesheet.png")),
+                                dict(BENCHMARK_PROPERTIES, **{ "worker-count": worker_count }))
+    yield ctx["groups"] * ctx["frames_per_group"]
+
+def bench_spritesheetize_2_workers(ctx: dict):
+    return bench_spritesheetize(ctx, 2)
+
+def bench_spritesheetize_4_workers(ctx: dict):
+    return bench_spritesheetize(ctx, 4)
+
+def bench_spritesheetize_8_workers(ctx: dict):
+    return bench_spritesheetize(ctx, 8)
+
+def bench_spritesheetize_incremental(ctx: dict):
+    # Re-export after editing a single frame, compare with the spritesheetize benchmark
+    spritesheetize = load_plugin_module(ctx["root"], "spritesheetize")
+    image = load_project(ctx["spritesheet_project"])
+    outfile = Gio.File.new_for_path(os.path.join(ctx["workdir"], "spritesheet-incremental.png"))
+    properties = dict(BENCHMARK_PROPERTIES, **{ "incremental": True })
+    spritesheetize.export_image(image, outfile, properties)
+    fill_layer(image.get_layers()[0].get_children()[0], ctx["frame_size"], ctx["frame_size"])
+    yield
+    spritesheetize.export_image(image, outfile, properties)
+
+def bench_tilesetize(ctx: dict):
+    spritesheetize = load_plugin_module(ctx["root"], "spritesheetize")
+    image = load_project(ctx["tileset_project"])
+    yield
+    spritesheetize.export_image(image,
+                                Gio.File.new_for_path(ctx["tileset_sheet"]),
+                                dict(BENCHMARK_PROPERTIES, **{ "groups-are-animations": False }))
+
+def bench_load_as_tiles(ctx: dict, disable_undo: bool = False):
+    load_as_tiles = load_plugin_module(ctx["root"], "load-as-tiles")
+    image = Gimp.Image.new(ctx["frame_size"], ctx["frame_size"], Gimp.ImageBaseType.RGB)
+    yield
+    source = load_as_tiles.load_tile_source(Gio.File.new_for_path(ctx["tileset_sheet"]))
+    rects = load_as_tiles.get_tile_rects(source.width,
+                                         source.height,
+                                         ctx["frame_size"],
+                                         ctx["frame_size"],
+                                         0, 0, 0, 0)
+    with load_as_tiles.undo_step(image, disable_undo):
+        load_as_tiles.load_tiles(source, image, rects)
+    yield len(rects)
+
+def bench_load_as_tiles_no_undo(ctx: dict):
+    return bench_load_as_tiles(ctx, True)
+
+def bench_load_as_tiles_clipboard(ctx: dict):
+    # Whole GIMP image and select / copy / paste per tile, the way load-as-tiles used to work
+    load_as_tiles = load_plugin_module(ctx["root"], "load-as-tiles")
+    image = Gimp.Image.new(ctx["frame_size"], ctx["frame_size"], Gimp.ImageBaseType.RGB)
+    yield
+    input_image = load_project(ctx["tileset_sheet"])
+    rects = load_as_tiles.get_tile_rects(input_image.get_width(),
+                                         input_image.get_height(),
+                                         ctx["frame_size"],
+                                         ctx["frame_size"],
+                                         0, 0, 0, 0)
+    load_as_tiles.load_tiles_with_clipboard(input_image, image, rects)
+    yield len(rects)
+
+def bench_animation_preview(ctx: dict):
+    animation_preview = load_plugin_module(ctx["root"], "animation-preview")
+    image = load_project(ctx["spritesheet_project"])
+    frame_cache = animation_preview.FrameCache(image.get_width(), image.get_height())
+    frames = animation_preview.PluginContext(image).layer_groups[0].get_children()
+    yield
+    # First pass renders, the following ones are playback served from the cache
+    for _ in range(10):
+        for frame in frames:
+            frame_cache.get_frame(frame, 4.0)
+    yield len(frames) * 10
+
+def bench_animation_export(ctx: dict):
+    animation_preview = load_plugin_module(ctx["root"], "animation-preview")
+    image = load_project(ctx["spritesheet_project"])
+    frame_cache = animation_preview.FrameCache(image.get_width(), image.get_height())
+    groups = animation_preview.PluginContext(image).layer_groups
+    yield
+    # Every clip as APNG and GIF, the second format is exported from the cache
+    for export_format in ["APNG", "GIF"]:
+        for (idx, group) in enumerate(groups):
+            frames = [frame_cache.get_frame(frame, 2.0) for frame in reversed(group.get_children())]
+            animation_preview.export_frames(os.path.join(ctx["workdir"], f"clip_{idx}{animation_preview.EXPORT_FORMATS[export_format]}"),
+                                            export_format,
+                                            frames,
+                                            16)
+    yield len(groups) * 2
+
+def bench_tile_preview(ctx: dict):
+    tile_preview = load_plugin_module(ctx["root"], "tile-preview")
+    image = load_project(ctx["tileset_project"])
+    (layer1, layer2) = image.get_layers()[:2]
+    tile_cache = tile_preview.TileCache(image.get_width(), image.get_height())
+    yield
+    for mode in tile_preview.RenderMode.get_string_annotations():
+        tile_preview.get_preview_pixbuf(tile_preview.Dim(image.get_width(), image.get_height()),
+                                        4,
+                                        layer1,
+                                        layer2,
+                                        tile_cache,
+                                        tile_preview.RenderStrategyFactory.get_strategy(mode))
+
+BENCHMARKS = {
+    "spritesheetize": bench_spritesheetize,
+    "spritesheetize-2-workers": bench_spritesheetize_2_workers,
+    "spritesheetize-4-workers": bench_spritesheetize_4_workers,
+    "spritesheetize-8-workers": bench_spritesheetize_8_workers,
+    "spritesheetize-incremental": bench_spritesheetize_incremental,
+    "tilesetize": bench_tilesetize,
+    "load-as-tiles": bench_load_as_tiles,
+    "load-as-tiles-clipboard": bench_load_as_tiles_clipboard,
+    "load-as-tiles-no-undo": bench_load_as_tiles_no_undo,
+    "animation-preview": bench_animation_preview,
+    "animation-export": bench_animation_export,
+    "tile-preview": bench_tile_preview
+}
+
+def run_benchmark(name: str, ctx: dict) -> dict:
+    images_before = set(image.get_id() for image in Gimp.get_images())
+
+    # Everything before the first yield is setup and is not measured,
+    # benchmarks may yield the number of processed items afterwards
+    steps = BENCHMARKS[name](ctx)
+    next(steps)
+
+    # Layers, undo steps and tiles live in the GIMP core, the parent of this plug-in process
+    core_rss_before = get_rss_kb(os.getppid())
+    reset_peak_rss()
+    items = 0
+    with instrumentation.Profiler(name) as profiler:
+        start = time.perf_counter()
+        for processed in steps:
+            items += processed or 0
+        elapsed = time.perf_counter() - start
+    core_rss_growth = get_rss_kb(os.getppid()) - core_rss_before
+
+    for image in Gimp.get_images():
+        if image.get_id() not in images_before:
+            image.delete()
+
+    return {
+        "name": name,
+        "wall_seconds": elapsed,
+        "items": items,
+        "items_per_second": items / elapsed if elapsed > 0 else 0.0,
+        "pdb_calls": profiler.get_call_count(),
+        "pdb_calls_by_function": { key: stats.count for (key, stats) in sorted(profiler.stats.items(), key=lambda item: -item[1].count) },
+        "pdb_seconds_by_function": { key: stats.total_seconds for (key, stats) in profiler.stats.items() },
+        "peak_rss_kb": get_peak_rss_kb(),
+        "core_rss_growth_kb": core_rss_growth
+    }
+
+def run_suite(config: dict):
+    global instrumentation
+    sys.path.append(os.path.join(config["root"], "plug-ins", "pixel-art-common"))
+    import instrumentation
+
+    os.makedirs(config["workdir"], exist_ok=True)
+    ctx = dict(config)
+    ctx["tileset_project"] = os.path.join(config["workdir"], "tileset.xcf")
+    ctx["spritesheet_project"] = os.path.join(config["workdir"], "spritesheet.xcf")
+    ctx["tileset_sheet"] = os.path.join(config["workdir"], "tileset.png")
+
+    create_tileset_project(ctx["tileset_project"], config["layers"], config["frame_size"])
+    create_spritesheet_project(ctx["spritesheet_project"], config["groups"], config["frames_per_group"], config["frame_size"])
+
+    names = config["only"] if len(config["only"]) > 0 else list(BENCHMARKS)
+    # load-as-tiles splits the sheet exported by tilesetize
+    if any(name.startswith("load-as-tiles") for name in names) and "tilesetize" not in names:
+        run_benchmark("tilesetize", ctx)
+
+    results = []
+    for name in names:
+        result = run_benchmark(name, ctx)
+        throughput = f", {result['items_per_second']:.1f} items/s" if result["items"] > 0 else ""
+        print(f"{name}: {result['wall_seconds']:.3f}s{throughput}, {result['pdb_calls']} PDB calls, peak RSS {result['peak_rss_kb']} kB, "
+              f"GIMP memory growth {result['core_rss_growth_kb']} kB")
+        results.append(result)
+
+    with open(config["output"], "w") as fp:
+        json.dump({
+            "gimp": Gimp.version(),
+            "python": sys.version.split()[0],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": config,
+            "results": results
+        }, fp, indent=4)
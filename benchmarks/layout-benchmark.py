@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Times the layout and packing code of spritesheetize on synthetic inputs.
+# Does not need GIMP, run from the repository root:
+#
+#   python3 benchmarks/layout-benchmark.py [--frames 100000] [--rects 500] [--large-rects 2000] [--seed 0] [--max-seconds 0]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plug-ins", "spritesheetize"))
+import layout
+
+FRAME_SIZE = layout.Vector2d(32, 32)
+
+def create_options(**kwargs) -> layout.ExportOptions:
+    return layout.ExportOptions(layout.Vector2d(1, 1), layout.Vector2d(2, 2), 1, False, False, 0, **kwargs)
+
+def create_group_lengths(frame_count: int, rng: random.Random) -> list[int]:
+    lengths = []
+    while frame_count > 0:
+        lengths.append(min(frame_count, rng.randint(1, 24)))
+        frame_count -= lengths[-1]
+    return lengths
+
+def create_rect_sizes(count: int, rng: random.Random) -> list[tuple[int, int]]:
+    return [(rng.randint(4, 64), rng.randint(4, 64)) for _ in range(count)]
+
+def measure(name: str, function) -> float:
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed * 1000:.1f}ms")
+    return elapsed
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark spritesheetize layout code without GIMP")
+    parser.add_argument("--frames", type=int, default=100000, help="Frame / tile count of the grid layouts")
+    parser.add_argument("--rects", type=int, default=500, help="Rectangle count of the MaxRects / skyline layouts")
+    parser.add_argument("--large-rects", type=int, default=2000, help="Rectangle count of the large MaxRects / skyline layouts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-seconds", type=float, default=0, help="Fail when the total time exceeds this (0 = never)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    group_lengths = create_group_lengths(args.frames, rng)
+    rect_sizes = create_rect_sizes(args.rects, rng)
+    large_rect_sizes = create_rect_sizes(args.large_rects, rng)
+    print(f"{args.frames} frames in {len(group_lengths)} clips, {args.rects} and {args.large_rects} rectangles")
+
+    total = 0.0
+    total += measure("tileset grid", lambda: layout.layout_tileset(args.frames, FRAME_SIZE, create_options()))
+    total += measure("tileset grid, paged", lambda: layout.layout_tileset(args.frames, FRAME_SIZE, create_options(max_atlas_size=4096)))
+    for strategy in layout.PACKING_STRATEGIES:
+        options = create_options(packing_strategy=strategy)
+        total += measure(f"spritesheet {strategy}", lambda: layout.layout_spritesheet(group_lengths, FRAME_SIZE, options))
+    for strategy in ["maxrects", "skyline"]:
+        total += measure(f"rects {strategy}", lambda: layout.find_rect_pages(rect_sizes, create_options(), strategy))
+        total += measure(f"rects {strategy}, paged",
+                         lambda: layout.find_rect_pages(rect_sizes, create_options(max_atlas_size=1024), strategy))
+        total += measure(f"rects {strategy}, large",
+                         lambda: layout.find_rect_pages(large_rect_sizes, create_options(), strategy))
+
+    print(f"total: {total * 1000:.1f}ms")
+    if args.max_seconds > 0 and total > args.max_seconds:
+        print(f"Layout took longer than {args.max_seconds}s")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Generates synthetic projects and benchmarks every plug-in on them in headless GIMP.
+# Wall time, PDB call counts, peak RSS and GIMP memory growth of every benchmark are written to a JSON file,
+# so results of different releases can be compared.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+def main() -> int:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    suite = os.path.join(root, "benchmarks", "benchmark-suite.py")
+
+    parser = argparse.ArgumentParser(description="Benchmark the plug-ins on synthetic projects")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file with the results")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "pixel-art-benchmarks"),
+                        help="Directory for the generated projects and exports")
+    parser.add_argument("--gimp", default="gimp-console", help="GIMP executable to use")
+    parser.add_argument("--layers", type=int, default=256, help="Layer count of the tileset project")
+    parser.add_argument("--groups", type=int, default=40, help="Group count of the spritesheet project")
+    parser.add_argument("--frames-per-group", type=int, default=50)
+    parser.add_argument("--frame-size", type=int, default=32)
+    parser.add_argument("--only", action="append", default=[],
+                        choices=["spritesheetize", "spritesheetize-2-workers", "spritesheetize-4-workers",
+                                 "spritesheetize-8-workers", "spritesheetize-incremental", "tilesetize",
+                                 "load-as-tiles", "load-as-tiles-clipboard", "load-as-tiles-no-undo",
+                                 "animation-preview", "animation-export", "tile-preview"],
+                        help="Run only this benchmark (can be repeated)")
+    args = parser.parse_args()
+
+    config = {
+        "root": root,
+        "workdir": os.path.abspath(args.workdir),
+        "output": os.path.abspath(args.output),
+        "layers": args.layers,
+        "groups": args.groups,
+        "frames_per_group": args.frames_per_group,
+        "frame_size": args.frame_size,
+        "only": args.only
+    }
+    script = f"exec(open({suite!r}).read()); run_suite({config!r})"
+
+    return subprocess.call([args.gimp,
+                            "-i",
+                            "--quit",
+                            "--batch-interpreter=python-fu-eval",
+                            "-b", script])
+
+if __name__ == "__main__":
+    sys.exit(main())
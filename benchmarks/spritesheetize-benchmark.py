@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compares the layer-copy and pixel-buffer compositors of spritesheetize, their speed and their output.
+# Run from the repository root inside headless GIMP:
+#
+#   gimp-console -i --batch-interpreter=python-fu-eval \
+#       -b "exec(open('benchmarks/spritesheetize-benchmark.py').read())" \
+#       -b "Gimp.quit()"
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+from gi.repository import Gegl
+import concurrent.futures
+import importlib.util
+import os
+import time
+
+GROUP_COUNT = 40
+FRAMES_PER_GROUP = 50
+FRAME_SIZE = 32
+# Every n-th frame gets a layer mask, the buffer compositor has to apply it like GIMP does
+MASKED_FRAME_STEP = 5
+
+def load_plugin_module(name: str):
+    path = os.path.join(os.getcwd(), "plug-ins", name, f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def create_synthetic_image(group_count: int, frames_per_group: int, frame_size: int) -> Gimp.Image:
+    image = Gimp.Image.new(frame_size, frame_size, Gimp.ImageBaseType.RGB)
+    image.undo_disable()
+    for group_idx in range(group_count):
+        group = Gimp.GroupLayer.new(image, f"group_{group_idx}")
+        image.insert_layer(group, None, 0)
+        for frame_idx in range(frames_per_group):
+            layer = Gimp.Layer.new(image,
+                                   f"frame_{group_idx}_{frame_idx}",
+                                   frame_size,
+                                   frame_size,
+                                   Gimp.ImageType.RGBA_IMAGE,
+                                   100,
+                                   Gimp.LayerMode.NORMAL)
+            image.insert_layer(layer, group, 0)
+            buffer = layer.get_buffer()
+            buffer.set(Gegl.Rectangle.new(0, 0, frame_size, frame_size),
+                       "R'G'B'A u8",
+                       os.urandom(frame_size * frame_size * 4))
+            buffer.flush()
+
+            if frame_idx % MASKED_FRAME_STEP == 0:
+                mask = layer.create_mask(Gimp.AddMaskType.WHITE)
+                layer.add_mask(mask)
+                mask_buffer = mask.get_buffer()
+                mask_buffer.set(Gegl.Rectangle.new(0, 0, frame_size, frame_size),
+                                "Y u8",
+                                os.urandom(frame_size * frame_size))
+                mask_buffer.flush()
+    return image
+
+def get_image_pixels(image: Gimp.Image) -> bytes:
+    layer = image.merge_visible_layers(Gimp.MergeType.CLIP_TO_IMAGE)
+    return layer.get_buffer().get(Gegl.Rectangle.new(0, 0, image.get_width(), image.get_height()),
+                                  1.0,
+                                  "R'G'B'A u8",
+                                  Gegl.AbyssPolicy.NONE)
+
+def run_benchmark():
+    spritesheetize = load_plugin_module("spritesheetize")
+    image = create_synthetic_image(GROUP_COUNT, FRAMES_PER_GROUP, FRAME_SIZE)
+    options = spritesheetize.ExportOptions(spritesheetize.Vector2d(8, 8),
+                                           spritesheetize.Vector2d(4, 4),
+                                           1, False, False, 0)
+    frame_count = GROUP_COUNT * FRAMES_PER_GROUP
+
+    (pages, _) = spritesheetize.spritesheetize(image, options)
+    page = pages[0]
+
+    worker_count = os.cpu_count() or 1
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count)
+    reference = None
+    for name, compositor in [("layer-copy", spritesheetize.LayerCopyCompositor()),
+                             ("buffer", spritesheetize.BufferCompositor()),
+                             (f"buffer x{worker_count}", spritesheetize.BufferCompositor(pool))]:
+        start = time.perf_counter()
+        out_image = compositor.compose(image, page.placements, page.size, options.scaling_factor)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {frame_count} frames in {elapsed:.3f}s ({frame_count / elapsed:.1f} frames/s)")
+
+        # Layer copies are blended by GIMP itself, so they are the reference output
+        pixels = get_image_pixels(out_image)
+        out_image.delete()
+        if reference is None:
+            reference = pixels
+            continue
+
+        # Masks are applied in floating point by GIMP, so values may differ by rounding
+        difference = max((abs(a - b) for (a, b) in zip(pixels, reference)), default=0)
+        status = "matches" if len(pixels) == len(reference) and difference <= 1 else "DIFFERS from"
+        print(f"{name}: output {status} layer-copy (largest channel difference {difference})")
+
+    pool.shutdown()
+    image.delete()
+
+run_benchmark()
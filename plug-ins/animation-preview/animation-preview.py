@@ -9,9 +9,22 @@ from gi.repository import GimpUi
 from gi.repository import GObject
 from gi.repository import GLib
 from gi.repository import Gtk
+gi.require_version('Gdk', '3.0')
+from gi.repository import Gdk
 from gi.repository import Gegl
 from gi.repository import Gio
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf
 import sys
+import os
+import re
+import collections
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pixel-art-common"))
+import instrumentation
+import change_detection
+from animation_export import ApngWriter, GifWriter
 
 plug_in_proc = "plug-in-nerudaj-animation-preview"
 plug_in_binary = "py3-animation-preview"
@@ -22,6 +35,18 @@ plug_in_docs = "Plug-in for playing layer groups as animations."
 plug_in_name = "Animation Preview"
 plug_in_path = "<Image>/Pixel Art"
 
+FRAME_FORMAT = "R'G'B'A u8"
+BYTES_PER_PIXEL = 4
+DEFAULT_CACHE_LIMIT_MB = 256
+DEFAULT_ONION_SKIN_FRAMES = 1
+DEFAULT_ONION_SKIN_OPACITY = 30
+DEFAULT_PREVIEW_WIDTH = 128
+EXPORT_FORMATS = {
+    "WEBP": ".webp",
+    "GIF": ".gif",
+    "APNG": ".png"
+}
+
 class GtkBuilder:
     @staticmethod
     def create_window(title: str) -> Gtk.Window:
@@ -72,12 +97,25 @@ class GtkBuilder:
         parent.pack_start(combo, True, True, 0)
         return combo
 
+class PreviewMode:
+    SINGLE = "Single"
+    ONION_SKIN = "Onion skin"
+    SIDE_BY_SIDE = "Side by side"
+
+    @staticmethod
+    def get_string_annotations():
+        return [PreviewMode.SINGLE, PreviewMode.ONION_SKIN, PreviewMode.SIDE_BY_SIDE]
+
 class GtkContext:
     def __init__(self):
         self.window = None
         self.display_box = None
         self.preview_box = None
         self.current_frame_label = None
+        self.fps_label = None
+        self.layer_combo = None
+        self.compare_combo = None
+        self.export_format_combo = None
 
 class Playback:
     def __init__(self, frame_count):
@@ -85,40 +123,198 @@ class Playback:
         self.playing = False
         self.frame_index = 0
         self.frame_count = frame_count
+        # Frames played since the start, wrapped separately for every clip shown side by side
+        self.frame_counter = 0
+        self.start_time = 0
+        self.start_counter = 0
+        self.presented_times = collections.deque()
 
-    def start(self):
+    def start(self, now: int):
         self.playing = True
+        self.presented_times.clear()
+        self.restart_clock(now)
 
     def stop(self):
         self.playing = False
 
+    def restart_clock(self, now: int):
+        self.start_time = now
+        self.start_counter = self.frame_counter
+
+    def advance_clock(self, now: int) -> bool:
+        # Frame is derived from the time elapsed since start, late ticks drop frames instead of drifting
+        if self.frame_count == 0:
+            return False
+
+        elapsed_frames = (now - self.start_time) * self.fps // 1000000
+        changed = self.start_counter + elapsed_frames != self.frame_counter
+        self.set_frame_counter(self.start_counter + elapsed_frames)
+        return changed
+
+    def set_frame_counter(self, frame_counter: int):
+        self.frame_counter = frame_counter
+        self.frame_index = frame_counter % self.frame_count if self.frame_count > 0 else 0
+
+    def get_clip_frame_index(self, clip_frame_count: int) -> int:
+        return self.frame_counter % clip_frame_count
+
+    def record_presented_frame(self, now: int):
+        self.presented_times.append(now)
+        while self.presented_times[0] < now - 1000000:
+            self.presented_times.popleft()
+
+    def get_measured_fps(self) -> float:
+        return float(len(self.presented_times))
+
     def next_frame(self):
-        self.frame_index += 1
-        if self.frame_index == self.frame_count:
-            self.frame_index = 0
+        self.set_frame_counter(self.frame_counter + 1)
 
     def prev_frame(self):
-        self.frame_index -= 1
-        if self.frame_index < 0:
-            self.frame_index = self.frame_count - 1
+        self.set_frame_counter(self.frame_counter - 1)
 
     def update_fps(self, fps):
         self.fps = fps
+        if self.playing:
+            self.restart_clock(GLib.get_monotonic_time())
+
+def render_frame(layer: Gimp.Layer, width: int, height: int) -> GdkPixbuf.Pixbuf:
+    (_, x, y) = layer.get_offsets()
+
+    # Read in image coordinates, areas not covered by the layer come out transparent
+    pixels = layer.get_buffer().get(Gegl.Rectangle.new(-x, -y, width, height),
+                                    1.0,
+                                    FRAME_FORMAT,
+                                    Gegl.AbyssPolicy.NONE)
+    pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(pixels),
+                                             GdkPixbuf.Colorspace.RGB,
+                                             True,
+                                             8,
+                                             width,
+                                             height,
+                                             width * BYTES_PER_PIXEL)
+
+    opacity = layer.get_opacity()
+    if opacity < 100.0:
+        faded = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, width, height)
+        faded.fill(0)
+        pixbuf.composite(faded, 0, 0, width, height, 0, 0, 1.0, 1.0, GdkPixbuf.InterpType.NEAREST, int(opacity * 255 / 100))
+        pixbuf = faded
+
+    return pixbuf
+
+def scale_frame(pixbuf: GdkPixbuf.Pixbuf, zoom_level: float) -> GdkPixbuf.Pixbuf:
+    return pixbuf.scale_simple(max(1, int(pixbuf.get_width() * zoom_level)),
+                               max(1, int(pixbuf.get_height() * zoom_level)),
+                               GdkPixbuf.InterpType.NEAREST)
+
+class FrameCache:
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 memory_limit: int = DEFAULT_CACHE_LIMIT_MB * 1024 * 1024,
+                 change_poller: change_detection.ChangePoller | None = None):
+        self.width = width
+        self.height = height
+        self.memory_limit = memory_limit
+        self.change_poller = change_poller
+        self.memory_used = 0
+        self.zoom_level = None
+        # Least recently used first
+        self.frames: collections.OrderedDict[int, GdkPixbuf.Pixbuf] = collections.OrderedDict()
+        self.scaled_frames: collections.OrderedDict[int, GdkPixbuf.Pixbuf] = collections.OrderedDict()
+
+    def has_frame(self, layer: Gimp.Layer, zoom_level: float) -> bool:
+        return zoom_level == self.zoom_level and layer.get_id() in self.scaled_frames
+
+    def get_frame(self, layer: Gimp.Layer, zoom_level: float) -> GdkPixbuf.Pixbuf:
+        # Zoom only rescales frames already read from GIMP
+        if zoom_level != self.zoom_level:
+            self.clear(self.scaled_frames)
+            self.zoom_level = zoom_level
+
+        layer_id = layer.get_id()
+        if layer_id in self.scaled_frames:
+            self.scaled_frames.move_to_end(layer_id)
+            return self.scaled_frames[layer_id]
+
+        if layer_id in self.frames:
+            self.frames.move_to_end(layer_id)
+        else:
+            # Checksum of what is being rendered, later edits are detected against it
+            if self.change_poller is not None:
+                self.change_poller.remember(layer)
+            self.store(self.frames, layer_id, render_frame(layer, self.width, self.height))
+        frame = scale_frame(self.frames[layer_id], zoom_level)
+        self.store(self.scaled_frames, layer_id, frame)
+        return frame
+
+    def get_frame_size(self, zoom_level: float) -> int:
+        # Memory taken by one frame, unscaled and scaled
+        scaled_size = max(1, int(self.width * zoom_level)) * max(1, int(self.height * zoom_level))
+        return (self.width * self.height + scaled_size) * BYTES_PER_PIXEL
+
+    def store(self, frames: collections.OrderedDict, layer_id: int, frame: GdkPixbuf.Pixbuf):
+        frames[layer_id] = frame
+        self.memory_used += frame.get_byte_length()
+        self.evict()
+
+    def evict(self):
+        # Scaled frames are cheap to recreate from the unscaled ones, so they go first
+        for frames in [self.scaled_frames, self.frames]:
+            while self.memory_used > self.memory_limit and len(frames) > 1:
+                (_, frame) = frames.popitem(last=False)
+                self.memory_used -= frame.get_byte_length()
+
+    def set_memory_limit(self, memory_limit: int):
+        self.memory_limit = memory_limit
+        self.evict()
+
+    def clear(self, frames: collections.OrderedDict):
+        for frame in frames.values():
+            self.memory_used -= frame.get_byte_length()
+        frames.clear()
+
+    def invalidate(self):
+        self.clear(self.frames)
+        self.clear(self.scaled_frames)
+
+    def invalidate_frame(self, layer_id: int):
+        for frames in [self.frames, self.scaled_frames]:
+            if layer_id in frames:
+                self.memory_used -= frames.pop(layer_id).get_byte_length()
+
+def get_layer_groups(image: Gimp.Image) -> list[Gimp.GroupLayer]:
+    return [
+        layer for layer in image.get_layers()
+        if hasattr(layer, "get_children") and len(layer.get_children()) > 0
+    ]
 
 class PluginContext:
     def __init__(self, image: Gimp.Image):
-        self.zoom_level = -1.0
+        # Export All can run before any group is picked, so the zoom has to be valid from the start
+        self.zoom_level = DEFAULT_PREVIEW_WIDTH / max(1, image.get_width())
         self.gtk_ctx = GtkContext()
         self.image_ref = image
-        self.layer_groups = [
-            layer for layer in image.get_layers()
-            if hasattr(layer, "get_children") and len(layer.get_children()) > 0
-        ]
+        self.layer_groups = get_layer_groups(image)
         self.layer_group_names = [ layer.get_name() for layer in self.layer_groups]
+        self.top_level_ids = [layer.get_id() for layer in image.get_layers()]
         self.playback = Playback(0)
         self.active_layer_group = None
-        self.temp_img = None
-        self.interval_event_id = -1
+        self.active_frames: list[Gimp.Layer] = []
+        self.active_frame_names: list[str] = []
+        self.change_poller = change_detection.ChangePoller()
+        self.frame_cache = FrameCache(image.get_width(),
+                                      image.get_height(),
+                                      change_poller=self.change_poller)
+        self.preview_mode = PreviewMode.SINGLE
+        self.onion_skin_frames = DEFAULT_ONION_SKIN_FRAMES
+        self.onion_skin_opacity = DEFAULT_ONION_SKIN_OPACITY / 100
+        self.compare_groups: list[Gimp.GroupLayer] = []
+        self.tick_callback_id = -1
+        self.group_frames: dict[int, list[Gimp.Layer]] = {}
+        self.prerender_queue: list[tuple[bool, Gimp.Layer]] = []
+        self.prerender_zoom = None
+        self.prerender_source_id = -1
 
     def __str__(self):
         return f"PreviewContext(zoom = {self.zoom_level})"
@@ -139,44 +335,56 @@ def log(message):
     ProcedureHelper.call_pdb_procedure("gimp-message", [("message", message)])
 
 def update_fps(_: Gtk.Widget, fps_entry, context: PluginContext):
-    context.playback.update_fps(int(fps_entry.get_text()))
+    # Frame durations are derived from the FPS, so it can't go below one
+    fps = max(1, int(fps_entry.get_text()))
+    fps_entry.set_text(f"{fps}")
+    context.playback.update_fps(fps)
 
 def start_playback(_: Gtk.Widget, context: PluginContext):
-    context.playback.start()
-    update_preview(context)
+    if context.playback.playing:
+        return
+
+    context.playback.start(GLib.get_monotonic_time())
+    # Ticks follow the frame clock of the window, frames are only redrawn when the frame index changes
+    context.tick_callback_id = context.gtk_ctx.preview_box.add_tick_callback(playback_tick, context)
 
 def stop_playback(_: Gtk.Widget, context: PluginContext):
     context.playback.stop()
+    if context.tick_callback_id != -1:
+        context.gtk_ctx.preview_box.remove_tick_callback(context.tick_callback_id)
+        context.tick_callback_id = -1
     update_preview(context)
 
 def prev_frame(_: Gtk.Widget, context: PluginContext):
-    context.playback.prev_frame()
-    update_preview(context, force=True)
+    if not context.playback.playing:
+        context.playback.prev_frame()
+        update_preview(context)
 
 def next_frame(_: Gtk.Widget, context: PluginContext):
-    context.playback.next_frame()
-    update_preview(context, force=True)
+    if not context.playback.playing:
+        context.playback.next_frame()
+        update_preview(context)
 
 class ZoomHandler:
     @staticmethod
     def zoom_in(_: Gtk.Widget, context: PluginContext):
         context.zoom_level += 0.1
-        update_preview(context, force=True)
+        update_preview(context)
 
     @staticmethod
     def zoom_out(_: Gtk.Widget, context: PluginContext):
         context.zoom_level = max(0.1, context.zoom_level - 0.1)
-        update_preview(context, force=True)
+        update_preview(context)
 
     @staticmethod
     def reset_zoom(_: Gtk.Widget, context: PluginContext):
         context.zoom_level = 1.0
-        update_preview(context, force=True)
+        update_preview(context)
 
     @staticmethod
     def zoom_to_fit(_: Gtk.Widget, context: PluginContext):
         if not context.gtk_ctx.display_box or not context.image_ref:
-            log("DEBUG: Zoom to fit called but display box or image reference is not set.")
+            instrumentation.debug("Zoom to fit called but display box or image reference is not set.")
             return
         
         img_w = context.image_ref.get_width()
@@ -191,71 +399,270 @@ class ZoomHandler:
 
         # Prevent zoom from being too small
         context.zoom_level = max(0.1, context.zoom_level)
-        update_preview(context, force=True)
+        update_preview(context)
+
+def get_cached_frame(frame: Gimp.Layer, context: PluginContext) -> GdkPixbuf.Pixbuf:
+    # Pixbufs are not kept outside of the cache, so its limit bounds the memory of all displayed clips
+    return context.frame_cache.get_frame(frame, context.zoom_level)
+
+def get_displayed_groups(context: PluginContext) -> list[Gimp.GroupLayer]:
+    if context.active_layer_group is None:
+        return []
+    if context.preview_mode == PreviewMode.SIDE_BY_SIDE:
+        return [context.active_layer_group] + context.compare_groups
+    return [context.active_layer_group]
 
-def update_preview(context: PluginContext, force: bool = False):
-    if (force == context.playback.playing):
+def update_preview(context: PluginContext):
+    if len(context.active_frames) == 0:
         return
-    
-    if (context.playback.playing):
-        context.playback.next_frame()
-    
-    active_group_len = len(context.active_layer_group.get_children())
-    frames = context.active_layer_group.get_children()
-    current_frame = frames[active_group_len - 1 - context.playback.frame_index]
 
-    context.gtk_ctx.current_frame_label.set_text(current_frame.get_name())
+    if context.prerender_zoom != context.zoom_level:
+        start_prerender(context)
 
-    if context.gtk_ctx.preview_box:
-        context.gtk_ctx.display_box.remove(context.gtk_ctx.preview_box)
-    
-    context.gtk_ctx.preview_box = GimpUi.DrawablePreview.new_from_drawable(get_scaled_layer(current_frame, context))
-    context.gtk_ctx.display_box.pack_start(context.gtk_ctx.preview_box, True, True, 0)
-    context.gtk_ctx.window.show_all()
+    context.gtk_ctx.current_frame_label.set_text(context.active_frame_names[context.playback.frame_index])
+    if context.playback.playing:
+        context.gtk_ctx.fps_label.set_text(f"{context.playback.get_measured_fps():.0f} / {context.playback.fps}")
+    else:
+        context.gtk_ctx.fps_label.set_text("")
+    context.gtk_ctx.preview_box.queue_draw()
+
+def playback_tick(widget: Gtk.Widget, frame_clock: Gdk.FrameClock, context: PluginContext) -> bool:
+    if not context.playback.playing:
+        context.tick_callback_id = -1
+        return GLib.SOURCE_REMOVE
+
+    if context.playback.advance_clock(frame_clock.get_frame_time()):
+        update_preview(context)
+    return GLib.SOURCE_CONTINUE
+
+def paint_frame(cr, pixbuf: GdkPixbuf.Pixbuf, x: int, y: int, opacity: float = 1.0):
+    Gdk.cairo_set_source_pixbuf(cr, pixbuf, x, y)
+    if opacity < 1.0:
+        cr.paint_with_alpha(opacity)
+    else:
+        cr.paint()
+
+def draw_onion_skin(cr, frames: list[Gimp.Layer], frame_index: int, x: int, y: int, context: PluginContext):
+    # Farthest frames first and faintest, so the nearer ones are painted over them
+    for distance in range(min(context.onion_skin_frames, len(frames) - 1), 0, -1):
+        opacity = context.onion_skin_opacity * (context.onion_skin_frames - distance + 1) / context.onion_skin_frames
+        paint_frame(cr, get_cached_frame(frames[(frame_index - distance) % len(frames)], context), x, y, opacity)
+        # In short clips the previous and the next frame can be the same one
+        if (frame_index + distance) % len(frames) != (frame_index - distance) % len(frames):
+            paint_frame(cr, get_cached_frame(frames[(frame_index + distance) % len(frames)], context), x, y, opacity)
+
+def draw_preview(widget: Gtk.DrawingArea, cr, context: PluginContext) -> bool:
+    if len(context.active_frames) == 0:
+        return False
+
+    # Every clip is painted from the frame cache, additional clips and onion skins only cost blits
+    clips = [get_group_frames(group, context) for group in get_displayed_groups(context)]
+    clips = [frames for frames in clips if len(frames) > 0]
+    # Frames have the size of the image
+    frame_width = max(1, int(context.frame_cache.width * context.zoom_level))
+    frame_height = max(1, int(context.frame_cache.height * context.zoom_level))
+    margin = 8
+    alloc = widget.get_allocation()
+    x = (alloc.width - len(clips) * (frame_width + margin) + margin) // 2
+    y = (alloc.height - frame_height) // 2
+
+    for frames in clips:
+        frame_index = context.playback.get_clip_frame_index(len(frames))
+        if context.preview_mode == PreviewMode.ONION_SKIN:
+            draw_onion_skin(cr, frames, frame_index, x, y, context)
+        paint_frame(cr, get_cached_frame(frames[frame_index], context), x, y)
+        x += frame_width + margin
 
     if context.playback.playing:
-        GLib.timeout_add(1000 / context.playback.fps, update_preview, context)
-    
-    return False # clear previous timeout if any
-
-def get_scaled_layer(layer: Gimp.Layer, context: PluginContext) -> Gimp.Image:
-    context.temp_img = Gimp.Image.new(
-        context.image_ref.get_width(),
-        context.image_ref.get_height(),
-        context.image_ref.get_base_type())
-    context.temp_img.undo_disable()
-
-    temp_layer = Gimp.Layer.new_from_drawable(layer, context.temp_img)
-    if len(temp_layer.get_children()) == 0:
-        temp_layer.add_alpha()
-    temp_layer.set_visible(True)
-    context.temp_img.insert_layer(temp_layer, None, 0)
-    Gimp.context_set_interpolation(Gimp.InterpolationType.NONE)
-    context.temp_img.scale(context.temp_img.get_width() * context.zoom_level,
-                           context.temp_img.get_height() * context.zoom_level)
-    
-    return temp_layer
+        context.playback.record_presented_frame(GLib.get_monotonic_time())
+    return False
+
+def get_group_frames(group: Gimp.GroupLayer, context: PluginContext) -> list[Gimp.Layer]:
+    # Frames are played from the bottom of the group up
+    if group.get_id() not in context.group_frames:
+        context.group_frames[group.get_id()] = list(reversed(group.get_children()))
+    return context.group_frames[group.get_id()]
+
+def start_prerender(context: PluginContext):
+    if context.active_layer_group is None:
+        return
+
+    # Queue is popped from the end, groups are expanded into frames lazily and the displayed ones go first
+    displayed_groups = get_displayed_groups(context)
+    displayed_ids = [group.get_id() for group in displayed_groups]
+    context.prerender_queue = [(True, group) for group in reversed(context.layer_groups)
+                               if group.get_id() not in displayed_ids] + [(True, group) for group in reversed(displayed_groups)]
+    context.prerender_zoom = context.zoom_level
+    if context.prerender_source_id == -1:
+        context.prerender_source_id = GLib.idle_add(prerender_step, context, priority=GLib.PRIORITY_LOW)
+
+def prerender_step(context: PluginContext) -> bool:
+    # One frame per idle call keeps the UI and playback responsive
+    cache = context.frame_cache
+    while len(context.prerender_queue) > 0:
+        (is_group, item) = context.prerender_queue.pop()
+        # Layers removed since the prerendering started
+        if not item.is_valid():
+            continue
+
+        if is_group:
+            context.prerender_queue.extend((False, frame) for frame in reversed(get_group_frames(item, context)))
+            continue
+
+        if cache.has_frame(item, context.prerender_zoom):
+            continue
+
+        # Stop once the cache is full, prerendering more would only evict frames rendered before
+        if cache.memory_used + cache.get_frame_size(context.prerender_zoom) > cache.memory_limit:
+            break
+
+        cache.get_frame(item, context.prerender_zoom)
+        return GLib.SOURCE_CONTINUE
+
+    instrumentation.debug("Prerendering finished, %d kB cached", cache.memory_used // 1024)
+    context.prerender_queue = []
+    context.prerender_source_id = -1
+    return GLib.SOURCE_REMOVE
+
+def load_active_frames(context: PluginContext):
+    context.active_frames = get_group_frames(context.active_layer_group, context)
+    context.active_frame_names = [frame.get_name() for frame in context.active_frames]
+
+def has_structure_changed(context: PluginContext) -> bool:
+    # Only the top level layers and the children of the displayed groups are listed, a few calls per poll
+    if [layer.get_id() for layer in context.image_ref.get_layers()] != context.top_level_ids:
+        return True
+
+    for group in get_displayed_groups(context):
+        if not group.is_valid():
+            return True
+        frame_ids = [frame.get_id() for frame in get_group_frames(group, context)]
+        if [frame.get_id() for frame in reversed(group.get_children())] != frame_ids:
+            return True
+
+    return False
+
+def poll_changes(context: PluginContext) -> bool:
+    # Groups or frames were added, removed or reordered
+    if has_structure_changed(context):
+        refresh_frames(None, context)
+        return GLib.SOURCE_CONTINUE
+
+    if context.active_layer_group is None:
+        return GLib.SOURCE_CONTINUE
+
+    polled_frames = [frame for group in get_displayed_groups(context) for frame in get_group_frames(group, context)]
+    changed = context.change_poller.poll(polled_frames)
+    if len(changed) == 0:
+        return GLib.SOURCE_CONTINUE
+
+    # Frames were removed from the image, the group has to be read again
+    if not all(frame.is_valid() for frame in changed):
+        refresh_frames(None, context)
+        return GLib.SOURCE_CONTINUE
+
+    instrumentation.debug("Frames changed: %s", lambda: ", ".join(frame.get_name() for frame in changed))
+    for frame in changed:
+        context.frame_cache.invalidate_frame(frame.get_id())
+    # Only the changed frames are read from GIMP again
+    update_preview(context)
+    return GLib.SOURCE_CONTINUE
+
+def update_cache_limit(_: Gtk.Widget, cache_limit_entry, context: PluginContext):
+    context.frame_cache.set_memory_limit(int(cache_limit_entry.get_text()) * 1024 * 1024)
+    start_prerender(context)
+
+def update_group_combo(combo: Gtk.ComboBoxText, names: list[str], active_name: str | None):
+    combo.remove_all()
+    for name in names:
+        combo.append_text(name)
+    if active_name in names:
+        combo.set_active(names.index(active_name))
+
+def refresh_frames(_: Gtk.Widget, context: PluginContext):
+    # Everything is read from the image again, groups and frames may have been added or removed
+    context.layer_groups = get_layer_groups(context.image_ref)
+    context.layer_group_names = [group.get_name() for group in context.layer_groups]
+    context.top_level_ids = [layer.get_id() for layer in context.image_ref.get_layers()]
+    group_ids = [group.get_id() for group in context.layer_groups]
+    context.group_frames.clear()
+    context.compare_groups = [group for group in context.compare_groups if group.get_id() in group_ids]
+    context.frame_cache.invalidate()
+    context.change_poller.forget()
+    context.prerender_queue = []
+
+    if context.active_layer_group is not None and context.active_layer_group.get_id() not in group_ids:
+        # Played group was removed, nothing is shown until another one is picked
+        context.active_layer_group = None
+        context.active_frames = []
+        context.active_frame_names = []
+        stop_playback(None, context)
+        context.gtk_ctx.current_frame_label.set_text("")
+        context.gtk_ctx.preview_box.queue_draw()
+    elif context.active_layer_group is not None:
+        context.active_layer_group = context.layer_groups[group_ids.index(context.active_layer_group.get_id())]
+
+    active_name = context.active_layer_group.get_name() if context.active_layer_group is not None else None
+    update_group_combo(context.gtk_ctx.layer_combo, context.layer_group_names, active_name)
+    update_group_combo(context.gtk_ctx.compare_combo, context.layer_group_names, None)
+    if context.active_layer_group is None:
+        return
+
+    load_active_frames(context)
+    start_prerender(context)
+    context.playback.frame_count = len(context.active_frames)
+    context.playback.set_frame_counter(context.playback.frame_counter)
+    update_preview(context)
 
 def active_layer_changed(widget, fps_entry, context: PluginContext):
     active_layer_name = widget.get_active_text()
     if active_layer_name:
         for layer in context.layer_groups:
+            # Group list was only read again, the played group stays as it is
+            if context.active_layer_group is not None and layer.get_id() == context.active_layer_group.get_id():
+                continue
+
             if layer.get_name() == active_layer_name:
+                stop_playback(None, context)
                 context.active_layer_group = layer
-                context.playback = Playback(len(layer.get_children()))
+                load_active_frames(context)
+                context.playback = Playback(len(context.active_frames))
                 update_fps(None, fps_entry, context)
-    
-    if context.zoom_level == -1.0:
-        context.zoom_level = 128.0 / context.active_layer_group.get_width()
 
-    update_preview(context, force=True)
+    if context.active_layer_group is None:
+        return
+
+    update_preview(context)
+
+def preview_mode_changed(widget, context: PluginContext):
+    context.preview_mode = widget.get_active_text()
+    # Compared clips are prerendered right after the played one
+    start_prerender(context)
+    update_preview(context)
+
+def update_onion_skin(_: Gtk.Widget, frames_entry, opacity_entry, context: PluginContext):
+    context.onion_skin_frames = max(1, int(frames_entry.get_text()))
+    context.onion_skin_opacity = min(100, max(0, int(opacity_entry.get_text()))) / 100
+    update_preview(context)
+
+def add_compare_group(_: Gtk.Widget, compare_combo, context: PluginContext):
+    group_name = compare_combo.get_active_text()
+    for group in context.layer_groups:
+        if group.get_name() == group_name and group.get_id() not in [compared.get_id() for compared in context.compare_groups]:
+            context.compare_groups.append(group)
+    start_prerender(context)
+    update_preview(context)
+
+def clear_compare_groups(_: Gtk.Widget, context: PluginContext):
+    context.compare_groups = []
+    update_preview(context)
 
-def pick_file():
-    log("DEBUG: Opening file chooser dialog for export.")
+def pick_file(action: Gtk.FileChooserAction = Gtk.FileChooserAction.SAVE):
+    instrumentation.debug("Opening file chooser dialog for export.")
     dialog = Gtk.FileChooserDialog(
-        title="Save As",
+        title="Save As" if action == Gtk.FileChooserAction.SAVE else "Export To",
         parent=None,
-        action=Gtk.FileChooserAction.SAVE,
+        action=action,
         buttons=(
             Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
             Gtk.STOCK_SAVE, Gtk.ResponseType.OK
@@ -265,52 +672,41 @@ def pick_file():
     response = dialog.run()
     filename = dialog.get_filename() if response == Gtk.ResponseType.OK else None
     dialog.destroy()
-    log(f"DEBUG: File chooser dialog closed. Selected filename: {filename}")
+    instrumentation.debug("File chooser dialog closed. Selected filename: %s", filename)
     return filename
 
-def export_clip_to_webp(widget, context: PluginContext):
-    log("DEBUG: Starting export_clip_to_webp.")
-    out_filename = pick_file()
-    if out_filename is None:
-        log("DEBUG: No filename selected, aborting export.")
-        return
+def get_frame_pixels(pixbuf: GdkPixbuf.Pixbuf) -> bytes:
+    # Rows of a pixbuf may be padded
+    pixels = pixbuf.read_pixel_bytes().get_data()
+    stride = pixbuf.get_rowstride()
+    row_size = pixbuf.get_width() * BYTES_PER_PIXEL
+    if stride == row_size:
+        return pixels
 
-    if not out_filename.lower().endswith(".webp"):
-        out_filename += ".webp"
-        log(f"DEBUG: Appended .webp extension. New filename: {out_filename}")
+    view = memoryview(pixels)
+    return b"".join(view[row * stride:row * stride + row_size] for row in range(pixbuf.get_height()))
 
-    active_layer = context.active_layer_group
-    playback = context.playback
-    zoom_level = context.zoom_level
-    image = context.image_ref
+def export_frames_to_webp(filename: str, frames: list[GdkPixbuf.Pixbuf], fps: int):
+    if fps < 1:
+        raise ValueError(f"Invalid FPS: {fps}")
 
-    log(f"DEBUG: Creating output image with size ({int(image.get_width() * zoom_level)}, {int(image.get_height() * zoom_level)})")
-    out_img = Gimp.Image.new(
-        int(image.get_width() * zoom_level),
-        int(image.get_height() * zoom_level),
-        image.get_base_type()
-    )
+    # There is no WEBP encoder outside of GIMP, so cached frames are copied straight into the layers of an export image
+    (width, height) = (frames[0].get_width(), frames[0].get_height())
+    out_img = Gimp.Image.new(width, height, Gimp.ImageBaseType.RGB)
     out_img.undo_disable()
 
-    for i, frame in enumerate(reversed(active_layer.get_children())):
-        log(f"DEBUG: Processing frame {i}: {frame.get_name()}")
-        temp_layer = Gimp.Layer.new_from_drawable(frame, out_img)
-        if len(temp_layer.get_children()) == 0:
-            temp_layer.add_alpha()
-        temp_layer.set_visible(True)
-        out_img.insert_layer(temp_layer, None, 0)
-        temp_layer.scale(
-            int(image.get_width() * zoom_level),
-            int(image.get_height() * zoom_level),
-            False
-        )
+    for (idx, frame) in enumerate(frames):
+        layer = Gimp.Layer.new(out_img, f"frame_{idx}", width, height, Gimp.ImageType.RGBA_IMAGE, 100, Gimp.LayerMode.NORMAL)
+        out_img.insert_layer(layer, None, 0)
+        buffer = layer.get_buffer()
+        buffer.set(Gegl.Rectangle.new(0, 0, width, height), FRAME_FORMAT, get_frame_pixels(frame))
+        buffer.flush()
 
-    log(f"DEBUG: Calling file-webp-save procedure. {out_filename}")
     ProcedureHelper.call_pdb_procedure(
         "file-webp-export",
         [
             ("image", out_img),
-            ("file", Gio.File.new_for_path(out_filename)),
+            ("file", Gio.File.new_for_path(filename)),
             ("options", None),
             ("preset", "default"),
             ("lossless", True),
@@ -325,10 +721,81 @@ def export_clip_to_webp(widget, context: PluginContext):
             ("include-iptc", False),
             ("include-xmp", False),
             ("include-thumbnail", True),
-            ("default-delay", int(1000.0 / playback.fps)),
+            ("default-delay", int(1000.0 / fps)),
             ("force-delay", True)
         ])
-    log("DEBUG: Export to WEBP completed.")
+    out_img.delete()
+
+def export_frames(filename: str, export_format: str, frames: list[GdkPixbuf.Pixbuf], fps: int):
+    if export_format == "WEBP":
+        export_frames_to_webp(filename, frames, fps)
+        return
+
+    (width, height) = (frames[0].get_width(), frames[0].get_height())
+    if export_format == "GIF":
+        writer = GifWriter(filename, width, height, fps)
+    else:
+        writer = ApngWriter(filename, width, height, len(frames), fps)
+
+    for frame in frames:
+        writer.write_frame(get_frame_pixels(frame))
+    writer.close()
+
+def get_export_format(context: PluginContext) -> str:
+    return context.gtk_ctx.export_format_combo.get_active_text()
+
+def export_clip(widget, context: PluginContext):
+    if len(context.active_frames) == 0:
+        return
+
+    out_filename = pick_file()
+    if out_filename is None:
+        instrumentation.debug("No filename selected, aborting export.")
+        return
+
+    export_format = get_export_format(context)
+    extension = EXPORT_FORMATS[export_format]
+    if not out_filename.lower().endswith(extension):
+        out_filename += extension
+
+    # Frames are already scaled to the current zoom in the cache
+    export_frames(out_filename,
+                  export_format,
+                  [get_cached_frame(frame, context) for frame in context.active_frames],
+                  context.playback.fps)
+    instrumentation.debug("Exported %s", out_filename)
+
+def get_clip_filenames(names: list[str]) -> list[str]:
+    # Group names can repeat or contain path separators, every clip needs its own file within the directory.
+    # Names are compared case-insensitively for case-insensitive file systems
+    filenames = []
+    used_filenames = set()
+    for name in names:
+        stem = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name).strip(" .") or "clip"
+        filename = stem
+        suffix = 1
+        while filename.lower() in used_filenames:
+            filename = f"{stem}-{suffix}"
+            suffix += 1
+        used_filenames.add(filename.lower())
+        filenames.append(filename)
+    return filenames
+
+def export_all_clips(widget, context: PluginContext):
+    directory = pick_file(Gtk.FileChooserAction.SELECT_FOLDER)
+    if directory is None:
+        return
+
+    export_format = get_export_format(context)
+    filenames = get_clip_filenames([group.get_name() for group in context.layer_groups])
+    for (group, filename) in zip(context.layer_groups, filenames):
+        frames = [context.frame_cache.get_frame(frame, context.zoom_level) for frame in get_group_frames(group, context)]
+        if len(frames) == 0:
+            continue
+
+        export_frames(os.path.join(directory, filename + EXPORT_FORMATS[export_format]), export_format, frames, context.playback.fps)
+
+    instrumentation.debug("Exported %d clips to %s", len(context.layer_groups), directory)
 
 def animation_preview_run(procedure, run_mode, image, drawables, config, data):
     if run_mode != Gimp.RunMode.INTERACTIVE:
@@ -339,7 +806,7 @@ def animation_preview_run(procedure, run_mode, image, drawables, config, data):
     
     context.gtk_ctx.window = GtkBuilder.create_window(plug_in_name)
     context.gtk_ctx.window.connect("destroy", lambda w: Gtk.main_quit())
-    context.gtk_ctx.window.set_default_size(400, 660)
+    context.gtk_ctx.window.set_default_size(400, 760)
     window_box = GtkBuilder.create_vbox(context.gtk_ctx.window)
     current_layer_show_box = GtkBuilder.create_hbox(window_box, False)
     GtkBuilder.create_label("Current Layer:", current_layer_show_box)
@@ -361,6 +828,9 @@ def animation_preview_run(procedure, run_mode, image, drawables, config, data):
     next_btn.connect("clicked", next_frame, context)
 
     context.gtk_ctx.display_box = GtkBuilder.create_hbox(window_box, True)
+    context.gtk_ctx.preview_box = Gtk.DrawingArea.new()
+    context.gtk_ctx.preview_box.connect("draw", draw_preview, context)
+    context.gtk_ctx.display_box.pack_start(context.gtk_ctx.preview_box, True, True, 0)
 
     bottom_controls_box = GtkBuilder.create_hbox(window_box, False)
     labels_vbox = GtkBuilder.create_vbox(bottom_controls_box, 10)
@@ -393,19 +863,74 @@ def animation_preview_run(procedure, run_mode, image, drawables, config, data):
     update_fps_btn = GtkBuilder.create_button("Update FPS", fps_controls_box)
     update_fps_btn.connect("clicked", update_fps, fps_entry, context)
 
+    cache_limit_label_box = GtkBuilder.create_hbox(labels_vbox, True)
+    cache_limit_box = GtkBuilder.create_hbox(controls_vbox, False)
+    GtkBuilder.create_label("Cache (MB):", cache_limit_label_box)
+
+    cache_limit_entry = GtkBuilder.create_value_input(DEFAULT_CACHE_LIMIT_MB, cache_limit_box)
+
+    update_cache_limit_btn = GtkBuilder.create_button("Update Cache", cache_limit_box)
+    update_cache_limit_btn.connect("clicked", update_cache_limit, cache_limit_entry, context)
+
+    measured_fps_label_box = GtkBuilder.create_hbox(labels_vbox, True)
+    measured_fps_box = GtkBuilder.create_hbox(controls_vbox, False)
+    GtkBuilder.create_label("Measured FPS:", measured_fps_label_box)
+    context.gtk_ctx.fps_label = GtkBuilder.create_label("", measured_fps_box)
+
     layer_label_box = GtkBuilder.create_hbox(labels_vbox, True)
     layer_select_box = GtkBuilder.create_hbox(controls_vbox, False)
     GtkBuilder.create_label("Group to play:", layer_label_box)
 
-    layer_combo = GtkBuilder.create_combo(context.layer_group_names, layer_select_box)
-    layer_combo.connect("changed", active_layer_changed, fps_entry, context)
+    context.gtk_ctx.layer_combo = GtkBuilder.create_combo(context.layer_group_names, layer_select_box)
+    context.gtk_ctx.layer_combo.connect("changed", active_layer_changed, fps_entry, context)
+
+    mode_label_box = GtkBuilder.create_hbox(labels_vbox, True)
+    mode_box = GtkBuilder.create_hbox(controls_vbox, False)
+    GtkBuilder.create_label("Mode:", mode_label_box)
+
+    mode_combo = GtkBuilder.create_combo(PreviewMode.get_string_annotations(), mode_box)
+    mode_combo.set_active(0)
+    mode_combo.connect("changed", preview_mode_changed, context)
+
+    onion_skin_label_box = GtkBuilder.create_hbox(labels_vbox, True)
+    onion_skin_box = GtkBuilder.create_hbox(controls_vbox, False)
+    GtkBuilder.create_label("Onion skin (frames, %):", onion_skin_label_box)
+
+    onion_skin_frames_entry = GtkBuilder.create_value_input(DEFAULT_ONION_SKIN_FRAMES, onion_skin_box)
+    onion_skin_opacity_entry = GtkBuilder.create_value_input(DEFAULT_ONION_SKIN_OPACITY, onion_skin_box)
+
+    update_onion_skin_btn = GtkBuilder.create_button("Update Onion Skin", onion_skin_box)
+    update_onion_skin_btn.connect("clicked", update_onion_skin, onion_skin_frames_entry, onion_skin_opacity_entry, context)
+
+    compare_label_box = GtkBuilder.create_hbox(labels_vbox, True)
+    compare_box = GtkBuilder.create_hbox(controls_vbox, False)
+    GtkBuilder.create_label("Side by side with:", compare_label_box)
+
+    context.gtk_ctx.compare_combo = GtkBuilder.create_combo(context.layer_group_names, compare_box)
+
+    add_compare_btn = GtkBuilder.create_button("Add", compare_box)
+    add_compare_btn.connect("clicked", add_compare_group, context.gtk_ctx.compare_combo, context)
+
+    clear_compare_btn = GtkBuilder.create_button("Clear", compare_box)
+    clear_compare_btn.connect("clicked", clear_compare_groups, context)
 
     export_btn_box = GtkBuilder.create_hbox(window_box, False)
-    export_btn = GtkBuilder.create_button("Export WEBP", export_btn_box)
-    export_btn.connect("clicked", export_clip_to_webp, context)
+    context.gtk_ctx.export_format_combo = GtkBuilder.create_combo(list(EXPORT_FORMATS), export_btn_box)
+    context.gtk_ctx.export_format_combo.set_active(0)
+
+    export_btn = GtkBuilder.create_button("Export", export_btn_box)
+    export_btn.connect("clicked", export_clip, context)
+
+    export_all_btn = GtkBuilder.create_button("Export All", export_btn_box)
+    export_all_btn.connect("clicked", export_all_clips, context)
+
+    refresh_btn = GtkBuilder.create_button("Refresh", export_btn_box)
+    refresh_btn.connect("clicked", refresh_frames, context)
 
     context.gtk_ctx.window.show_all()
+    poll_source_id = GLib.timeout_add(change_detection.POLL_INTERVAL_MS, poll_changes, context)
     Gtk.main()
+    GLib.source_remove(poll_source_id)
 
     return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
@@ -420,7 +945,7 @@ class AnimationPreview (Gimp.PlugIn):
         procedure = Gimp.ImageProcedure.new(self,
                                             name,
                                             Gimp.PDBProcType.PLUGIN,
-                                            animation_preview_run,
+                                            instrumentation.instrument_run(plug_in_name, animation_preview_run),
                                             None)
 
         procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.DRAWABLE |
@@ -432,4 +957,5 @@ class AnimationPreview (Gimp.PlugIn):
 
         return procedure
 
-Gimp.main(AnimationPreview.__gtype__, sys.argv)
+if __name__ == "__main__":
+    Gimp.main(AnimationPreview.__gtype__, sys.argv)
@@ -0,0 +1,172 @@
+# Animated GIF and APNG writers, independent of GIMP.
+#
+# Frames are streamed to the file one by one as tightly packed RGBA rows, so an export holds at most
+# one encoded frame in memory.
+
+import struct
+import zlib
+from array import array
+
+BYTES_PER_PIXEL = 4
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Bits kept from every channel when a GIF frame has too many colors for its palette
+GIF_QUANTIZATION_MASKS = [0xFFFFFF, 0xFEFEFE, 0xFCFCFC, 0xF8F8F8, 0xF0F0F0, 0xE0E0E0, 0xC0C0C0]
+
+class ApngWriter:
+    def __init__(self, filename: str, width: int, height: int, frame_count: int, fps: int):
+        # Frame delay is stored as 1 / fps seconds with a 16 bit denominator
+        if fps < 1 or fps > 0xFFFF:
+            raise ValueError(f"Invalid FPS: {fps}")
+
+        self.fp = open(filename, "wb")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.sequence_number = 0
+        self.fp.write(PNG_SIGNATURE)
+        # 8 bits per channel, RGBA, default compression, filtering and no interlacing
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        # Loops forever
+        self.write_chunk(b"acTL", struct.pack(">II", frame_count, 0))
+
+    def write_chunk(self, tag: bytes, data: bytes):
+        self.fp.write(struct.pack(">I", len(data)))
+        self.fp.write(tag)
+        self.fp.write(data)
+        self.fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def write_frame(self, pixels: bytes):
+        # Every frame covers the whole canvas and replaces the previous one
+        self.write_chunk(b"fcTL", struct.pack(">IIIIIHHBB",
+                                              self.sequence_number,
+                                              self.width,
+                                              self.height,
+                                              0,
+                                              0,
+                                              1,
+                                              self.fps,
+                                              1,
+                                              0))
+        self.sequence_number += 1
+
+        stride = self.width * BYTES_PER_PIXEL
+        view = memoryview(pixels)
+        scanlines = bytearray()
+        for row in range(self.height):
+            scanlines.append(0) # No filter
+            scanlines += view[row * stride:(row + 1) * stride]
+        data = zlib.compress(scanlines, 6)
+
+        # First frame is also the default image for viewers without APNG support
+        if self.sequence_number == 1:
+            self.write_chunk(b"IDAT", data)
+        else:
+            self.write_chunk(b"fdAT", struct.pack(">I", self.sequence_number) + data)
+            self.sequence_number += 1
+
+    def close(self):
+        self.write_chunk(b"IEND", b"")
+        self.fp.close()
+
+def get_gif_palette(pixels: bytes) -> tuple[list[int], bytes]:
+    # Pixels as 0xAABBGGRR, everything less than half transparent becomes the transparent index 0
+    values = array("I", pixels)
+    colors = [value & 0xFFFFFF if value >= 0x80000000 else -1 for value in values]
+    for mask in GIF_QUANTIZATION_MASKS:
+        quantized = colors if mask == 0xFFFFFF else [color & mask if color >= 0 else -1 for color in colors]
+        palette = sorted(set(quantized) - { -1 })
+        if len(palette) <= 255:
+            break
+
+    indices = { color: idx + 1 for (idx, color) in enumerate(palette) }
+    indices[-1] = 0
+    return ([0] + palette, bytes(indices[color] for color in quantized))
+
+def lzw_encode(indices: bytes, min_code_size: int) -> bytes:
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    code_size = min_code_size + 1
+    next_code = end_code + 1
+    table: dict[int, int] = {}
+
+    out = bytearray()
+    bits = 0
+    bit_count = 0
+
+    def emit(code: int):
+        nonlocal bits, bit_count
+        bits |= code << bit_count
+        bit_count += code_size
+        while bit_count >= 8:
+            out.append(bits & 0xFF)
+            bits >>= 8
+            bit_count -= 8
+
+    emit(clear_code)
+    prefix = indices[0]
+    for index in indices[1:]:
+        key = (prefix << 8) | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        emit(prefix)
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:
+            emit(clear_code)
+            table.clear()
+            code_size = min_code_size + 1
+            next_code = end_code + 1
+        prefix = index
+
+    emit(prefix)
+    emit(end_code)
+    if bit_count > 0:
+        out.append(bits & 0xFF)
+    return bytes(out)
+
+class GifWriter:
+    def __init__(self, filename: str, width: int, height: int, fps: int):
+        if fps < 1:
+            raise ValueError(f"Invalid FPS: {fps}")
+
+        self.fp = open(filename, "wb")
+        self.width = width
+        self.height = height
+        # GIF delays are in hundredths of a second
+        self.delay = max(1, round(100 / fps))
+        self.fp.write(b"GIF89a")
+        self.fp.write(struct.pack("<HHBBB", width, height, 0, 0, 0))
+        # Loops forever
+        self.fp.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+
+    def write_frame(self, pixels: bytes):
+        # Every frame has its own palette, so frames don't have to be known upfront
+        (palette, indices) = get_gif_palette(pixels)
+        table_bits = max(1, (len(palette) - 1).bit_length())
+
+        # Restore to background after the frame, transparent pixels must not show the previous frame
+        self.fp.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, (2 << 2) | 1, self.delay, 0, 0))
+        self.fp.write(struct.pack("<BHHHHB", 0x2C, 0, 0, self.width, self.height, 0x80 | (table_bits - 1)))
+        color_table = bytearray()
+        for color in palette + [0] * ((1 << table_bits) - len(palette)):
+            color_table += bytes([color & 0xFF, (color >> 8) & 0xFF, (color >> 16) & 0xFF])
+        self.fp.write(color_table)
+
+        min_code_size = max(2, table_bits)
+        data = lzw_encode(indices, min_code_size)
+        self.fp.write(bytes([min_code_size]))
+        for start in range(0, len(data), 255):
+            block = data[start:start + 255]
+            self.fp.write(bytes([len(block)]))
+            self.fp.write(block)
+        self.fp.write(b"\x00")
+
+    def close(self):
+        self.fp.write(b"\x3b")
+        self.fp.close()
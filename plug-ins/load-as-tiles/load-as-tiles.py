@@ -8,9 +8,19 @@ gi.require_version('GimpUi', '3.0')
 from gi.repository import GimpUi
 from gi.repository import GObject
 from gi.repository import GLib
+from gi.repository import Gio
 from gi.repository import Gtk
 from gi.repository import Gegl
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf
 import sys
+import os
+import json
+import hashlib
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pixel-art-common"))
+import instrumentation
 
 plug_in_proc = "plug-in-nerudaj-load-as-tiles"
 plug_in_binary = "py3-load-as-tiles"
@@ -20,6 +30,13 @@ plug_in_year = "2025"
 plug_in_docs = "Load an image and break it into tiles"
 plug_in_name = "Load as tiles"
 plug_in_path = "<Image>/Pixel Art"
+plug_in_annotations_proc = "plug-in-nerudaj-load-from-annotations"
+plug_in_annotations_docs = "Load a spritesheet / tilesheet exported by Spritesheetize back into layers and groups"
+plug_in_annotations_name = "Load from annotations"
+
+TILE_FORMAT = "R'G'B'A u8"
+BYTES_PER_PIXEL = 4
+TILE_WRITE_BATCH = 64
 
 def log(message: str):
     proc = Gimp.get_pdb().lookup_procedure("gimp-message")
@@ -41,7 +58,14 @@ def create_dialog_with_all_procedure_params(procedure, config):
     dialog.fill_frame("dimensions-frame", "frame-width", False, "frame-box")
     dialog.fill_frame("dimensions-offset", "xoffset", False, "offset-box")
     dialog.fill_frame("dimensions-spacing", "xspacing", False, "spacing-box")
-    dialog.fill(["infile", "dimensions-frame", "dimensions-offset", "dimensions-spacing"])
+    dialog.fill(["infile",
+                 "dimensions-frame",
+                 "dimensions-offset",
+                 "dimensions-spacing",
+                 "skip-empty",
+                 "skip-duplicates",
+                 "report",
+                 "disable-undo"])
 
     if not dialog.run():
         dialog.destroy()
@@ -72,6 +96,366 @@ def copy_area_between_images(source_image: Gimp.Image, destination_image: Gimp.I
         Gimp.floating_sel_attach(sl, layer)
         Gimp.floating_sel_remove(sl)
 
+def get_tile_rects(in_w: int,
+                   in_h: int,
+                   framew: int,
+                   frameh: int,
+                   xoffset: int,
+                   yoffset: int,
+                   xspacing: int,
+                   yspacing: int) -> list[Gegl.Rectangle]:
+    rects = []
+    y = yoffset
+    while y < in_h:
+        x = xoffset
+        while x < in_w:
+            rects.append(Gegl.Rectangle.new(x, y, framew, frameh))
+            x = x + framew + xspacing
+        y = y + frameh + yspacing
+    return rects
+
+def load_tiles_with_clipboard(input_image: Gimp.Image, image: Gimp.Image, rects: list[Gegl.Rectangle]):
+    for (idx, rect) in enumerate(rects):
+        copy_area_between_images(input_image, image, rect, f"layer_{idx}")
+
+def get_tile_layer_type(image: Gimp.Image) -> Gimp.ImageType:
+    if image.get_base_type() == Gimp.ImageBaseType.GRAY:
+        return Gimp.ImageType.GRAYA_IMAGE
+    elif image.get_base_type() == Gimp.ImageBaseType.INDEXED:
+        return Gimp.ImageType.INDEXEDA_IMAGE
+    return Gimp.ImageType.RGBA_IMAGE
+
+def is_empty_tile(tile: bytes) -> bool:
+    return not any(tile[3::BYTES_PER_PIXEL])
+
+class TileSource:
+    def __init__(self, width: int, height: int, pixels: memoryview, stride: int):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+        self.stride = stride
+
+def get_tile_source_from_image(image: Gimp.Image) -> TileSource:
+    layer = image.get_layers()[0]
+    (_, x, y) = layer.get_offsets()
+    width = image.get_width()
+    height = image.get_height()
+
+    # Read in image coordinates, areas not covered by the layer come out transparent
+    pixels = layer.get_buffer().get(Gegl.Rectangle.new(-x, -y, width, height),
+                                    1.0,
+                                    TILE_FORMAT,
+                                    Gegl.AbyssPolicy.NONE)
+    return TileSource(width, height, memoryview(pixels), width * BYTES_PER_PIXEL)
+
+def get_tile_source_from_pixbuf(pixbuf: GdkPixbuf.Pixbuf) -> TileSource:
+    if not pixbuf.get_has_alpha():
+        pixbuf = pixbuf.add_alpha(False, 0, 0, 0)
+
+    return TileSource(pixbuf.get_width(),
+                      pixbuf.get_height(),
+                      memoryview(pixbuf.read_pixel_bytes().get_data()),
+                      pixbuf.get_rowstride())
+
+def load_tile_source(infile: Gio.File) -> TileSource | None:
+    # PNG and other formats known to GdkPixbuf are decoded straight to memory,
+    # without creating a whole GIMP image with its own undo and tile cache
+    path = infile.get_path()
+    if path is not None:
+        try:
+            return get_tile_source_from_pixbuf(GdkPixbuf.Pixbuf.new_from_file(path))
+        except GLib.Error:
+            pass
+
+    input_image = Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, infile)
+    if input_image is None:
+        return None
+
+    source = get_tile_source_from_image(input_image)
+    input_image.delete()
+    return source
+
+def get_tile_pixels(source: TileSource, rect: Gegl.Rectangle) -> tuple[tuple[int, int, int, int], bytes]:
+    # Parts of the tile outside of the source stay transparent
+    left = max(rect.x, 0)
+    top = max(rect.y, 0)
+    right = min(rect.x + rect.width, source.width)
+    bottom = min(rect.y + rect.height, source.height)
+    if right <= left or bottom <= top:
+        return ((0, 0, 0, 0), b"")
+
+    row_start = left * BYTES_PER_PIXEL
+    row_size = (right - left) * BYTES_PER_PIXEL
+    stride = source.stride
+    pixels = source.pixels
+    tile = b"".join(pixels[row * stride + row_start:row * stride + row_start + row_size]
+                    for row in range(top, bottom))
+    return ((left - rect.x, top - rect.y, right - left, bottom - top), tile)
+
+class TileWriter:
+    # Written buffers are flushed in batches, so that only a batch of them is held in memory
+    def __init__(self, batch_size: int = TILE_WRITE_BATCH):
+        self.batch_size = batch_size
+        self.written: list[tuple[Gimp.Layer, Gegl.Buffer, tuple[int, int, int, int]]] = []
+
+    def write(self, layer: Gimp.Layer, area: tuple[int, int, int, int], tile: bytes):
+        if len(tile) == 0:
+            return
+
+        buffer = layer.get_buffer()
+        buffer.set(Gegl.Rectangle.new(*area), TILE_FORMAT, tile)
+        self.written.append((layer, buffer, area))
+        if len(self.written) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for (layer, buffer, area) in self.written:
+            buffer.flush()
+            # Only invalidates the projection, displays are flushed once at the end of the import
+            layer.update(area[0], area[1], area[2], area[3])
+        self.written.clear()
+
+def load_tiles(source: TileSource,
+               image: Gimp.Image,
+               rects: list[Gegl.Rectangle],
+               skip_empty: bool = False,
+               skip_duplicates: bool = False) -> list[str | None]:
+    layer_type = get_tile_layer_type(image)
+
+    # Name of the layer every cell ended up in, None for skipped empty cells
+    cell_layers: list[str | None] = []
+    layer_by_hash: dict[tuple[int, int, int, int, str], str] = {}
+    writer = TileWriter()
+
+    for (idx, rect) in enumerate(rects):
+        (area, tile) = get_tile_pixels(source, rect)
+        if skip_empty and is_empty_tile(tile):
+            cell_layers.append(None)
+            continue
+
+        layer_name = f"layer_{idx}"
+        if skip_duplicates:
+            # Clipped edge tiles only match identically clipped ones
+            tile_hash = (*area, hashlib.blake2b(tile, digest_size=16).hexdigest())
+            if tile_hash in layer_by_hash:
+                cell_layers.append(layer_by_hash[tile_hash])
+                continue
+            layer_by_hash[tile_hash] = layer_name
+        cell_layers.append(layer_name)
+
+        layer = Gimp.Layer.new(image,
+                               layer_name,
+                               rect.width,
+                               rect.height,
+                               layer_type,
+                               100,
+                               Gimp.LayerMode.NORMAL)
+        image.insert_layer(layer, None, 0)
+        writer.write(layer, area, tile)
+
+    writer.flush()
+    return cell_layers
+
+def downscale_tile(tile: bytes, width: int, factor: int) -> bytes:
+    # Upscaled sheets repeat every pixel factor times in both directions, so one of each is kept
+    pixels = memoryview(tile).cast("I")
+    return b"".join(pixels[row * width:(row + 1) * width:factor].tobytes()
+                    for row in range(0, len(pixels) // width, factor))
+
+def write_mapping_report(filename: str, rects: list[Gegl.Rectangle], cell_layers: list[str | None]):
+    report = {
+        "cells": [{ "x": rect.x, "y": rect.y, "width": rect.width, "height": rect.height, "layer": layer }
+                  for (rect, layer) in zip(rects, cell_layers)],
+        "layerCount": len(set(filter(lambda x: x is not None, cell_layers))),
+        "emptyCount": cell_layers.count(None)
+    }
+    fp = open(filename, "wt")
+    json.dump(report, fp, indent=4)
+    fp.close()
+
+class AnnotatedFrame:
+    def __init__(self,
+                 name: str,
+                 page: int,
+                 bounds: Gegl.Rectangle | None,
+                 offset: tuple[int, int],
+                 skip_empty: bool = False):
+        self.name = name
+        self.page = page
+        self.bounds = bounds
+        self.offset = offset
+        self.skip_empty = skip_empty
+
+class AnnotatedGroup:
+    def __init__(self, name: str, frames: list[AnnotatedFrame]):
+        self.name = name
+        self.frames = frames
+
+def get_json_rect(bounds: dict) -> Gegl.Rectangle:
+    return Gegl.Rectangle.new(bounds["left"], bounds["top"], bounds["width"], bounds["height"])
+
+def get_json_offset(offset: dict) -> tuple[int, int]:
+    return (offset["horizontal"], offset["vertical"])
+
+def get_json_spacing(spacing: dict) -> tuple[int, int]:
+    # Older exports stored spacing as width / height
+    return (spacing.get("horizontal", spacing.get("width", 0)), spacing.get("vertical", spacing.get("height", 0)))
+
+def get_json_upscale(annotation: dict) -> int:
+    # Older exports did not record the upscale factor
+    return max(1, annotation.get("upscale", 1))
+
+def get_annotated_tiles(annotation: dict, frame_size: tuple[int, int]) -> list[AnnotatedFrame]:
+    if "tiles" in annotation:
+        return [AnnotatedFrame(tile["name"],
+                               tile.get("page", 0),
+                               get_json_rect(tile["bounds"]),
+                               get_json_offset(tile["offset"])) for tile in annotation["tiles"]]
+
+    # Plain grid, tile count is not known so every non-empty cell of the bounds is a tile
+    (framew, frameh) = frame_size
+    (xspacing, yspacing) = get_json_spacing(annotation["spacing"])
+    bounds = get_json_rect(annotation["bounds"])
+    columns = (bounds.width + xspacing) // (framew + xspacing)
+    rows = (bounds.height + yspacing) // (frameh + yspacing)
+    return [AnnotatedFrame(f"layer_{row * columns + column}",
+                           0,
+                           Gegl.Rectangle.new(bounds.x + column * (framew + xspacing),
+                                              bounds.y + row * (frameh + yspacing),
+                                              framew,
+                                              frameh),
+                           (0, 0),
+                           True) for row in range(rows) for column in range(columns)]
+
+def get_annotated_states(annotation: dict, frame_size: tuple[int, int]) -> list[AnnotatedGroup]:
+    (framew, frameh) = frame_size
+    groups: list[AnnotatedGroup] = []
+    for state in annotation["states"]:
+        name = state["name"]
+        if "frames" in state:
+            # Optimized spritesheet, frames reference deduplicated and trimmed atlas cells
+            frames = []
+            for (idx, reference) in enumerate(state["frames"]):
+                if reference["index"] < 0:
+                    frames.append(AnnotatedFrame(f"{name}_{idx}", 0, None, (0, 0)))
+                    continue
+
+                cell = annotation["frames"][reference["index"]]
+                frames.append(AnnotatedFrame(f"{name}_{idx}",
+                                             cell.get("page", 0),
+                                             get_json_rect(cell),
+                                             get_json_offset(reference["offset"])))
+        else:
+            (xspacing, _) = get_json_spacing(annotation["defaults"]["spacing"])
+            bounds = get_json_rect(state["bounds"])
+            frames = [AnnotatedFrame(f"{name}_{idx}",
+                                     state.get("page", 0),
+                                     Gegl.Rectangle.new(bounds.x + idx * (framew + xspacing), bounds.y, framew, frameh),
+                                     (0, 0)) for idx in range(state["nframes"])]
+        groups.append(AnnotatedGroup(name, frames))
+    return groups
+
+def get_annotated_page_files(annotation_file: Gio.File, annotation: dict) -> list[Gio.File]:
+    if "pages" in annotation:
+        directory = annotation_file.get_parent()
+        return [directory.get_child(page) for page in annotation["pages"]]
+
+    # Annotations are named after the atlas, spritesheet.png.anim
+    (atlas, _) = os.path.splitext(annotation_file.get_path())
+    return [Gio.File.new_for_path(atlas)]
+
+def load_annotations(image: Gimp.Image, annotation_file: Gio.File) -> str | None:
+    try:
+        fp = open(annotation_file.get_path(), "rt")
+        annotation = json.load(fp)
+        fp.close()
+
+        if "defaults" in annotation:
+            sheet_frame_size = (annotation["defaults"]["frame"]["width"], annotation["defaults"]["frame"]["height"])
+            upscale = get_json_upscale(annotation["defaults"])
+            items = get_annotated_states(annotation, sheet_frame_size)
+        else:
+            sheet_frame_size = (annotation["frame"]["width"], annotation["frame"]["height"])
+            upscale = get_json_upscale(annotation)
+            items = get_annotated_tiles(annotation, sheet_frame_size)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return f"Could not read annotations {annotation_file.get_path()}: {e}"
+
+    # Annotations describe the upscaled sheet, layers get the original frame size
+    frame_size = (sheet_frame_size[0] // upscale, sheet_frame_size[1] // upscale)
+
+    # Canvas is only ever grown, content of the open image must not be cropped
+    if image.get_width() < frame_size[0] or image.get_height() < frame_size[1]:
+        image.resize(max(image.get_width(), frame_size[0]), max(image.get_height(), frame_size[1]), 0, 0)
+
+    # Layers are created in their original order first, then filled page by page so that only
+    # one decoded page is held in memory at a time
+    layer_type = get_tile_layer_type(image)
+    frame_layers: list[tuple[Gimp.Layer, AnnotatedFrame]] = []
+
+    def create_frame_layer(frame: AnnotatedFrame, parent: Gimp.GroupLayer | None, position: int):
+        layer = Gimp.Layer.new(image,
+                               frame.name,
+                               frame_size[0],
+                               frame_size[1],
+                               layer_type,
+                               100,
+                               Gimp.LayerMode.NORMAL)
+        image.insert_layer(layer, parent, position)
+        frame_layers.append((layer, frame))
+
+    for (position, item) in enumerate(items):
+        if isinstance(item, AnnotatedGroup):
+            group = Gimp.GroupLayer.new(image, item.name)
+            image.insert_layer(group, None, position)
+            for (frame_position, frame) in enumerate(item.frames):
+                create_frame_layer(frame, group, frame_position)
+        else:
+            create_frame_layer(item, None, position)
+
+    page_files = get_annotated_page_files(annotation_file, annotation)
+    writer = TileWriter()
+    for (page_idx, page_file) in enumerate(page_files):
+        page_frames = [(layer, frame) for (layer, frame) in frame_layers
+                       if frame.page == page_idx and frame.bounds is not None]
+        if len(page_frames) == 0:
+            continue
+
+        source = load_tile_source(page_file)
+        if source is None:
+            return f"Could not load image {page_file.get_path()}"
+
+        for (layer, frame) in page_frames:
+            ((x, y, width, height), tile) = get_tile_pixels(source, frame.bounds)
+            if frame.skip_empty and is_empty_tile(tile):
+                image.remove_layer(layer)
+                continue
+
+            if upscale > 1 and len(tile) > 0:
+                tile = downscale_tile(tile, width, upscale)
+                (x, y, width, height) = (x // upscale, y // upscale, -(-width // upscale), -(-height // upscale))
+
+            writer.write(layer, (frame.offset[0] // upscale + x, frame.offset[1] // upscale + y, width, height), tile)
+
+        writer.flush()
+
+    return None
+
+@contextlib.contextmanager
+def undo_step(image: Gimp.Image, disable_undo: bool):
+    # Whole import is a single undo step, or no undo step at all with undo frozen
+    if disable_undo:
+        image.undo_freeze()
+    else:
+        image.undo_group_start()
+    try:
+        yield
+    finally:
+        if disable_undo:
+            image.undo_thaw()
+        else:
+            image.undo_group_end()
+
 def load_as_tiles_run(procedure, run_mode, image, drawables, config, data):
     if run_mode == Gimp.RunMode.INTERACTIVE:
         create_dialog_with_all_procedure_params(procedure, config)
@@ -83,45 +467,71 @@ def load_as_tiles_run(procedure, run_mode, image, drawables, config, data):
     yoffset = config.get_property("yoffset")
     xspacing = config.get_property("xspacing")
     yspacing = config.get_property("yspacing")
+    skip_empty = config.get_property("skip-empty")
+    skip_duplicates = config.get_property("skip-duplicates")
+    report_file = config.get_property("report")
+    disable_undo = config.get_property("disable-undo")
 
-    input_image = Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, infile)
+    source = load_tile_source(infile)
 
-    if input_image is None:
+    if source is None:
         return procedure.new_return_values (Gimp.PDBStatusType.CALLING_ERROR,
                                             GLib.Error(f"Could not load image {infile}"))
 
-    in_w = input_image.get_width()
-    in_h = input_image.get_height()
-    y = yoffset
-    idx = 0
-    while y < in_h:
-        x = xoffset
-        while x < in_w:
-            copy_area_between_images(input_image,
-                                     image,
-                                     Gegl.Rectangle.new(x, y, framew, frameh),
-                                     f"layer_{idx}")
+    rects = get_tile_rects(source.width,
+                           source.height,
+                           framew,
+                           frameh,
+                           xoffset,
+                           yoffset,
+                           xspacing,
+                           yspacing)
+    with undo_step(image, disable_undo):
+        cell_layers = load_tiles(source, image, rects, skip_empty, skip_duplicates)
 
-            idx = idx + 1
-            x = x + framew + xspacing
-        
-        y = y + frameh + yspacing
+    if report_file is not None:
+        write_mapping_report(report_file.get_path(), rects, cell_layers)
+
+    Gimp.displays_flush()
+    return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
+
+def load_from_annotations_run(procedure, run_mode, image, drawables, config, data):
+    if run_mode == Gimp.RunMode.INTERACTIVE:
+        GimpUi.init(plug_in_binary)
+
+        dialog = GimpUi.ProcedureDialog.new(procedure, config, plug_in_annotations_name)
+        dialog.fill(["annotations", "disable-undo"])
+
+        if not dialog.run():
+            dialog.destroy()
+            return procedure.new_return_values(Gimp.PDBStatusType.CANCEL, None)
+        else:
+            dialog.destroy()
+
+    with undo_step(image, config.get_property("disable-undo")):
+        error = load_annotations(image, config.get_property("annotations"))
+    if error is not None:
+        return procedure.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(error))
 
     Gimp.displays_flush()
     return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
 class LoadAsTiles (Gimp.PlugIn):
     def do_query_procedures(self):
-        return [ plug_in_proc ]
+        return [ plug_in_proc, plug_in_annotations_proc ]
 
     def do_create_procedure(self, name):
-        if name != plug_in_proc:
-            return None
+        if name == plug_in_proc:
+            return self.create_load_procedure(name)
+        elif name == plug_in_annotations_proc:
+            return self.create_annotations_procedure(name)
+        return None
 
+    def create_load_procedure(self, name: str):
         procedure = Gimp.ImageProcedure.new(self,
                                             name,
                                             Gimp.PDBProcType.PLUGIN,
-                                            load_as_tiles_run,
+                                            instrumentation.instrument_run(plug_in_name, load_as_tiles_run),
                                             None)
 
         procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.DRAWABLE |
@@ -187,7 +597,63 @@ class LoadAsTiles (Gimp.PlugIn):
                                     0,
                                     GObject.ParamFlags.READWRITE)
 
+        procedure.add_boolean_argument("skip-empty",
+                                       "Skip fully transparent tiles",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+        procedure.add_boolean_argument("skip-duplicates",
+                                       "Skip duplicate tiles",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+        procedure.add_file_argument("report",
+                                    "Tile mapping report file",
+                                    None,
+                                    Gimp.FileChooserAction.SAVE,
+                                    True,
+                                    None,
+                                    GObject.ParamFlags.READWRITE)
+
+        procedure.add_boolean_argument("disable-undo",
+                                       "Disable undo (faster, import cannot be undone)",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+        return procedure
+
+    def create_annotations_procedure(self, name: str):
+        procedure = Gimp.ImageProcedure.new(self,
+                                            name,
+                                            Gimp.PDBProcType.PLUGIN,
+                                            instrumentation.instrument_run(plug_in_annotations_name, load_from_annotations_run),
+                                            None)
+
+        procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.DRAWABLE |
+                                       Gimp.ProcedureSensitivityMask.NO_DRAWABLES)
+        procedure.set_menu_label(plug_in_annotations_name)
+        procedure.set_attribution(plug_in_author, plug_in_org, plug_in_year)
+        procedure.add_menu_path(plug_in_path)
+        procedure.set_documentation(plug_in_annotations_docs, None)
+
+        procedure.add_file_argument("annotations",
+                                    "Annotation file (.clip / .anim)",
+                                    None,
+                                    Gimp.FileChooserAction.OPEN,
+                                    False,
+                                    None,
+                                    GObject.ParamFlags.READWRITE)
+
+        procedure.add_boolean_argument("disable-undo",
+                                       "Disable undo (faster, import cannot be undone)",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
 
         return procedure
 
-Gimp.main(LoadAsTiles.__gtype__, sys.argv)
+if __name__ == "__main__":
+    Gimp.main(LoadAsTiles.__gtype__, sys.argv)
@@ -0,0 +1,63 @@
+# Cheap detection of drawable edits for the live previews.
+#
+# Drawables are compared by a checksum of their thumbnail, which GIMP keeps cached until the drawable
+# changes. Pixel art is usually small enough to be sampled at full size, only large drawables are
+# downsampled and very small edits of those may go unnoticed until the next bigger one.
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+import struct
+import time
+import zlib
+
+POLL_INTERVAL_MS = 100
+SAMPLE_SIZE = 256
+# Part of a poll interval spent on checksums, drawables not polled in time are checked in the next one
+POLL_BUDGET_SECONDS = 0.03
+
+def get_drawable_checksum(drawable: Gimp.Drawable) -> int:
+    width = drawable.get_width()
+    height = drawable.get_height()
+    (_, x, y) = drawable.get_offsets()
+    scale = min(1.0, SAMPLE_SIZE / max(width, height, 1))
+
+    (data, _, _, _) = drawable.get_thumbnail_data(max(1, int(width * scale)), max(1, int(height * scale)))
+    checksum = zlib.crc32(struct.pack("<iiii", x, y, width, height))
+    return zlib.crc32(data.get_data(), checksum)
+
+class ChangePoller:
+    def __init__(self):
+        self.checksums: dict[int, int] = {}
+        self.next_index = 0
+
+    def remember(self, drawable: Gimp.Drawable):
+        self.checksums[drawable.get_id()] = get_drawable_checksum(drawable)
+
+    def forget(self):
+        self.checksums.clear()
+
+    def poll(self, drawables: list[Gimp.Drawable]) -> list[Gimp.Drawable]:
+        # Round robin within a time budget, so that long clips don't block the UI.
+        # Drawables seen for the first time are remembered, not reported
+        changed = []
+        start = time.perf_counter()
+        for _ in range(len(drawables)):
+            if time.perf_counter() - start > POLL_BUDGET_SECONDS:
+                break
+
+            self.next_index = self.next_index % len(drawables)
+            drawable = drawables[self.next_index]
+            self.next_index += 1
+
+            if not drawable.is_valid():
+                changed.append(drawable)
+                continue
+
+            checksum = get_drawable_checksum(drawable)
+            previous = self.checksums.get(drawable.get_id())
+            if previous is not None and previous != checksum:
+                changed.append(drawable)
+            self.checksums[drawable.get_id()] = checksum
+
+        return changed
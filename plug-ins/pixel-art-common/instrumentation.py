@@ -0,0 +1,198 @@
+# Profiling of PDB / libgimp calls and buffered debug logging shared by all plug-ins.
+#
+# Controlled by environment variables of the GIMP process:
+#
+#   PIXEL_ART_PROFILE=summary|trace   count and time every libgimp call (and PDB procedure)
+#   PIXEL_ART_PROFILE_OUTPUT=<file>   where to write the result, summary goes to stderr by default,
+#                                     Chrome trace (chrome://tracing, Perfetto) to the temp directory
+#   PIXEL_ART_DEBUG=1                 collect debug() messages and show them in one message at the end of a run
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+PROFILE_VARIABLE = "PIXEL_ART_PROFILE"
+PROFILE_OUTPUT_VARIABLE = "PIXEL_ART_PROFILE_OUTPUT"
+DEBUG_VARIABLE = "PIXEL_ART_DEBUG"
+
+# Methods of these classes and functions of the Gimp module are libgimp wrappers, most of them PDB calls
+INSTRUMENTED_CLASSES = [Gimp.Image, Gimp.Item, Gimp.Drawable, Gimp.Layer, Gimp.GroupLayer, Gimp.Procedure, Gimp.PDB]
+IGNORED_FUNCTIONS = ["main", "quit"]
+
+profile_mode = os.environ.get(PROFILE_VARIABLE, "").lower()
+debug_enabled = os.environ.get(DEBUG_VARIABLE, "") not in ["", "0"]
+debug_messages: list[str] = []
+
+get_procedure_name = Gimp.Procedure.get_name
+
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+class Profiler:
+    def __init__(self, name: str, trace: bool = False):
+        self.name = name
+        self.trace = trace
+        self.stats: dict[str, CallStats] = {}
+        self.events: list[dict] = []
+        self.originals: list[tuple[object, str, object]] = []
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def record(self, key: str, start: float, end: float):
+        with self.lock:
+            stats = self.stats.setdefault(key, CallStats())
+            stats.count += 1
+            stats.total_seconds += end - start
+            stats.max_seconds = max(stats.max_seconds, end - start)
+            if self.trace:
+                self.events.append({
+                    "name": key,
+                    "ph": "X",
+                    "ts": (start - self.start_time) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident()
+                })
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(f"section {name}", start, time.perf_counter())
+
+    def wrap(self, owner, owner_name: str, name: str, function, original):
+        key = f"{owner_name}.{name}"
+        record = self.record
+
+        def instrumented(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(key, start, time.perf_counter())
+
+        # PDB procedures are told apart by their name, gimp-message is as much a round trip as anything else
+        def instrumented_run(procedure, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(procedure, *args, **kwargs)
+            finally:
+                record(f"pdb {get_procedure_name(procedure)}", start, time.perf_counter())
+
+        wrapper = instrumented_run if owner is Gimp.Procedure and name == "run" else instrumented
+        self.originals.append((owner, name, original))
+        setattr(owner, name, staticmethod(wrapper) if isinstance(original, (staticmethod, classmethod)) else wrapper)
+
+    def start(self):
+        for cls in INSTRUMENTED_CLASSES:
+            for name in dir(cls):
+                if name.startswith("_") or name.startswith("do_"):
+                    continue
+                attr = getattr(cls, name, None)
+                # Inherited methods are instrumented on the class that defines them
+                if name in cls.__dict__ and callable(attr) and not isinstance(attr, type):
+                    self.wrap(cls, cls.__name__, name, attr, cls.__dict__[name])
+
+        for name in dir(Gimp):
+            attr = getattr(Gimp, name, None)
+            if name[0].islower() and name not in IGNORED_FUNCTIONS and callable(attr) and not isinstance(attr, type):
+                self.wrap(Gimp, "Gimp", name, attr, attr)
+
+        self.start_time = time.perf_counter()
+        return self
+
+    def stop(self):
+        for (owner, name, original) in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_call_count(self) -> int:
+        return sum(stats.count for (key, stats) in self.stats.items() if not key.startswith("section "))
+
+    def get_summary(self) -> str:
+        lines = [f"{self.name}: {time.perf_counter() - self.start_time:.3f}s, {self.get_call_count()} libgimp calls",
+                 f"{'function':<48} {'calls':>8} {'total ms':>10} {'avg ms':>8} {'max ms':>8}"]
+        for (key, stats) in sorted(self.stats.items(), key=lambda item: -item[1].total_seconds):
+            lines.append(f"{key:<48} {stats.count:>8} {stats.total_seconds * 1000:>10.2f} "
+                         f"{stats.total_seconds * 1000 / stats.count:>8.3f} {stats.max_seconds * 1000:>8.3f}")
+        return "\n".join(lines)
+
+    def dump(self, filename: str | None):
+        if self.trace:
+            if filename is None:
+                filename = os.path.join(tempfile.gettempdir(), f"{self.name}-{os.getpid()}-trace.json")
+            with open(filename, "w") as fp:
+                json.dump({ "traceEvents": self.events, "displayTimeUnit": "ms" }, fp)
+            print(f"{self.name}: trace written to {filename}", file=sys.stderr)
+        elif filename is None:
+            print(self.get_summary(), file=sys.stderr)
+        else:
+            with open(filename, "a") as fp:
+                fp.write(self.get_summary() + "\n")
+
+active_profiler: Profiler | None = None
+
+@contextlib.contextmanager
+def section(name: str):
+    if active_profiler is None:
+        yield
+        return
+
+    with active_profiler.section(name):
+        yield
+
+def debug(message: str, *args):
+    if not debug_enabled:
+        return
+
+    # Callable arguments are only evaluated when debugging, so PDB getters cost nothing otherwise
+    values = tuple(arg() if callable(arg) else arg for arg in args)
+    debug_messages.append(message % values if len(values) > 0 else message)
+
+def flush_debug_messages():
+    if len(debug_messages) == 0:
+        return
+
+    # All messages in a single PDB round trip
+    proc = Gimp.get_pdb().lookup_procedure("gimp-message")
+    config = proc.create_config()
+    config.set_property("message", "\n".join(debug_messages))
+    proc.run(config)
+    debug_messages.clear()
+
+def instrument_run(plug_in_name: str, run):
+    if profile_mode == "" and not debug_enabled:
+        return run
+
+    def instrumented_run(*args):
+        global active_profiler
+        if profile_mode != "":
+            active_profiler = Profiler(plug_in_name, profile_mode == "trace").start()
+        try:
+            return run(*args)
+        finally:
+            if active_profiler is not None:
+                active_profiler.stop()
+                active_profiler.dump(os.environ.get(PROFILE_OUTPUT_VARIABLE))
+                active_profiler = None
+            flush_debug_messages()
+
+    return instrumented_run
@@ -0,0 +1,214 @@
+# Compact binary variant of the .clip / .anim annotations
+#
+# All values are little-endian and every section is an array of fixed-width records,
+# so a reader can memory-map the file and index records directly:
+#
+#   header
+#   pages       page_count      * (name offset, name length)
+#   rects       rect_count      * (x, y, width, height, offset x, offset y, page, name offset, name length)
+#   states      state_count     * (name offset, name length, page, x, y, width, height, nframes, first frame ref)
+#   frame refs  frame_ref_count * (rect index, offset x, offset y)
+#   strings     UTF-8 names referenced by (offset, length) pairs
+#
+# The header holds the frame size, spacing, upscale factor and bounds of a tileset grid, flags and the record counts.
+# Rects are tiles of a tileset or unique frames of an optimized spritesheet.
+# Values missing in the JSON variant (bounds of a tileset grid, page of an unpaged export, ...)
+# are stored as zeros, rect index -1 marks a fully transparent frame.
+
+import mmap
+import struct
+
+MAGIC = b"PXAN"
+VERSION = 2
+
+HEADER = struct.Struct("<4sIiiiiiiiiiIIIIII")
+PAGE = struct.Struct("<II")
+RECT = struct.Struct("<iiiiiiiII")
+STATE = struct.Struct("<IIiiiiiII")
+FRAME_REF = struct.Struct("<iii")
+
+HAS_BOUNDS = 1
+HAS_PAGES = 2
+HAS_FRAME_REFS = 4
+
+class StringTable:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets: dict[str, int] = {}
+
+    def add(self, text: str) -> tuple[int, int]:
+        encoded = text.encode("utf-8")
+        if text not in self.offsets:
+            self.offsets[text] = len(self.data)
+            self.data += encoded
+        return (self.offsets[text], len(encoded))
+
+def get_box(obj: dict) -> tuple[int, int, int, int]:
+    return (obj["left"], obj["top"], obj["width"], obj["height"])
+
+def encode_annotations(annotation: dict) -> bytes:
+    defaults = annotation.get("defaults", annotation)
+    strings = StringTable()
+    flags = 0
+
+    bounds = (0, 0, 0, 0)
+    if "bounds" in annotation:
+        bounds = get_box(annotation["bounds"])
+        flags |= HAS_BOUNDS
+
+    pages = bytearray()
+    for page_name in annotation.get("pages", []):
+        pages += PAGE.pack(*strings.add(page_name))
+        flags |= HAS_PAGES
+
+    rects = bytearray()
+    for rect in annotation.get("tiles", annotation.get("frames", [])):
+        offset = rect.get("offset", { "horizontal": 0, "vertical": 0 })
+        name = strings.add(rect["name"]) if "name" in rect else (0, 0)
+        rects += RECT.pack(*get_box(rect.get("bounds", rect)),
+                           offset["horizontal"],
+                           offset["vertical"],
+                           rect.get("page", 0),
+                           *name)
+
+    states = bytearray()
+    frame_refs = bytearray()
+    frame_ref_count = 0
+    for state in annotation.get("states", []):
+        state_bounds = get_box(state["bounds"]) if "bounds" in state else (0, 0, 0, 0)
+        states += STATE.pack(*strings.add(state["name"]),
+                             state.get("page", 0),
+                             *state_bounds,
+                             state["nframes"],
+                             frame_ref_count)
+        if "frames" in state:
+            flags |= HAS_FRAME_REFS
+        for frame in state.get("frames", []):
+            frame_refs += FRAME_REF.pack(frame["index"], frame["offset"]["horizontal"], frame["offset"]["vertical"])
+            frame_ref_count += 1
+
+    header = HEADER.pack(MAGIC,
+                         VERSION,
+                         defaults["frame"]["width"],
+                         defaults["frame"]["height"],
+                         defaults["spacing"]["horizontal"],
+                         defaults["spacing"]["vertical"],
+                         defaults.get("upscale", 1),
+                         *bounds,
+                         flags,
+                         len(pages) // PAGE.size,
+                         len(rects) // RECT.size,
+                         len(states) // STATE.size,
+                         frame_ref_count,
+                         len(strings.data))
+    return b"".join([header, pages, rects, states, frame_refs, strings.data])
+
+def write_binary_annotations(annotation: dict, filename: str):
+    fp = open(filename, "wb")
+    fp.write(encode_annotations(annotation))
+    fp.close()
+
+class BinaryAnnotations:
+    def __init__(self, data):
+        (magic, version, *values) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a binary annotation file or unsupported version")
+
+        self.data = data
+        (self.frame_width, self.frame_height,
+         self.spacing_x, self.spacing_y,
+         self.upscale,
+         self.bounds_x, self.bounds_y, self.bounds_width, self.bounds_height,
+         self.flags,
+         self.page_count, self.rect_count, self.state_count, self.frame_ref_count,
+         strings_size) = values
+
+        self.pages_start = HEADER.size
+        self.rects_start = self.pages_start + self.page_count * PAGE.size
+        self.states_start = self.rects_start + self.rect_count * RECT.size
+        self.frame_refs_start = self.states_start + self.state_count * STATE.size
+        self.strings_start = self.frame_refs_start + self.frame_ref_count * FRAME_REF.size
+        if self.strings_start + strings_size > len(data):
+            raise ValueError("Binary annotation file is truncated")
+
+    @staticmethod
+    def open(filename: str):
+        fp = open(filename, "rb")
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        fp.close()
+        return BinaryAnnotations(data)
+
+    def get_string(self, offset: int, length: int) -> str:
+        start = self.strings_start + offset
+        return bytes(self.data[start:start + length]).decode("utf-8")
+
+    def get_page(self, idx: int) -> str:
+        return self.get_string(*PAGE.unpack_from(self.data, self.pages_start + idx * PAGE.size))
+
+    # (x, y, width, height, offset x, offset y, page, name)
+    def get_rect(self, idx: int) -> tuple:
+        (*values, name_offset, name_length) = RECT.unpack_from(self.data, self.rects_start + idx * RECT.size)
+        return (*values, self.get_string(name_offset, name_length))
+
+    # (name, page, x, y, width, height, nframes, first frame ref)
+    def get_state(self, idx: int) -> tuple:
+        (name_offset, name_length, *values) = STATE.unpack_from(self.data, self.states_start + idx * STATE.size)
+        return (self.get_string(name_offset, name_length), *values)
+
+    # (rect index, offset x, offset y)
+    def get_frame_ref(self, idx: int) -> tuple[int, int, int]:
+        return FRAME_REF.unpack_from(self.data, self.frame_refs_start + idx * FRAME_REF.size)
+
+    def find_state(self, name: str) -> int:
+        for idx in range(self.state_count):
+            if self.get_state(idx)[0] == name:
+                return idx
+        return -1
+
+    def to_json(self) -> dict:
+        def box(x: int, y: int, width: int, height: int) -> dict:
+            return { "left": x, "top": y, "width": width, "height": height }
+
+        paged = (self.flags & HAS_PAGES) != 0
+        frame = { "width": self.frame_width, "height": self.frame_height }
+        spacing = { "horizontal": self.spacing_x, "vertical": self.spacing_y }
+
+        rects = []
+        for idx in range(self.rect_count):
+            (x, y, width, height, offset_x, offset_y, page, name) = self.get_rect(idx)
+            rect = box(x, y, width, height)
+            if not self.flags & HAS_FRAME_REFS:
+                rect = { "name": name, "bounds": rect, "offset": { "horizontal": offset_x, "vertical": offset_y } }
+            if paged:
+                rect["page"] = page
+            rects.append(rect)
+
+        if self.state_count == 0:
+            result = { "frame": frame, "spacing": spacing, "upscale": self.upscale }
+            if self.flags & HAS_BOUNDS:
+                result["bounds"] = box(self.bounds_x, self.bounds_y, self.bounds_width, self.bounds_height)
+            if self.rect_count > 0:
+                result["tiles"] = rects
+        else:
+            result = { "defaults": { "frame": frame, "spacing": spacing, "upscale": self.upscale } }
+            if self.flags & HAS_FRAME_REFS:
+                result["frames"] = rects
+
+            result["states"] = []
+            for idx in range(self.state_count):
+                (name, page, x, y, width, height, nframes, first_frame_ref) = self.get_state(idx)
+                if self.flags & HAS_FRAME_REFS:
+                    state = { "name": name, "nframes": nframes, "frames": [] }
+                    for ref_idx in range(first_frame_ref, first_frame_ref + nframes):
+                        (rect_idx, offset_x, offset_y) = self.get_frame_ref(ref_idx)
+                        state["frames"].append({ "index": rect_idx,
+                                                 "offset": { "horizontal": offset_x, "vertical": offset_y } })
+                else:
+                    state = { "name": name, "bounds": box(x, y, width, height), "nframes": nframes }
+                    if paged:
+                        state["page"] = page
+                result["states"].append(state)
+
+        if paged:
+            result["pages"] = [self.get_page(idx) for idx in range(self.page_count)]
+        return result
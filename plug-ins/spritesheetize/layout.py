@@ -0,0 +1,517 @@
+import sys
+import math
+import time
+import bisect
+
+from typing import Self
+
+OPTIMAL_PACKING_MAX_GROUPS = 40
+OPTIMAL_PACKING_MAX_NODES = 200000
+# Rectangle placements spent on trying different texture widths, big inputs try fewer widths
+RECT_LAYOUT_MAX_PLACEMENTS = 4000
+# Optimized frames set to grid packing use MaxRects up to this many frames, Skyline is much faster above it
+MAXRECTS_MAX_FRAMES = 1000
+
+class Vector2d:
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+    
+    def get_scaled(self, factor: int) -> Self:
+        return Vector2d(self.x * factor, self.y * factor)
+    
+    def to_json_dim(self) -> dict[str, int]:
+        return {
+            "width": int(self.x),
+            "height": int(self.y)
+        }
+
+    def to_json_dist(self)-> dict[str, int]:
+        return {
+            "horizontal": int(self.x),
+            "vertical": int(self.y)
+        }
+
+class Box:
+    def __init__(self, position: Vector2d, size: Vector2d):
+        self.position = position
+        self.size = size
+
+    def to_json(self) -> dict[str, int]:
+        return {
+            "left": int(self.position.x),
+            "top": int(self.position.y),
+            "width": int(self.size.x),
+            "height": int(self.size.y)
+        }
+
+class ExportOptions:
+    def __init__(self,
+                 offset: Vector2d,
+                 spacing: Vector2d,
+                 upscale_factor: int,
+                 invert_order: bool,
+                 enforce_tiles_per_row: bool,
+                 enforced_column_count: int,
+                 packing_strategy: str = "greedy",
+                 tileset_packing: str = "grid",
+                 trim_tiles: bool = False,
+                 power_of_two: bool = False,
+                 max_atlas_size: int = 0,
+                 optimize_frames: bool = False,
+                 binary_annotations: bool = False):
+        self.offset = offset
+        self.spacing = spacing
+        self.scaling_factor = upscale_factor
+        self.invert_order = invert_order
+        self.enforce_tiles_per_row = enforce_tiles_per_row
+        self.enforced_column_count = enforced_column_count
+        self.packing_strategy = packing_strategy
+        self.tileset_packing = tileset_packing
+        self.trim_tiles = trim_tiles
+        self.power_of_two = power_of_two
+        self.max_atlas_size = max_atlas_size
+        self.optimize_frames = optimize_frames
+        self.binary_annotations = binary_annotations
+
+def get_power_of_two(value: int) -> int:
+    return 1 << max(0, value - 1).bit_length()
+
+def is_paged(options: ExportOptions) -> bool:
+    return options.max_atlas_size > 0
+
+def get_tileset_row_count(layer_count: int, options: ExportOptions) -> tuple[int, int]:
+    if options.enforce_tiles_per_row and options.enforced_column_count > 0:
+        n_tiles_per_row = options.enforced_column_count
+    else:
+        n_tiles_per_row = int(round(math.sqrt(layer_count)))
+
+    n_rows = math.ceil(layer_count / n_tiles_per_row)
+    return (n_tiles_per_row, n_rows)
+
+def get_out_image_size(frame_size: Vector2d, options: ExportOptions, tiles_per_row: int, row_count: int) -> Vector2d:
+    return Vector2d(tiles_per_row * frame_size.x + 2 * options.offset.x + (tiles_per_row - 1) * options.spacing.x,
+                    row_count * frame_size.y + 2 * options.offset.y + (row_count - 1) * options.spacing.y)
+
+def get_cells_per_page(cell_size: int, offset: int, spacing: int, options: ExportOptions) -> int:
+    size_limit = get_atlas_size_limit(options)
+    if size_limit <= 0:
+        return sys.maxsize
+    return max(0, (size_limit - 2 * offset + spacing) // (cell_size + spacing))
+
+def pack_rects_maxrects(sizes: list[tuple[int, int]], bin_width: int, bin_height: int) -> list[tuple[int, int] | None]:
+    # Free rectangles are stored as left, top, right, bottom
+    free_rects = [(0, 0, bin_width, bin_height)]
+    positions: list[tuple[int, int] | None] = [None] * len(sizes)
+
+    for idx in sorted(range(len(sizes)), key=lambda i: (-max(sizes[i]), -min(sizes[i]))):
+        (width, height) = sizes[idx]
+
+        # Bottom-left rule keeps the atlas as low as possible
+        best = None
+        for (free_left, free_top, free_right, free_bottom) in free_rects:
+            if (width <= free_right - free_left and height <= free_bottom - free_top
+                    and (best is None or (free_top + height, free_left) < best)):
+                best = (free_top + height, free_left)
+
+        if best is None:
+            continue
+
+        (left, top) = (best[1], best[0] - height)
+        (right, bottom) = (left + width, top + height)
+        positions[idx] = (left, top)
+
+        kept_rects = []
+        split_rects = []
+        for free_rect in free_rects:
+            (free_left, free_top, free_right, free_bottom) = free_rect
+            if left >= free_right or right <= free_left or top >= free_bottom or bottom <= free_top:
+                kept_rects.append(free_rect)
+                continue
+
+            if left > free_left:
+                split_rects.append((free_left, free_top, left, free_bottom))
+            if right < free_right:
+                split_rects.append((right, free_top, free_right, free_bottom))
+            if top > free_top:
+                split_rects.append((free_left, free_top, free_right, top))
+            if bottom < free_bottom:
+                split_rects.append((free_left, bottom, free_right, free_bottom))
+
+        # No free rectangle contains another one, so a kept rectangle can't be contained in a piece split
+        # from a different rectangle. Only the pieces have to be pruned, against each other and the kept ones
+        new_rects = []
+        for (split_idx, split_rect) in enumerate(split_rects):
+            (split_left, split_top, split_right, split_bottom) = split_rect
+            is_redundant = False
+            for (other_idx, other) in enumerate(split_rects):
+                if (other_idx != split_idx
+                        and split_left >= other[0] and split_top >= other[1]
+                        and split_right <= other[2] and split_bottom <= other[3]
+                        and (split_rect != other or other_idx < split_idx)):
+                    is_redundant = True
+                    break
+            if is_redundant:
+                continue
+
+            for (kept_left, kept_top, kept_right, kept_bottom) in kept_rects:
+                if (split_left >= kept_left and split_top >= kept_top
+                        and split_right <= kept_right and split_bottom <= kept_bottom):
+                    is_redundant = True
+                    break
+            if not is_redundant:
+                new_rects.append(split_rect)
+
+        free_rects = kept_rects + new_rects
+
+    return positions
+
+def pack_rects_skyline(sizes: list[tuple[int, int]], bin_width: int, bin_height: int) -> list[tuple[int, int] | None]:
+    skyline = [[0, 0, bin_width]] # x, y, width of every segment
+    positions: list[tuple[int, int] | None] = [None] * len(sizes)
+
+    def get_fit_height(segment_idx: int, width: int, height: int) -> int:
+        x = skyline[segment_idx][0]
+        if x + width > bin_width:
+            return -1
+
+        y = 0
+        remaining_width = width
+        while remaining_width > 0:
+            y = max(y, skyline[segment_idx][1])
+            if y + height > bin_height:
+                return -1
+            remaining_width -= skyline[segment_idx][2]
+            segment_idx += 1
+        return y
+
+    for idx in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        (width, height) = sizes[idx]
+
+        best = None
+        for segment_idx in range(len(skyline)):
+            y = get_fit_height(segment_idx, width, height)
+            if y >= 0 and (best is None or (y + height, skyline[segment_idx][0]) < best[0]):
+                best = ((y + height, skyline[segment_idx][0]), segment_idx, y)
+
+        if best is None:
+            continue
+
+        (_, segment_idx, y) = best
+        x = skyline[segment_idx][0]
+        positions[idx] = (x, y)
+
+        # Raise the skyline under the new rectangle and cut the segments it covers
+        skyline.insert(segment_idx, [x, y + height, width])
+        next_idx = segment_idx + 1
+        while next_idx < len(skyline) and skyline[next_idx][0] < x + width:
+            overlap = x + width - skyline[next_idx][0]
+            if overlap >= skyline[next_idx][2]:
+                skyline.pop(next_idx)
+            else:
+                skyline[next_idx][0] += overlap
+                skyline[next_idx][2] -= overlap
+                break
+
+        merged = [skyline[0]]
+        for segment in skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        skyline = merged
+
+    return positions
+
+RECT_PACKING_STRATEGIES = {
+    "grid": ("Grid of full frames", None),
+    "maxrects": ("MaxRects", pack_rects_maxrects),
+    "skyline": ("Skyline", pack_rects_skyline)
+}
+
+def get_frame_packing_strategy(frame_count: int, options: ExportOptions) -> str:
+    if options.tileset_packing != "grid":
+        return options.tileset_packing
+    return "maxrects" if frame_count <= MAXRECTS_MAX_FRAMES else "skyline"
+
+def get_atlas_size_limit(options: ExportOptions) -> int:
+    if options.max_atlas_size <= 0:
+        return 0
+
+    # Pages are padded to a power of two after the layout, so the padded size must fit as well
+    max_atlas_size = options.max_atlas_size
+    if options.power_of_two:
+        max_atlas_size = 1 << (max_atlas_size.bit_length() - 1)
+    return max_atlas_size // options.scaling_factor
+
+def get_padded_sizes(sizes: list[tuple[int, int]], options: ExportOptions) -> list[tuple[int, int]]:
+    # Spacing is packed as a part of every rectangle and removed after the last row / column
+    return [(width + options.spacing.x, height + options.spacing.y) for (width, height) in sizes]
+
+def get_bin_limits(padded_sizes: list[tuple[int, int]], options: ExportOptions) -> tuple[int, int]:
+    size_limit = get_atlas_size_limit(options)
+    if size_limit <= 0:
+        return (0, sum(height for (_, height) in padded_sizes))
+
+    return (size_limit - 2 * options.offset.x + options.spacing.x,
+            size_limit - 2 * options.offset.y + options.spacing.y)
+
+def get_used_size(positions: list[tuple[int, int]], padded_sizes: list[tuple[int, int]], options: ExportOptions) -> Vector2d:
+    return Vector2d(max(x + w for ((x, _), (w, _)) in zip(positions, padded_sizes)) - options.spacing.x + 2 * options.offset.x,
+                    max(y + h for ((_, y), (_, h)) in zip(positions, padded_sizes)) - options.spacing.y + 2 * options.offset.y)
+
+def find_rect_layout(sizes: list[tuple[int, int]],
+                     options: ExportOptions,
+                     strategy: str) -> tuple[list[Vector2d], Vector2d] | None:
+    (_, pack) = RECT_PACKING_STRATEGIES[strategy]
+
+    padded_sizes = get_padded_sizes(sizes, options)
+    (width_limit, height_limit) = get_bin_limits(padded_sizes, options)
+
+    widest = max(width for (width, _) in padded_sizes)
+    base_width = max(widest, math.ceil(math.sqrt(sum(width * height for (width, height) in padded_sizes))))
+    width_steps = max(3, min(9, RECT_LAYOUT_MAX_PLACEMENTS // len(sizes)))
+    candidate_widths = set(base_width * step // 8 for step in range(8, 8 + width_steps))
+    if options.power_of_two:
+        candidate_widths.update(get_power_of_two(width * options.scaling_factor) // options.scaling_factor
+                                for width in list(candidate_widths))
+    if width_limit > 0:
+        candidate_widths = set(min(width, width_limit) for width in candidate_widths)
+
+    best = None
+    for bin_width in sorted(candidate_widths):
+        if bin_width < widest:
+            continue
+
+        positions = pack(padded_sizes, bin_width, height_limit)
+        if None in positions:
+            continue
+
+        used_size = get_used_size(positions, padded_sizes, options)
+        scaled_size = used_size.get_scaled(options.scaling_factor)
+        if options.power_of_two:
+            scaled_size = Vector2d(get_power_of_two(scaled_size.x), get_power_of_two(scaled_size.y))
+
+        area = scaled_size.x * scaled_size.y
+        if best is None or area < best[0]:
+            best = (area, positions, used_size)
+
+    if best is None:
+        return None
+
+    (_, positions, used_size) = best
+    return ([Vector2d(x + options.offset.x, y + options.offset.y) for (x, y) in positions], used_size)
+
+def find_rect_pages(sizes: list[tuple[int, int]],
+                    options: ExportOptions,
+                    strategy: str) -> list[tuple[list[int], list[Vector2d], Vector2d]] | None:
+    (_, pack) = RECT_PACKING_STRATEGIES[strategy]
+
+    remaining = list(range(len(sizes)))
+    pages = []
+    while len(remaining) > 0:
+        # Last page is shrunk to its content, the others are filled up to the size limit
+        layout = find_rect_layout([sizes[idx] for idx in remaining], options, strategy)
+        if layout is not None:
+            pages.append((remaining, layout[0], layout[1]))
+            break
+
+        if not is_paged(options):
+            return None
+
+        padded_sizes = get_padded_sizes([sizes[idx] for idx in remaining], options)
+        (width_limit, height_limit) = get_bin_limits(padded_sizes, options)
+        positions = pack(padded_sizes, width_limit, height_limit)
+        placed = [pos for pos in range(len(remaining)) if positions[pos] is not None]
+        if len(placed) == 0:
+            return None
+
+        pages.append(([remaining[pos] for pos in placed],
+                      [Vector2d(positions[pos][0] + options.offset.x, positions[pos][1] + options.offset.y) for pos in placed],
+                      get_used_size([positions[pos] for pos in placed], [padded_sizes[pos] for pos in placed], options)))
+        remaining = [remaining[pos] for pos in range(len(remaining)) if positions[pos] is None]
+
+    return pages
+
+def pack_greedy(lengths: list[int], capacity: int) -> list[list[int]]:
+    # Fills one row at a time with the longest group that still fits
+    remaining = sorted((length, -idx) for idx, length in enumerate(lengths))
+
+    rows: list[list[int]] = []
+    while len(remaining) > 0:
+        row: list[int] = []
+        row_usage = 0
+        while len(remaining) > 0:
+            pos = bisect.bisect_right(remaining, (capacity - row_usage, 0)) - 1
+            if pos < 0:
+                break
+            (length, neg_idx) = remaining.pop(pos)
+            row.append(-neg_idx)
+            row_usage += length
+        rows.append(row)
+
+    return rows
+
+def pack_first_fit_decreasing(lengths: list[int], capacity: int) -> list[list[int]]:
+    rows: list[list[int]] = []
+    row_usages: list[int] = []
+    for idx in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        for row_idx in range(len(rows)):
+            if row_usages[row_idx] + lengths[idx] <= capacity:
+                rows[row_idx].append(idx)
+                row_usages[row_idx] += lengths[idx]
+                break
+        else:
+            rows.append([idx])
+            row_usages.append(lengths[idx])
+
+    return rows
+
+def pack_best_fit_decreasing(lengths: list[int], capacity: int) -> list[list[int]]:
+    # Rows are kept sorted by their free space so the tightest fit is a bisect away
+    rows: list[list[int]] = []
+    free_space: list[tuple[int, int]] = []
+    for idx in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        pos = bisect.bisect_left(free_space, (lengths[idx], -1))
+        if pos < len(free_space):
+            (space, row_idx) = free_space.pop(pos)
+            rows[row_idx].append(idx)
+            bisect.insort(free_space, (space - lengths[idx], row_idx))
+        else:
+            rows.append([idx])
+            bisect.insort(free_space, (capacity - lengths[idx], len(rows) - 1))
+
+    return rows
+
+def pack_optimal(lengths: list[int], capacity: int) -> list[list[int]]:
+    best_rows = pack_best_fit_decreasing(lengths, capacity)
+    if len(lengths) > OPTIMAL_PACKING_MAX_GROUPS:
+        return best_rows
+
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    lower_bound = max(1, math.ceil(sum(lengths) / capacity)) if capacity > 0 else 1
+    row_usages: list[int] = []
+    assignment = [0] * len(order)
+    visited_nodes = 0
+
+    # Branch and bound over row assignments, rows with equal usage are interchangeable
+    def search(depth: int):
+        nonlocal best_rows, visited_nodes
+        visited_nodes += 1
+        if len(best_rows) == lower_bound or visited_nodes > OPTIMAL_PACKING_MAX_NODES:
+            return
+
+        if depth == len(order):
+            best_rows = [[] for _ in row_usages]
+            for pos in range(len(order)):
+                best_rows[assignment[pos]].append(order[pos])
+            return
+
+        length = lengths[order[depth]]
+        tried_usages = set()
+        for row_idx in range(len(row_usages)):
+            usage = row_usages[row_idx]
+            if usage + length > capacity or usage in tried_usages:
+                continue
+            tried_usages.add(usage)
+            row_usages[row_idx] += length
+            assignment[depth] = row_idx
+            search(depth + 1)
+            row_usages[row_idx] -= length
+
+        if len(row_usages) + 1 < len(best_rows):
+            row_usages.append(length)
+            assignment[depth] = len(row_usages) - 1
+            search(depth + 1)
+            row_usages.pop()
+
+    search(0)
+    return best_rows
+
+PACKING_STRATEGIES = {
+    "greedy": ("Greedy (longest fitting clip per row)", pack_greedy),
+    "first-fit": ("First fit decreasing", pack_first_fit_decreasing),
+    "best-fit": ("Best fit decreasing", pack_best_fit_decreasing),
+    "optimal": ("Optimal (small projects only)", pack_optimal)
+}
+
+def fit_groups(group_lengths: list[int], strategy: str) -> list[list[int]]:
+    (_, pack) = PACKING_STRATEGIES[strategy]
+    return pack(group_lengths, max(group_lengths))
+
+def get_packing_report(group_lengths: list[int],
+                       frame_size: Vector2d,
+                       options: ExportOptions,
+                       strategies: list[str]) -> list[dict]:
+    report = []
+    tiles_per_row = max(group_lengths)
+    for strategy in strategies:
+        start = time.perf_counter()
+        row_count = len(fit_groups(group_lengths, strategy))
+        elapsed = time.perf_counter() - start
+        size = get_out_image_size(frame_size, options, tiles_per_row, row_count).get_scaled(options.scaling_factor)
+        report.append({
+            "strategy": strategy,
+            "rows": row_count,
+            "area": size.x * size.y,
+            "seconds": elapsed
+        })
+    return report
+
+class LayoutCell:
+    def __init__(self, page: int, position: Vector2d):
+        self.page = page
+        self.position = position
+
+def get_grid_position(column: int, row: int, frame_size: Vector2d, options: ExportOptions) -> Vector2d:
+    return Vector2d(options.offset.x + column * (frame_size.x + options.spacing.x),
+                    options.offset.y + row * (frame_size.y + options.spacing.y))
+
+def get_grid_page_sizes(frame_size: Vector2d,
+                        options: ExportOptions,
+                        tiles_per_row: int,
+                        row_count: int,
+                        rows_per_page: int) -> list[Vector2d]:
+    return [get_out_image_size(frame_size, options, tiles_per_row, min(rows_per_page, row_count - first_row))
+            for first_row in range(0, row_count, rows_per_page)]
+
+def layout_tileset(tile_count: int,
+                   frame_size: Vector2d,
+                   options: ExportOptions) -> tuple[list[Vector2d], list[LayoutCell], int, int] | None:
+    (tiles_per_row, row_count) = get_tileset_row_count(tile_count, options)
+
+    max_tiles_per_row = get_cells_per_page(frame_size.x, options.offset.x, options.spacing.x, options)
+    rows_per_page = get_cells_per_page(frame_size.y, options.offset.y, options.spacing.y, options)
+    if max_tiles_per_row == 0 or rows_per_page == 0:
+        return None
+
+    if tiles_per_row > max_tiles_per_row:
+        tiles_per_row = max_tiles_per_row
+        row_count = math.ceil(tile_count / tiles_per_row)
+    rows_per_page = min(rows_per_page, row_count)
+
+    cells = [LayoutCell((idx // tiles_per_row) // rows_per_page,
+                        get_grid_position(idx % tiles_per_row, (idx // tiles_per_row) % rows_per_page, frame_size, options))
+             for idx in range(tile_count)]
+    return (get_grid_page_sizes(frame_size, options, tiles_per_row, row_count, rows_per_page), cells, tiles_per_row, rows_per_page)
+
+def layout_spritesheet(group_lengths: list[int],
+                       frame_size: Vector2d,
+                       options: ExportOptions) -> tuple[list[Vector2d], list[list[int]], list[LayoutCell]] | None:
+    rows = fit_groups(group_lengths, options.packing_strategy)
+    tiles_per_row = max(group_lengths)
+
+    # Clips are never split, so every page holds whole rows
+    rows_per_page = min(get_cells_per_page(frame_size.y, options.offset.y, options.spacing.y, options), len(rows))
+    if tiles_per_row > get_cells_per_page(frame_size.x, options.offset.x, options.spacing.x, options) or rows_per_page == 0:
+        return None
+
+    clip_cells: list[LayoutCell] = [None] * len(group_lengths)
+    for (row_idx, row) in enumerate(rows):
+        column = 0
+        for group_idx in row:
+            clip_cells[group_idx] = LayoutCell(row_idx // rows_per_page,
+                                               get_grid_position(column, row_idx % rows_per_page, frame_size, options))
+            column += group_lengths[group_idx]
+
+    return (get_grid_page_sizes(frame_size, options, tiles_per_row, len(rows), rows_per_page), rows, clip_cells)
@@ -10,12 +10,38 @@ from gi.repository import GObject
 from gi.repository import GLib
 from gi.repository import Gtk
 from gi.repository import Gegl
+from gi.repository import Gio
 import sys
-import math
+import os
+import time
 import json
+import concurrent.futures
+import array
+import hashlib
+import struct
+import zlib
 
 from typing import Self
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pixel-art-common"))
+import instrumentation
+import change_detection
+from annotation_format import write_binary_annotations
+from layout import (Vector2d,
+                    Box,
+                    ExportOptions,
+                    LayoutCell,
+                    get_power_of_two,
+                    is_paged,
+                    layout_tileset,
+                    layout_spritesheet,
+                    find_rect_pages,
+                    RECT_PACKING_STRATEGIES,
+                    PACKING_STRATEGIES,
+                    get_packing_report,
+                    get_frame_packing_strategy)
+
 plug_in_proc = "plug-in-nerudaj-spritesheetize"
 plug_in_binary = "py3-spritesheetize"
 plug_in_author = "nerudaj"
@@ -24,54 +50,39 @@ plug_in_year = "2025"
 plug_in_docs = "Export layers as spritesheet / tilesheet"
 plug_in_name = "Spritesheetize"
 plug_in_path = "<Image>/Pixel Art"
+plug_in_batch_proc = "plug-in-nerudaj-spritesheetize-batch"
+plug_in_batch_docs = "Export every .xcf file listed in a JSON manifest as spritesheet / tilesheet"
 
-class Vector2d:
-    def __init__(self, x: int, y: int):
-        self.x = x
-        self.y = y
-    
-    def get_scaled(self, factor: int) -> Self:
-        return Vector2d(self.x * factor, self.y * factor)
-    
-    def to_json_dim(self) -> dict[str, int]:
-        return {
-            "width": int(self.x),
-            "height": int(self.y)
-        }
+EXPORT_PROPERTY_NAMES = [
+    "groups-are-animations",
+    "upscale-factor",
+    "xoffset",
+    "yoffset",
+    "xspacing",
+    "yspacing",
+    "enforce-row-count",
+    "enforced-tiles-per-row",
+    "invert-order",
+    "worker-count",
+    "incremental",
+    "packing-strategy",
+    "tileset-packing",
+    "trim-tiles",
+    "power-of-two",
+    "max-atlas-size",
+    "optimize-frames",
+    "streaming-png",
+    "binary-annotations"
+]
 
-    def to_json_dist(self)-> dict[str, int]:
-        return {
-            "horizontal": int(self.x),
-            "vertical": int(self.y)
-        }
-
-class Box:
-    def __init__(self, position: Vector2d, size: Vector2d):
-        self.position = position
-        self.size = size
-
-    def to_json(self) -> dict[str, int]:
-        return {
-            "left": int(self.position.x),
-            "top": int(self.position.y),
-            "width": int(self.size.x),
-            "height": int(self.size.y)
-        }
-
-class ExportOptions:
-    def __init__(self,
-                 offset: Vector2d,
-                 spacing: Vector2d,
-                 upscale_factor: int,
-                 invert_order: bool,
-                 enforce_tiles_per_row: bool,
-                 enforced_column_count: int):
-        self.offset = offset
-        self.spacing = spacing
-        self.scaling_factor = upscale_factor
-        self.invert_order = invert_order
-        self.enforce_tiles_per_row = enforce_tiles_per_row
-        self.enforced_column_count = enforced_column_count
+RGBA_FORMAT = "R'G'B'A u8"
+# Layer masks are stored linear, so this is their own format in 8-bit images
+MASK_FORMAT = "Y u8"
+NORMAL_LAYER_MODES = (Gimp.LayerMode.NORMAL, Gimp.LayerMode.NORMAL_LEGACY)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+BYTES_PER_PIXEL = 4
+EXPORT_CACHE_VERSION = 2
+PNG_BAND_ROWS = 256
 
 def log(message: str):
     proc = Gimp.get_pdb().lookup_procedure("gimp-message")
@@ -104,169 +115,994 @@ def copy_layer_to_image(layer: Gimp.Layer,
     target_image.insert_layer(temp_layer, None, 0)
     temp_layer.transform_translate(x, y)
 
+class PixelBuffer:
+    def __init__(self, width: int, height: int, data: bytearray | None = None):
+        self.width = width
+        self.height = height
+        self.data = data if data is not None else bytearray(width * height * BYTES_PER_PIXEL)
+
+    def blit(self, source: Self, x: int, y: int):
+        src_stride = source.width * BYTES_PER_PIXEL
+        dst_stride = self.width * BYTES_PER_PIXEL
+        src_view = memoryview(source.data)
+        for row in range(source.height):
+            dst_start = (y + row) * dst_stride + x * BYTES_PER_PIXEL
+            src_start = row * src_stride
+            self.data[dst_start:dst_start + src_stride] = src_view[src_start:src_start + src_stride]
+
+    def blit_scaled(self, source: Self, x: int, y: int, factor: int):
+        if factor == 1:
+            self.blit(source, x, y)
+            return
+
+        # Nearest neighbour upscale, whole pixels are replicated as 32bit words
+        pixels = array.array("I")
+        pixels.frombytes(source.data)
+        wide_pixels = array.array("I", [0]) * (len(pixels) * factor)
+        for repeat in range(factor):
+            wide_pixels[repeat::factor] = pixels
+        wide_view = memoryview(wide_pixels.tobytes())
+
+        src_stride = source.width * factor * BYTES_PER_PIXEL
+        dst_stride = self.width * BYTES_PER_PIXEL
+        for row in range(source.height):
+            src_row = wide_view[row * src_stride:(row + 1) * src_stride]
+            for repeat in range(factor):
+                dst_start = (y + row * factor + repeat) * dst_stride + x * BYTES_PER_PIXEL
+                self.data[dst_start:dst_start + src_stride] = src_row
+
+    def apply_mask(self, mask: bytes):
+        alpha = self.data[3::BYTES_PER_PIXEL]
+        self.data[3::BYTES_PER_PIXEL] = bytes((value * coverage + 127) // 255 for (value, coverage) in zip(alpha, mask))
+
+    def apply_opacity(self, opacity: float):
+        if opacity >= 100.0:
+            return
+
+        alpha_table = bytes(int(round(alpha * opacity / 100.0)) for alpha in range(256))
+        self.data[3::BYTES_PER_PIXEL] = self.data[3::BYTES_PER_PIXEL].translate(alpha_table)
+
+    def get_scaled(self, factor: int) -> Self:
+        if factor == 1:
+            return self
+
+        scaled = PixelBuffer(self.width * factor, self.height * factor)
+        scaled.blit_scaled(self, 0, 0, factor)
+        return scaled
+
+    def get_hash(self) -> str:
+        return hashlib.blake2b(self.data, digest_size=16).hexdigest()
+
+    def get_cropped(self, box: Box) -> Self:
+        cropped = PixelBuffer(box.size.x, box.size.y)
+        stride = self.width * BYTES_PER_PIXEL
+        row_size = box.size.x * BYTES_PER_PIXEL
+        for row in range(box.size.y):
+            src_start = (box.position.y + row) * stride + box.position.x * BYTES_PER_PIXEL
+            cropped.data[row * row_size:(row + 1) * row_size] = self.data[src_start:src_start + row_size]
+        return cropped
+
+    def get_opaque_bounds(self) -> Box | None:
+        alpha = bytes(self.data[3::BYTES_PER_PIXEL])
+        left = self.width
+        right = 0
+        top = -1
+        bottom = 0
+        for row in range(self.height):
+            row_alpha = alpha[row * self.width:(row + 1) * self.width]
+            row_left = self.width - len(row_alpha.lstrip(b"\0"))
+            if row_left == self.width:
+                continue
+
+            if top == -1:
+                top = row
+            bottom = row + 1
+            left = min(left, row_left)
+            right = max(right, len(row_alpha.rstrip(b"\0")))
+
+        if top == -1:
+            return None
+
+        return Box(Vector2d(left, top), Vector2d(right - left, bottom - top))
+
+class FramePlacement:
+    def __init__(self, layer: Gimp.Layer, position: Vector2d, crop: Box | None = None):
+        self.layer = layer
+        self.position = position
+        self.crop = crop
+
+    def get_crop(self, frame_size: Vector2d) -> Box:
+        return self.crop if self.crop is not None else Box(Vector2d(0, 0), frame_size)
+
+class FrameSource:
+    def __init__(self,
+                 buffer: Gegl.Buffer,
+                 rect: Gegl.Rectangle,
+                 opacity: float,
+                 position: Vector2d,
+                 mask_buffer: Gegl.Buffer | None = None):
+        self.buffer = buffer
+        self.rect = rect
+        self.opacity = opacity
+        self.position = position
+        self.mask_buffer = mask_buffer
+
+def get_frame_source(placement: FramePlacement, frame_size: Vector2d) -> FrameSource | None:
+    # Only the part of the layer that lies within the image canvas (or its crop) is exported
+    layer = placement.layer
+    crop = placement.get_crop(frame_size)
+    (_, offset_x, offset_y) = layer.get_offsets()
+    left = max(crop.position.x, offset_x)
+    top = max(crop.position.y, offset_y)
+    right = min(crop.position.x + crop.size.x, offset_x + layer.get_width())
+    bottom = min(crop.position.y + crop.size.y, offset_y + layer.get_height())
+
+    if right <= left or bottom <= top:
+        return None
+
+    mask = layer.get_mask()
+    return FrameSource(layer.get_buffer(),
+                       Gegl.Rectangle.new(left - offset_x, top - offset_y, right - left, bottom - top),
+                       layer.get_opacity(),
+                       Vector2d(placement.position.x + left - crop.position.x,
+                                placement.position.y + top - crop.position.y),
+                       mask.get_buffer() if mask is not None and layer.get_apply_mask() else None)
+
+def rasterize_frame(source: FrameSource) -> PixelBuffer:
+    pixels = source.buffer.get(source.rect, 1.0, RGBA_FORMAT, Gegl.AbyssPolicy.NONE)
+    frame = PixelBuffer(source.rect.width, source.rect.height, bytearray(pixels))
+    if source.mask_buffer is not None:
+        frame.apply_mask(source.mask_buffer.get(source.rect, 1.0, MASK_FORMAT, Gegl.AbyssPolicy.NONE))
+    frame.apply_opacity(source.opacity)
+    return frame
+
+def has_blend_modes(placements: list[FramePlacement]) -> bool:
+    return any(placement.layer.get_mode() not in NORMAL_LAYER_MODES for placement in placements)
+
+def get_trimmed_frame(layer: Gimp.Layer, frame_size: Vector2d) -> tuple[PixelBuffer, Box] | None:
+    source = get_frame_source(FramePlacement(layer, Vector2d(0, 0)), frame_size)
+    if source is None:
+        return None
+
+    frame = rasterize_frame(source)
+    opaque_bounds = frame.get_opaque_bounds()
+    if opaque_bounds is None:
+        return None
+
+    return (frame.get_cropped(opaque_bounds),
+            Box(Vector2d(source.position.x + opaque_bounds.position.x,
+                         source.position.y + opaque_bounds.position.y),
+                opaque_bounds.size))
+
+def get_frame_bounds(layer: Gimp.Layer, frame_size: Vector2d, trim: bool) -> Box | None:
+    if trim:
+        trimmed_frame = get_trimmed_frame(layer, frame_size)
+        return trimmed_frame[1] if trimmed_frame is not None else None
+
+    source = get_frame_source(FramePlacement(layer, Vector2d(0, 0)), frame_size)
+    if source is None:
+        return None
+
+    return Box(source.position, Vector2d(source.rect.width, source.rect.height))
+
+def render_cell(placement: FramePlacement, source: FrameSource | None, frame_size: Vector2d) -> PixelBuffer:
+    crop = placement.get_crop(frame_size)
+    cell = PixelBuffer(crop.size.x, crop.size.y)
+    if source is not None:
+        cell.blit(rasterize_frame(source),
+                  source.position.x - placement.position.x,
+                  source.position.y - placement.position.y)
+    return cell
+
+def create_image_from_pixels(pixels: PixelBuffer, in_image: Gimp.Image) -> Gimp.Image:
+    out_image = Gimp.Image.new(pixels.width, pixels.height, Gimp.ImageBaseType.RGB)
+    layer = Gimp.Layer.new(out_image,
+                           "atlas",
+                           pixels.width,
+                           pixels.height,
+                           Gimp.ImageType.RGBA_IMAGE,
+                           100,
+                           Gimp.LayerMode.NORMAL)
+    out_image.insert_layer(layer, None, 0)
+
+    buffer = layer.get_buffer()
+    buffer.set(Gegl.Rectangle.new(0, 0, pixels.width, pixels.height), RGBA_FORMAT, bytes(pixels.data))
+    buffer.flush()
+    layer.update(0, 0, pixels.width, pixels.height)
+
+    # Atlas is composed in RGBA, convert it back so the output matches the source project
+    if in_image.get_base_type() == Gimp.ImageBaseType.GRAY:
+        out_image.convert_grayscale()
+    elif in_image.get_base_type() == Gimp.ImageBaseType.INDEXED:
+        out_image.convert_indexed(Gimp.ConvertDitherType.NONE,
+                                  Gimp.ConvertPaletteType.CUSTOM,
+                                  0,
+                                  False,
+                                  False,
+                                  in_image.get_palette())
+
+    return out_image
+
+def scale_image(image: Gimp.Image, scaling_factor: int):
+    Gimp.context_set_interpolation(Gimp.InterpolationType.NONE)
+    image.scale(image.get_width() * scaling_factor,
+                image.get_height() * scaling_factor)
+
+def pad_image_to_power_of_two(image: Gimp.Image):
+    width = get_power_of_two(image.get_width())
+    height = get_power_of_two(image.get_height())
+    if width == image.get_width() and height == image.get_height():
+        return
+
+    image.resize(width, height, 0, 0)
+    for layer in image.get_layers():
+        layer.resize_to_image_size()
+
+class CompositorInterface:
+    def compose(self,
+                in_image: Gimp.Image,
+                placements: list[FramePlacement],
+                out_size: Vector2d,
+                scaling_factor: int) -> Gimp.Image:
+        pass
+
+class LayerCopyCompositor(CompositorInterface):
+    def compose(self,
+                in_image: Gimp.Image,
+                placements: list[FramePlacement],
+                out_size: Vector2d,
+                scaling_factor: int) -> Gimp.Image:
+        out_image = Gimp.Image.new(out_size.x, out_size.y, in_image.get_base_type())
+        frame_size = Vector2d(in_image.get_width(), in_image.get_height())
+        for placement in placements:
+            crop = placement.get_crop(frame_size)
+            copy_layer_to_image(placement.layer,
+                                out_image,
+                                placement.position.x - crop.position.x,
+                                placement.position.y - crop.position.y)
+            if placement.crop is not None:
+                copied_layer = out_image.get_layers()[0]
+                (_, offset_x, offset_y) = copied_layer.get_offsets()
+                copied_layer.resize(crop.size.x,
+                                    crop.size.y,
+                                    offset_x - placement.position.x,
+                                    offset_y - placement.position.y)
+        scale_image(out_image, scaling_factor)
+        return out_image
+
+class BufferCompositor(CompositorInterface):
+    def __init__(self, pool: concurrent.futures.Executor | None = None):
+        self.pool = pool
+
+    def map_frames(self, function, items) -> list:
+        if self.pool is not None:
+            return list(self.pool.map(function, items))
+        return [function(item) for item in items]
+
+    def compose(self,
+                in_image: Gimp.Image,
+                placements: list[FramePlacement],
+                out_size: Vector2d,
+                scaling_factor: int) -> Gimp.Image:
+        frame_size = Vector2d(in_image.get_width(), in_image.get_height())
+        # Frames are upscaled while blitting, so the atlas is allocated just once in its final size
+        atlas = PixelBuffer(out_size.x * scaling_factor, out_size.y * scaling_factor)
+
+        # Everything that talks to GIMP stays on this thread, workers only touch raw buffers
+        sources = [source for source in (get_frame_source(placement, frame_size) for placement in placements)
+                   if source is not None]
+
+        def place_frame(source: FrameSource):
+            atlas.blit_scaled(rasterize_frame(source),
+                              source.position.x * scaling_factor,
+                              source.position.y * scaling_factor,
+                              scaling_factor)
+
+        self.map_frames(place_frame, sources)
+
+        return create_image_from_pixels(atlas, in_image)
+
+class PngStreamWriter:
+    def __init__(self, filename: str, width: int, height: int):
+        self.fp = open(filename, "wb")
+        self.compressor = zlib.compressobj(6)
+        self.width = width
+        self.fp.write(PNG_SIGNATURE)
+        # 8 bits per channel, RGBA, default compression, filtering and no interlacing
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def write_chunk(self, tag: bytes, data: bytes):
+        self.fp.write(struct.pack(">I", len(data)))
+        self.fp.write(tag)
+        self.fp.write(data)
+        self.fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def write_rows(self, pixels: PixelBuffer):
+        stride = pixels.width * BYTES_PER_PIXEL
+        view = memoryview(pixels.data)
+        scanlines = bytearray()
+        for row in range(pixels.height):
+            scanlines.append(0) # No filter
+            scanlines += view[row * stride:(row + 1) * stride]
+            if pixels.width < self.width:
+                scanlines += bytes((self.width - pixels.width) * BYTES_PER_PIXEL)
+
+        compressed = self.compressor.compress(scanlines)
+        if len(compressed) > 0:
+            self.write_chunk(b"IDAT", compressed)
+
+    def close(self):
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+        self.fp.close()
+
+class StreamingPngCompositor(BufferCompositor):
+    def write(self,
+              in_image: Gimp.Image,
+              placements: list[FramePlacement],
+              out_size: Vector2d,
+              scaling_factor: int,
+              outfile: Gio.File,
+              power_of_two: bool):
+        frame_size = Vector2d(in_image.get_width(), in_image.get_height())
+        sources = [source for source in (get_frame_source(placement, frame_size) for placement in placements)
+                   if source is not None]
+        sources.sort(key=lambda source: source.position.y)
+
+        file_size = out_size.get_scaled(scaling_factor)
+        if power_of_two:
+            file_size = Vector2d(get_power_of_two(file_size.x), get_power_of_two(file_size.y))
+        writer = PngStreamWriter(outfile.get_path(), file_size.x, file_size.y)
+
+        # Only one band of rows, roughly one row of frames, is kept in memory at a time
+        band_height = min(frame_size.y, out_size.y)
+        first_source = 0
+        for band_top in range(0, out_size.y, band_height):
+            band_bottom = min(band_top + band_height, out_size.y)
+            while first_source < len(sources) and sources[first_source].position.y + sources[first_source].rect.height <= band_top:
+                first_source += 1
+
+            band_parts = []
+            for source in sources[first_source:]:
+                if source.position.y >= band_bottom:
+                    break
+
+                top = max(source.position.y, band_top)
+                bottom = min(source.position.y + source.rect.height, band_bottom)
+                if bottom > top:
+                    band_parts.append(FrameSource(source.buffer,
+                                                  Gegl.Rectangle.new(source.rect.x,
+                                                                     source.rect.y + top - source.position.y,
+                                                                     source.rect.width,
+                                                                     bottom - top),
+                                                  source.opacity,
+                                                  Vector2d(source.position.x, top - band_top)))
+
+            band = PixelBuffer(file_size.x, (band_bottom - band_top) * scaling_factor)
+
+            def place_frame(source: FrameSource):
+                band.blit_scaled(rasterize_frame(source),
+                                 source.position.x * scaling_factor,
+                                 source.position.y * scaling_factor,
+                                 scaling_factor)
+
+            self.map_frames(place_frame, band_parts)
+            writer.write_rows(band)
+
+        padding_rows = file_size.y - out_size.y * scaling_factor
+        if padding_rows > 0:
+            writer.write_rows(PixelBuffer(file_size.x, padding_rows))
+        writer.close()
+
+def get_cache_filename(outfile: Gio.File) -> str:
+    return outfile.get_path() + ".cache"
+
+def read_export_cache(outfile: Gio.File) -> dict | None:
+    try:
+        fp = open(get_cache_filename(outfile), "rt")
+        cache = json.load(fp)
+        fp.close()
+    except (OSError, ValueError):
+        return None
+
+    if cache.get("version") != EXPORT_CACHE_VERSION:
+        return None
+
+    # Output was touched by something else since the last export
+    if not os.path.exists(outfile.get_path()) or os.path.getmtime(outfile.get_path()) != cache["output_mtime"]:
+        return None
+
+    return cache
+
+def get_atlas_cache_filename(outfile: Gio.File) -> str:
+    return outfile.get_path() + ".cache.rgba"
+
+def read_cached_atlas(outfile: Gio.File, size: Vector2d) -> PixelBuffer | None:
+    try:
+        fp = open(get_atlas_cache_filename(outfile), "rb")
+        data = bytearray(fp.read())
+        fp.close()
+    except OSError:
+        return None
+
+    if len(data) != size.x * size.y * BYTES_PER_PIXEL:
+        return None
+
+    return PixelBuffer(size.x, size.y, data)
+
+def get_layer_metadata(layer: Gimp.Layer) -> str:
+    (_, offset_x, offset_y) = layer.get_offsets()
+    return f"{layer.get_tattoo()}:{offset_x},{offset_y}:{layer.get_width()}x{layer.get_height()}:{layer.get_opacity()}"
+
+def write_png_from_pixels(pixels: PixelBuffer, outfile: Gio.File, file_size: Vector2d):
+    writer = PngStreamWriter(outfile.get_path(), file_size.x, file_size.y)
+    stride = pixels.width * BYTES_PER_PIXEL
+    for band_top in range(0, pixels.height, PNG_BAND_ROWS):
+        band_bottom = min(band_top + PNG_BAND_ROWS, pixels.height)
+        writer.write_rows(PixelBuffer(pixels.width,
+                                      band_bottom - band_top,
+                                      pixels.data[band_top * stride:band_bottom * stride]))
+
+    padding_rows = file_size.y - pixels.height
+    if padding_rows > 0:
+        writer.write_rows(PixelBuffer(file_size.x, padding_rows))
+    writer.close()
+
+class IncrementalCompositor(BufferCompositor):
+    def __init__(self, pool: concurrent.futures.Executor | None, outfile: Gio.File):
+        super().__init__(pool)
+        self.outfile = outfile
+
+    def get_layout(self,
+                   in_image: Gimp.Image,
+                   placements: list[FramePlacement],
+                   out_size: Vector2d,
+                   scaling_factor: int,
+                   power_of_two: bool) -> dict:
+        # Everything that changes pixels of the output without changing any frame
+        frame_size = Vector2d(in_image.get_width(), in_image.get_height())
+        layout = {
+            "base_type": int(in_image.get_base_type()),
+            "frame_size": [frame_size.x, frame_size.y],
+            "out_size": [out_size.x, out_size.y],
+            "scaling_factor": scaling_factor,
+            "power_of_two": power_of_two,
+            "positions": [[placement.position.x, placement.position.y] for placement in placements],
+            "crops": [placement.get_crop(frame_size).to_json() for placement in placements]
+        }
+        if in_image.get_base_type() == Gimp.ImageBaseType.INDEXED:
+            layout["palette"] = [list(color.get_rgba()) for color in in_image.get_palette().get_colors()]
+        return layout
+
+    def write(self,
+              in_image: Gimp.Image,
+              placements: list[FramePlacement],
+              out_size: Vector2d,
+              scaling_factor: int,
+              power_of_two: bool):
+        frame_size = Vector2d(in_image.get_width(), in_image.get_height())
+        atlas_size = out_size.get_scaled(scaling_factor)
+        layout = self.get_layout(in_image, placements, out_size, scaling_factor, power_of_two)
+
+        # Composed atlas of the last export is kept next to it, so the output doesn't have to be loaded and decoded
+        atlas = None
+        cache = read_export_cache(self.outfile)
+        if cache is not None and cache["layout"] == layout:
+            atlas = read_cached_atlas(self.outfile, atlas_size)
+        cached_fingerprints = cache["frames"] if atlas is not None else [None] * len(placements)
+        if atlas is None:
+            atlas = PixelBuffer(atlas_size.x, atlas_size.y)
+
+        # Layer metadata is compared first, the thumbnail checksum is only taken when it still matches
+        # and pixels are only read for frames that changed
+        fingerprints = []
+        changed = []
+        for (placement, cached) in zip(placements, cached_fingerprints):
+            metadata = get_layer_metadata(placement.layer)
+            checksum = None
+            if cached is not None and cached["layer"] == metadata:
+                checksum = change_detection.get_drawable_checksum(placement.layer)
+                if checksum == cached["pixels"]:
+                    fingerprints.append(cached)
+                    continue
+
+            changed.append(len(fingerprints))
+            fingerprints.append({ "layer": metadata, "pixels": checksum })
+
+        # Everything that talks to GIMP stays on this thread
+        sources = { idx: get_frame_source(placements[idx], frame_size) for idx in changed }
+        for idx in changed:
+            if fingerprints[idx]["pixels"] is None:
+                fingerprints[idx]["pixels"] = change_detection.get_drawable_checksum(placements[idx].layer)
+
+        def place_frame(idx: int):
+            atlas.blit_scaled(render_cell(placements[idx], sources[idx], frame_size),
+                              placements[idx].position.x * scaling_factor,
+                              placements[idx].position.y * scaling_factor,
+                              scaling_factor)
+
+        self.map_frames(place_frame, changed)
+        instrumentation.debug("Incremental export redrew %d of %d frames", len(changed), len(placements))
+
+        # RGB PNGs are written directly, other outputs need GIMP to convert or encode them
+        if self.outfile.get_path().lower().endswith(".png") and in_image.get_base_type() == Gimp.ImageBaseType.RGB:
+            file_size = atlas_size
+            if power_of_two:
+                file_size = Vector2d(get_power_of_two(file_size.x), get_power_of_two(file_size.y))
+            write_png_from_pixels(atlas, self.outfile, file_size)
+        else:
+            out_image = create_image_from_pixels(atlas, in_image)
+            if power_of_two:
+                pad_image_to_power_of_two(out_image)
+            Gimp.file_save(Gimp.RunMode.NONINTERACTIVE, out_image, self.outfile, None)
+            out_image.delete()
+
+        fp = open(get_atlas_cache_filename(self.outfile), "wb")
+        fp.write(atlas.data)
+        fp.close()
+        write_obj_to_file_as_json({
+            "version": EXPORT_CACHE_VERSION,
+            "output_mtime": os.path.getmtime(self.outfile.get_path()),
+            "layout": layout,
+            "frames": fingerprints
+        }, get_cache_filename(self.outfile))
+
+class FrameReference:
+    def __init__(self, index: int, offset: Vector2d):
+        self.index = index
+        self.offset = offset
+
+    def to_json(self, scaling_factor: int) -> dict:
+        return {
+            "index": self.index,
+            "offset": self.offset.get_scaled(scaling_factor).to_json_dist()
+        }
+
+class AnimationClip:
+    def __init__(self, name: str, frame_count: int, cell: LayoutCell):
+        self.name = name
+        self.frame_count = frame_count
+        self.cell = cell
+
+class AnimationState:
+    def __init__(self, name: str, frames: list[FrameReference]):
+        self.name = name
+        self.frames = frames
+
+class PackedTile:
+    def __init__(self, name: str, bounds: Box, offset: Vector2d, page: int = 0):
+        self.name = name
+        self.bounds = bounds
+        self.offset = offset
+        self.page = page
+
+    def to_json(self, scaling_factor: int, paged: bool) -> dict:
+        result = {
+            "name": self.name,
+            "bounds": Box(self.bounds.position.get_scaled(scaling_factor),
+                          self.bounds.size.get_scaled(scaling_factor)).to_json(),
+            "offset": self.offset.get_scaled(scaling_factor).to_json_dist()
+        }
+        if paged:
+            result["page"] = self.page
+        return result
+
+class AtlasCell:
+    def __init__(self, bounds: Box, page: int = 0):
+        self.bounds = bounds
+        self.page = page
+
+    def to_json(self, scaling_factor: int, paged: bool) -> dict:
+        result = Box(self.bounds.position.get_scaled(scaling_factor),
+                     self.bounds.size.get_scaled(scaling_factor)).to_json()
+        if paged:
+            result["page"] = self.page
+        return result
+
+class AtlasPage:
+    def __init__(self, size: Vector2d):
+        self.size = size
+        self.placements: list[FramePlacement] = []
+
+def get_page_files(outfile: Gio.File, page_count: int) -> list[Gio.File]:
+    (stem, extension) = os.path.splitext(outfile.get_path())
+    return [outfile] + [Gio.File.new_for_path(f"{stem}-{idx}{extension}") for idx in range(1, page_count)]
+
+def add_page_annotations(annotation: dict, options: ExportOptions, page_files: list[Gio.File]):
+    if is_paged(options):
+        annotation["pages"] = [page_file.get_basename() for page_file in page_files]
+
 def write_obj_to_file_as_json(obj, filename: str):
     fp = open(filename, "wt")
     json.dump(obj, fp, indent=4)
     fp.close()
 
+def write_annotations(annotation: dict, filename: str, options: ExportOptions):
+    write_obj_to_file_as_json(annotation, filename)
+    if options.binary_annotations:
+        write_binary_annotations(annotation, filename + ".bin")
+
 def export_tileset_annotations(filename: str,
                                frame_size: Vector2d,
                                options: ExportOptions,
                                items_per_row: int,
-                               nrows: int):
+                               nrows: int,
+                               tiles: list[PackedTile],
+                               page_files: list[Gio.File]):
     bounds_width = int((items_per_row * frame_size.x + (items_per_row - 1) * options.spacing.x) * options.scaling_factor)
     bounds_height = int((nrows * frame_size.y + (nrows - 1) * options.spacing.y) * options.scaling_factor)
 
     annotation = {
         "frame": frame_size.get_scaled(options.scaling_factor).to_json_dim(),
         "spacing": options.spacing.get_scaled(options.scaling_factor).to_json_dist(),
+        "upscale": options.scaling_factor,
         "bounds": Box(options.offset.get_scaled(options.scaling_factor),
                       Vector2d(bounds_width, bounds_height)).to_json()
     }
 
-    write_obj_to_file_as_json(annotation, filename + ".clip")
+    # Grid is the same on every page, tiles only need to know their page
+    if is_paged(options):
+        annotation["tiles"] = [tile.to_json(options.scaling_factor, True) for tile in tiles]
+    add_page_annotations(annotation, options, page_files)
+
+    write_annotations(annotation, filename + ".clip", options)
+
+def export_packed_tileset_annotations(filename: str,
+                                      frame_size: Vector2d,
+                                      options: ExportOptions,
+                                      tiles: list[PackedTile],
+                                      page_files: list[Gio.File]):
+    annotation = {
+        "frame": frame_size.get_scaled(options.scaling_factor).to_json_dim(),
+        "spacing": options.spacing.get_scaled(options.scaling_factor).to_json_dist(),
+        "upscale": options.scaling_factor,
+        "tiles": [tile.to_json(options.scaling_factor, is_paged(options)) for tile in tiles]
+    }
+    add_page_annotations(annotation, options, page_files)
+
+    write_annotations(annotation, filename + ".clip", options)
+
+def export_optimized_spritesheet_annotations(filename: str,
+                                             frame_size: Vector2d,
+                                             options: ExportOptions,
+                                             cells: list[AtlasCell],
+                                             states: list[AnimationState],
+                                             page_files: list[Gio.File]):
+    annotation = {
+        "defaults": {
+            "frame": frame_size.get_scaled(options.scaling_factor).to_json_dim(),
+            "spacing": options.spacing.get_scaled(options.scaling_factor).to_json_dist(),
+            "upscale": options.scaling_factor,
+        },
+        "frames": [cell.to_json(options.scaling_factor, is_paged(options)) for cell in cells],
+        "states": [{
+            "name": state.name,
+            "nframes": len(state.frames),
+            "frames": [frame.to_json(options.scaling_factor) for frame in state.frames]
+        } for state in states]
+    }
+    add_page_annotations(annotation, options, page_files)
+
+    write_annotations(annotation, filename + ".anim", options)
 
 def export_spritesheet_annotations(filename: str,
                                    frame_size: Vector2d,
                                    options: ExportOptions,
-                                   fitted_groups: list[list[Gimp.GroupLayer]]):
+                                   clips: list[AnimationClip],
+                                   page_files: list[Gio.File]):
     annotation = {
         "defaults": {
             "frame": frame_size.get_scaled(options.scaling_factor).to_json_dim(),
             "spacing": options.spacing.get_scaled(options.scaling_factor).to_json_dist(),
+            "upscale": options.scaling_factor,
         },
         "states": []
     }
 
-    for rowIdx in range(len(fitted_groups)):
-        startColumnIdx = 0
-        for group in fitted_groups[rowIdx]:
-            group_len = len(group.get_children())
-            annotation["states"].append({
-                "name": group.get_name(),
-                "bounds": Box(Vector2d(options.offset.x + startColumnIdx * (options.spacing.x + frame_size.x),
-                                       options.offset.y + rowIdx * (options.spacing.y + frame_size.y)).get_scaled(options.scaling_factor),
-                              Vector2d(group_len * frame_size.x + (group_len - 1) * options.spacing.x,
-                                       frame_size.y).get_scaled(options.scaling_factor)).to_json(),
-                "nframes": len(group.get_children())
-            })
-
-            startColumnIdx += group_len
-    
-    write_obj_to_file_as_json(annotation, filename + ".anim")
+    for clip in clips:
+        state = {
+            "name": clip.name,
+            "bounds": Box(clip.cell.position.get_scaled(options.scaling_factor),
+                          Vector2d(clip.frame_count * frame_size.x + (clip.frame_count - 1) * options.spacing.x,
+                                   frame_size.y).get_scaled(options.scaling_factor)).to_json(),
+            "nframes": clip.frame_count
+        }
+        if is_paged(options):
+            state["page"] = clip.cell.page
+        annotation["states"].append(state)
+    add_page_annotations(annotation, options, page_files)
 
-def get_tileset_row_count(layer_count: int, options: ExportOptions) -> tuple[int, int]:
-    if options.enforce_tiles_per_row and options.enforced_column_count > 0:
-        n_tiles_per_row = options.enforced_column_count
-    else:
-        n_tiles_per_row = int(round(math.sqrt(layer_count)))
+    write_annotations(annotation, filename + ".anim", options)
 
-    n_rows = int(layer_count / n_tiles_per_row)
-    if (n_tiles_per_row * n_rows) % layer_count != 0:
-        n_rows += 1 # There are some extra tiles
-    return (n_tiles_per_row, n_rows)
+def tilesetize(image: Gimp.Image,
+               options: ExportOptions) -> tuple[list[AtlasPage], list[PackedTile], int, int]:
+    layers = image.get_layers()
+    frame_size = Vector2d(image.get_width(), image.get_height())
 
-def create_out_image(in_image: Gimp.Image, options: ExportOptions, tiles_per_row: int, row_count: int) -> Gimp.Image:
-    return Gimp.Image.new(tiles_per_row * in_image.get_width() + 2 * options.offset.x + (tiles_per_row - 1) * options.spacing.x,
-                          row_count * in_image.get_height() + 2 * options.offset.y + (row_count - 1) * options.spacing.y,
-                          in_image.get_base_type())
+    layout = layout_tileset(len(layers), frame_size, options)
+    if layout is None:
+        log("Tiles do not fit into the maximum texture size!")
+        return ([], [], 0, 0)
 
-def tilesetize(image: Gimp.Image,
-               options: ExportOptions) -> tuple[Gimp.Image, int, int]:
+    (page_sizes, cells, tiles_per_row, rows_per_page) = layout
+    pages = [AtlasPage(page_size) for page_size in page_sizes]
+    tiles: list[PackedTile] = []
+    for (idx, cell) in enumerate(cells):
+        layer = layers[len(layers) - 1 - idx if options.invert_order else idx]
+        pages[cell.page].placements.append(FramePlacement(layer, cell.position))
+        tiles.append(PackedTile(layer.get_name(), Box(cell.position, frame_size), Vector2d(0, 0), cell.page))
+
+    return (pages, tiles, tiles_per_row, rows_per_page)
+
+def tilesetize_packed(image: Gimp.Image,
+                      options: ExportOptions) -> tuple[list[AtlasPage], list[PackedTile]]:
     layers = image.get_layers()
+    if options.invert_order:
+        layers = list(reversed(layers))
+    frame_size = Vector2d(image.get_width(), image.get_height())
 
-    (tiles_per_row, row_count) = get_tileset_row_count(len(layers), options)
-    
-    out_image = create_out_image(image, options, tiles_per_row, row_count)
-    
-    for idx in range(0, len(layers)):
-        columnIdx = idx % tiles_per_row
-        rowIdx = math.floor(idx / tiles_per_row)
-        layerIdx = len(layers) - 1 - idx if options.invert_order else idx
-        copy_layer_to_image(layers[layerIdx],
-                            out_image,
-                            options.offset.x + columnIdx * (image.get_width() + options.spacing.x),
-                            options.offset.y + rowIdx * (image.get_height() + options.spacing.y))
-    
-    Gimp.context_set_interpolation(Gimp.InterpolationType.NONE)
-    out_image.scale(out_image.get_width() * options.scaling_factor,
-                    out_image.get_height() * options.scaling_factor)
-
-    return (out_image, tiles_per_row, row_count)
-
-def get_next_best_fitting_group(groups: list[Gimp.GroupLayer],
-                                max_tiles_per_row: int,
-                                currently_used_tiles: int) -> Gimp.GroupLayer | None:
-    target_score = max_tiles_per_row - currently_used_tiles
-    score = -1
-    best_idx = -1
-    for idx in range(len(groups)):
-        current_score = len(groups[idx].get_children())
-        if current_score > target_score:
-            continue
+    crops = [get_frame_bounds(layer, frame_size, options.trim_tiles) for layer in layers]
+    packed_indices = [idx for idx in range(len(layers)) if crops[idx] is not None]
+    if len(packed_indices) == 0:
+        log("No tiles to export!")
+        return ([], [])
 
-        if score == -1 or score < current_score:
-            score = current_score
-            best_idx = idx
-    
-    if best_idx != -1:
-        result = groups.pop(best_idx)
-        return result
-    
-    return None
-
-def fit_groups(groups: list[Gimp.GroupLayer]) -> list[list[Gimp.GroupLayer]]:
-    group_lens = list(len(g.get_children()) for g in groups)
-    max_group_len = max(group_lens)
-
-    rows: list[list[Gimp.GroupLayer]] = [[]]
-    current_row_idx = 0
-    current_row_usage = 0
-    while len(groups) > 0:
-        group = get_next_best_fitting_group(groups, max_group_len, current_row_usage)
-        if group is None:
-            rows.append(list())
-            current_row_idx += 1
-            current_row_usage = 0
-            continue
+    page_layouts = find_rect_pages([(crops[idx].size.x, crops[idx].size.y) for idx in packed_indices],
+                                   options,
+                                   options.tileset_packing)
+    if page_layouts is None:
+        log("Tiles do not fit into the maximum texture size!")
+        return ([], [])
 
-        rows[current_row_idx].append(group)
-        current_row_usage += len(group.get_children())
+    pages: list[AtlasPage] = []
+    tiles: list[PackedTile] = [None] * len(packed_indices)
+    for (page_idx, (indices, positions, page_size)) in enumerate(page_layouts):
+        page = AtlasPage(page_size)
+        for (packed_idx, position) in zip(indices, positions):
+            idx = packed_indices[packed_idx]
+            page.placements.append(FramePlacement(layers[idx], position, crops[idx]))
+            tiles[packed_idx] = PackedTile(layers[idx].get_name(), Box(position, crops[idx].size), crops[idx].position, page_idx)
+        pages.append(page)
 
-    return rows
+    return (pages, tiles)
+
+def create_strategy_choice(strategies: dict[str, tuple]) -> Gimp.Choice:
+    choice = Gimp.Choice.new()
+    for idx, (name, (label, _)) in enumerate(strategies.items()):
+        choice.add(name, idx, label, "")
+    return choice
+
+def get_animation_groups(image: Gimp.Image) -> list[Gimp.GroupLayer]:
+    return list(filter(lambda x: x.is_group_layer(), image.get_layers()))
 
 def spritesheetize(image: Gimp.Image,
-                   options: ExportOptions) -> tuple[Gimp.Image, list[list[Gimp.GroupLayer]]]:
-    groups: list[Gimp.GroupLayer] = list(filter(lambda x: x.is_group_layer(), image.get_layers()))
+                   options: ExportOptions) -> tuple[list[AtlasPage], list[AnimationClip]]:
+    groups = get_animation_groups(image)
 
     if len(groups) == 0:
         log("No groups to export!")
-        return (None, [])
+        return ([], [])
 
-    fitted_groups = fit_groups(groups)
-    tiles_per_row = len(fitted_groups[0][0].get_children()) # First row always contains the longest animation
-    row_count = len(fitted_groups)
+    frame_size = Vector2d(image.get_width(), image.get_height())
+    group_lengths = [len(group.get_children()) for group in groups]
+    layout = layout_spritesheet(group_lengths, frame_size, options)
+    if layout is None:
+        log("Animation clips do not fit into the maximum texture size!")
+        return ([], [])
 
-    out_image = create_out_image(image, options, tiles_per_row, row_count)
-
-    for rowIdx in range(len(fitted_groups)):
-        columnIdx = 0
-        for group in fitted_groups[rowIdx]:
-            layers = group.get_children()
+    (page_sizes, rows, clip_cells) = layout
+    pages = [AtlasPage(page_size) for page_size in page_sizes]
+    clips: list[AnimationClip] = []
+    for row in rows:
+        for group_idx in row:
+            cell = clip_cells[group_idx]
+            layers = groups[group_idx].get_children()
             for idx in range(0, len(layers)):
                 layerIdx = len(layers) - 1 - idx if options.invert_order else idx
-                copy_layer_to_image(layers[layerIdx],
-                                    out_image,
-                                    options.offset.x + columnIdx * (image.get_width() + options.spacing.x),
-                                    options.offset.y + rowIdx * (image.get_height() + options.spacing.y))
-                columnIdx += 1
-    
-    Gimp.context_set_interpolation(Gimp.InterpolationType.NONE)
-    out_image.scale(out_image.get_width() * options.scaling_factor,
-                    out_image.get_height() * options.scaling_factor)
+                pages[cell.page].placements.append(FramePlacement(layers[layerIdx],
+                                                                  Vector2d(cell.position.x + idx * (frame_size.x + options.spacing.x),
+                                                                           cell.position.y)))
+            clips.append(AnimationClip(groups[group_idx].get_name(), len(layers), cell))
+
+    return (pages, clips)
+
+def spritesheetize_optimized(image: Gimp.Image,
+                             options: ExportOptions) -> tuple[list[AtlasPage], list[AtlasCell], list[AnimationState]]:
+    groups = get_animation_groups(image)
+
+    if len(groups) == 0:
+        log("No groups to export!")
+        return ([], [], [])
+
+    frame_size = Vector2d(image.get_width(), image.get_height())
+    unique_frames: list[tuple[Gimp.Layer, Box]] = []
+    frame_indices: dict[str, int] = {}
+    states: list[AnimationState] = []
+    for group in groups:
+        layers = group.get_children()
+        if options.invert_order:
+            layers = list(reversed(layers))
+
+        references: list[FrameReference] = []
+        for layer in layers:
+            trimmed_frame = get_trimmed_frame(layer, frame_size)
+            if trimmed_frame is None:
+                references.append(FrameReference(-1, Vector2d(0, 0)))
+                continue
+
+            (pixels, bounds) = trimmed_frame
+            frame_key = f"{pixels.width}x{pixels.height}:{pixels.get_hash()}"
+            if frame_key not in frame_indices:
+                frame_indices[frame_key] = len(unique_frames)
+                unique_frames.append((layer, bounds))
 
-    return (out_image, fitted_groups)
+            references.append(FrameReference(frame_indices[frame_key], bounds.position))
 
+        states.append(AnimationState(group.get_name(), references))
+
+    if len(unique_frames) == 0:
+        log("No frames to export!")
+        return ([], [], [])
+
+    strategy = get_frame_packing_strategy(len(unique_frames), options)
+    instrumentation.debug("Packing %d unique frames with %s", len(unique_frames), strategy)
+    page_layouts = find_rect_pages([(bounds.size.x, bounds.size.y) for (_, bounds) in unique_frames], options, strategy)
+    if page_layouts is None:
+        log("Frames do not fit into the maximum texture size!")
+        return ([], [], [])
+
+    pages: list[AtlasPage] = []
+    cells: list[AtlasCell] = [None] * len(unique_frames)
+    for (page_idx, (indices, positions, page_size)) in enumerate(page_layouts):
+        page = AtlasPage(page_size)
+        for (frame_idx, position) in zip(indices, positions):
+            (layer, bounds) = unique_frames[frame_idx]
+            page.placements.append(FramePlacement(layer, position, bounds))
+            cells[frame_idx] = AtlasCell(Box(position, bounds.size), page_idx)
+        pages.append(page)
+
+    return (pages, cells, states)
+
+def get_export_properties(config) -> dict[str, object]:
+    return { name: config.get_property(name) for name in EXPORT_PROPERTY_NAMES }
+
+def create_export_options(properties: dict[str, object]) -> ExportOptions:
+    return ExportOptions(Vector2d(properties["xoffset"],
+                                  properties["yoffset"]),
+                         Vector2d(properties["xspacing"],
+                                  properties["yspacing"]),
+                         properties["upscale-factor"],
+                         properties["invert-order"],
+                         properties["enforce-row-count"],
+                         properties["enforced-tiles-per-row"],
+                         properties["packing-strategy"],
+                         properties["tileset-packing"],
+                         properties["trim-tiles"],
+                         properties["power-of-two"],
+                         properties["max-atlas-size"],
+                         properties["optimize-frames"],
+                         properties["binary-annotations"])
+
+def save_pages(image: Gimp.Image,
+               pages: list[AtlasPage],
+               page_files: list[Gio.File],
+               options: ExportOptions,
+               streaming: bool,
+               incremental: bool,
+               pool: concurrent.futures.Executor | None):
+    # Pages are composed and saved one by one, so only one of them is in memory at a time
+    for (page, page_file) in zip(pages, page_files):
+        # Raw pixel buffers only cover normal layers, GIMP has to blend the other modes
+        layer_copy = has_blend_modes(page.placements)
+        if layer_copy and (streaming or incremental):
+            instrumentation.debug("%s has layers with blend modes, it is saved without streaming or incremental update",
+                                  page_file.get_path())
+
+        if streaming and not layer_copy:
+            with instrumentation.section("stream page"):
+                StreamingPngCompositor(pool).write(image,
+                                                   page.placements,
+                                                   page.size,
+                                                   options.scaling_factor,
+                                                   page_file,
+                                                   options.power_of_two)
+            continue
+
+        if incremental and not layer_copy:
+            with instrumentation.section("incremental page"):
+                IncrementalCompositor(pool, page_file).write(image,
+                                                             page.placements,
+                                                             page.size,
+                                                             options.scaling_factor,
+                                                             options.power_of_two)
+            continue
+
+        compositor = LayerCopyCompositor() if layer_copy else BufferCompositor(pool)
+        with instrumentation.section("compose page"):
+            out_image = compositor.compose(image, page.placements, page.size, options.scaling_factor)
+
+        if options.power_of_two:
+            pad_image_to_power_of_two(out_image)
+
+        with instrumentation.section("save page"):
+            Gimp.file_save(Gimp.RunMode.NONINTERACTIVE,
+                           out_image,
+                           page_file,
+                           None)
+        out_image.delete()
+
+def export_image(image: Gimp.Image, outfile: Gio.File, properties: dict[str, object]) -> bool:
+    options = create_export_options(properties)
+    frame_size = Vector2d(image.get_width(), image.get_height())
+
+    if properties["groups-are-animations"] and options.optimize_frames:
+        (pages, cells, states) = spritesheetize_optimized(image, options)
+        page_files = get_page_files(outfile, len(pages))
+
+        if len(pages) == 0:
+            return False
+
+        export_optimized_spritesheet_annotations(outfile.get_path(),
+                                                 frame_size,
+                                                 options,
+                                                 cells,
+                                                 states,
+                                                 page_files)
+
+    elif properties["groups-are-animations"]:
+        (pages, clips) = spritesheetize(image, options)
+        page_files = get_page_files(outfile, len(pages))
+
+        if len(pages) == 0:
+            return False
+
+        export_spritesheet_annotations(outfile.get_path(),
+                                       frame_size,
+                                       options,
+                                       clips,
+                                       page_files)
+
+    elif options.tileset_packing != "grid":
+        (pages, tiles) = tilesetize_packed(image, options)
+        page_files = get_page_files(outfile, len(pages))
+
+        if len(pages) == 0:
+            return False
+
+        export_packed_tileset_annotations(outfile.get_path(),
+                                          frame_size,
+                                          options,
+                                          tiles,
+                                          page_files)
+
+    else:
+        (pages, tiles, tiles_per_row, rows_per_page) = tilesetize(image, options)
+        page_files = get_page_files(outfile, len(pages))
+
+        if len(pages) == 0:
+            return False
+
+        export_tileset_annotations(outfile.get_path(),
+                                   frame_size,
+                                   options,
+                                   tiles_per_row, rows_per_page,
+                                   tiles,
+                                   page_files)
+
+    streaming = properties["streaming-png"] and outfile.get_path().lower().endswith(".png")
+    if properties["streaming-png"] and not streaming:
+        log("Streaming export only supports PNG files, saving through GIMP instead")
+
+    # Worker threads are started once and shared by all pages
+    worker_count = properties["worker-count"]
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) if worker_count > 1 else None
+    try:
+        save_pages(image, pages, page_files, options, streaming, properties["incremental"], pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return True
 
 def spritify_run(procedure: Gimp.Procedure,
                  run_mode: Gimp.RunMode,
@@ -277,56 +1113,244 @@ def spritify_run(procedure: Gimp.Procedure,
     if run_mode == Gimp.RunMode.INTERACTIVE:
         create_dialog_with_all_procedure_params(procedure, config)
 
-    outfile = config.get_property("outfile")
-    do_spritesheetize = config.get_property("groups-are-animations")
+    if not export_image(image, config.get_property("outfile"), get_export_properties(config)):
+        return procedure.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, None)
+
+    return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
-    options = ExportOptions(Vector2d(config.get_property("xoffset"),
-                                     config.get_property("yoffset")),
-                            Vector2d(config.get_property("xspacing"),
-                                     config.get_property("yspacing")),
-                            config.get_property("upscale-factor"),
-                            config.get_property("invert-order"),
-                            config.get_property("enforce-row-count"),
-                            config.get_property("enforced-tiles-per-row"))
+def read_batch_manifest(manifest: Gio.File) -> list[dict]:
+    fp = open(manifest.get_path(), "rt")
+    entries = json.load(fp)
+    fp.close()
 
+    # Relative paths in the manifest are relative to the manifest itself
+    manifest_dir = os.path.dirname(manifest.get_path())
+    for entry in entries:
+        entry["input"] = os.path.join(manifest_dir, entry["input"])
+        entry["output"] = os.path.join(manifest_dir, entry["output"])
 
-    if do_spritesheetize:
-        (out_image, fitted_groups) = spritesheetize(image, options)
+    return entries
 
-        if out_image is None:
-            return procedure.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, None)
-        
-        export_spritesheet_annotations(outfile.get_path(),
-                                       Vector2d(image.get_width(), image.get_height()),
-                                       options,
-                                       fitted_groups)
+def export_batch_entry(entry: dict, properties: dict[str, object], compare_packing: bool) -> dict:
+    file_report = {
+        "input": entry["input"],
+        "output": entry["output"],
+        "success": False
+    }
 
-    else:
-        (out_image, tiles_per_row, row_count) = tilesetize(image, options)
-        export_tileset_annotations(outfile.get_path(),
-                                   Vector2d(image.get_width(), image.get_height()),
-                                   options,
-                                   tiles_per_row, row_count)
+    start = time.perf_counter()
+    image = None
+    try:
+        image = Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(entry["input"]))
+        file_report["load_seconds"] = time.perf_counter() - start
+        if image is None:
+            file_report["error"] = "Could not load image"
+            return file_report
+
+        file_report["success"] = export_image(image, Gio.File.new_for_path(entry["output"]), properties)
+
+        group_lengths = [len(group.get_children()) for group in get_animation_groups(image)]
+        if properties["groups-are-animations"] and len(group_lengths) > 0:
+            # Packing with every strategy is expensive (optimal can search for a long time), so it's opt-in
+            strategies = list(PACKING_STRATEGIES) if compare_packing else [properties["packing-strategy"]]
+            file_report["packing"] = get_packing_report(group_lengths,
+                                                        Vector2d(image.get_width(), image.get_height()),
+                                                        create_export_options(properties),
+                                                        strategies)
+    except Exception as e:
+        # GIMP reports failed loads and saves as GLib.Error, one broken project must not stop the whole batch
+        file_report["success"] = False
+        file_report["error"] = str(e)
+    finally:
+        file_report["total_seconds"] = time.perf_counter() - start
+        if image is not None:
+            image.delete()
+
+    return file_report
+
+def spritify_batch_run(procedure: Gimp.Procedure, config, data):
+    if config.get_property("run-mode") == Gimp.RunMode.INTERACTIVE:
+        create_dialog_with_all_procedure_params(procedure, config)
+
+    entries = read_batch_manifest(config.get_property("manifest"))
+    default_properties = get_export_properties(config)
+    compare_packing = config.get_property("compare-packing")
+
+    report = []
+    batch_start = time.perf_counter()
+    for entry in entries:
+        properties = dict(default_properties)
+        properties.update(entry.get("options", {}))
+
+        file_report = export_batch_entry(entry, properties, compare_packing)
+        report.append(file_report)
+        if file_report["success"]:
+            log(f"{entry['input']}: exported in {file_report['total_seconds']:.3f}s")
+        else:
+            log(f"{entry['input']}: failed after {file_report['total_seconds']:.3f}s: {file_report.get('error', 'export failed')}")
+
+    failed_count = len(list(filter(lambda x: not x["success"], report)))
+    log(f"Exported {len(report) - failed_count} of {len(entries)} files in {time.perf_counter() - batch_start:.3f}s")
+
+    report_file = config.get_property("report")
+    if report_file is not None:
+        write_obj_to_file_as_json(report, report_file.get_path())
+
+    if failed_count > 0:
+        return procedure.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR,
+                                           GLib.Error(f"{failed_count} files failed to export"))
 
-    Gimp.file_save(Gimp.RunMode.NONINTERACTIVE,
-                   out_image,
-                   outfile,
-                   None)
-    
     return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
+def add_export_arguments(procedure: Gimp.Procedure):
+    procedure.add_boolean_argument("groups-are-animations",
+                                   "Export layer groups as animation clips",
+                                   None,
+                                   False,
+                                   GObject.ParamFlags.READWRITE)
+    
+    procedure.add_int_argument("upscale-factor",
+                                "Upscale factor",
+                                None,
+                                1,
+                                16,
+                                1,
+                                GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_argument("xoffset",
+                                "Horizontal padding",
+                                None,
+                                0,
+                                1024,
+                                0,
+                                GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_argument("yoffset",
+                                "Vertical padding",
+                                None,
+                                0,
+                                1024,
+                                0,
+                                GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_argument("xspacing",
+                                "Horizontal spacing",
+                                None,
+                                0,
+                                1024,
+                                0,
+                                GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_argument("yspacing",
+                                "Vertical spacing",
+                                None,
+                                0,
+                                1024,
+                                0,
+                                GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("enforce-row-count",
+                                       "Enforce specific tiles per row",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_aux_argument("enforced-tiles-per-row",
+                                   "Enforced tiles per row count",
+                                   None,
+                                   0,
+                                   16,
+                                   0,
+                                   GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("invert-order",
+                                       "Export in inverted order",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_aux_argument("worker-count",
+                                   "Worker threads",
+                                   None,
+                                   1,
+                                   64,
+                                   1,
+                                   GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("incremental",
+                                       "Only update frames changed since the last export (experimental)",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_choice_aux_argument("packing-strategy",
+                                      "Animation clip packing",
+                                      None,
+                                      create_strategy_choice(PACKING_STRATEGIES),
+                                      "greedy",
+                                      GObject.ParamFlags.READWRITE)
+
+    procedure.add_choice_aux_argument("tileset-packing",
+                                      "Tileset packing",
+                                      None,
+                                      create_strategy_choice(RECT_PACKING_STRATEGIES),
+                                      "grid",
+                                      GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("trim-tiles",
+                                       "Trim transparent borders of packed tiles",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("power-of-two",
+                                       "Power of two texture size",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_int_aux_argument("max-atlas-size",
+                                   "Maximum texture size (0 = unlimited)",
+                                   None,
+                                   0,
+                                   65536,
+                                   0,
+                                   GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("optimize-frames",
+                                       "Trim and deduplicate animation frames",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("streaming-png",
+                                       "Stream PNG output row by row (low memory)",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
+    procedure.add_boolean_aux_argument("binary-annotations",
+                                       "Also write binary annotations (.bin)",
+                                       None,
+                                       False,
+                                       GObject.ParamFlags.READWRITE)
+
 class Spritify (Gimp.PlugIn):
     def do_query_procedures(self):
-        return [ plug_in_proc ]
+        return [ plug_in_proc, plug_in_batch_proc ]
 
     def do_create_procedure(self, name: str):
-        if name != plug_in_proc:
-            return None
+        if name == plug_in_proc:
+            return self.create_export_procedure(name)
+        elif name == plug_in_batch_proc:
+            return self.create_batch_procedure(name)
+        return None
 
+    def create_export_procedure(self, name: str):
         procedure = Gimp.ImageProcedure.new(self,
                                             name,
                                             Gimp.PDBProcType.PLUGIN,
-                                            spritify_run,
+                                            instrumentation.instrument_run(plug_in_name, spritify_run),
                                             None)
 
         procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.DRAWABLE |
@@ -343,73 +1367,53 @@ class Spritify (Gimp.PlugIn):
                                     False,
                                     None,
                                     GObject.ParamFlags.READWRITE)
-        
-        procedure.add_boolean_argument("groups-are-animations",
-                                       "Export layer groups as animation clips",
-                                       None,
-                                       False,
-                                       GObject.ParamFlags.READWRITE)
-        
-        procedure.add_int_argument("upscale-factor",
-                                    "Upscale factor",
-                                    None,
-                                    1,
-                                    16,
-                                    1,
-                                    GObject.ParamFlags.READWRITE)
 
-        procedure.add_int_argument("xoffset",
-                                    "Horizontal padding",
-                                    None,
-                                    0,
-                                    1024,
-                                    0,
-                                    GObject.ParamFlags.READWRITE)
+        add_export_arguments(procedure)
+
+        return procedure
 
-        procedure.add_int_argument("yoffset",
-                                    "Vertical padding",
+    def create_batch_procedure(self, name: str):
+        procedure = Gimp.Procedure.new(self,
+                                       name,
+                                       Gimp.PDBProcType.PLUGIN,
+                                       instrumentation.instrument_run(plug_in_name, spritify_batch_run),
+                                       None)
+
+        procedure.set_attribution(plug_in_author, plug_in_org, plug_in_year)
+        procedure.set_documentation(plug_in_batch_docs, None)
+
+        procedure.add_enum_argument("run-mode",
+                                    "Run mode",
                                     None,
-                                    0,
-                                    1024,
-                                    0,
+                                    Gimp.RunMode,
+                                    Gimp.RunMode.NONINTERACTIVE,
                                     GObject.ParamFlags.READWRITE)
 
-        procedure.add_int_argument("xspacing",
-                                    "Horizontal spacing",
+        procedure.add_file_argument("manifest",
+                                    "Manifest file",
+                                    None,
+                                    Gimp.FileChooserAction.OPEN,
+                                    False,
                                     None,
-                                    0,
-                                    1024,
-                                    0,
                                     GObject.ParamFlags.READWRITE)
 
-        procedure.add_int_argument("yspacing",
-                                    "Vertical spacing",
+        procedure.add_file_argument("report",
+                                    "Timing report file",
+                                    None,
+                                    Gimp.FileChooserAction.SAVE,
+                                    True,
                                     None,
-                                    0,
-                                    1024,
-                                    0,
                                     GObject.ParamFlags.READWRITE)
 
-        procedure.add_boolean_aux_argument("enforce-row-count",
-                                           "Enforce specific tiles per row",
-                                           None,
-                                           False,
-                                           GObject.ParamFlags.READWRITE)
-
-        procedure.add_int_aux_argument("enforced-tiles-per-row",
-                                       "Enforced tiles per row count",
+        procedure.add_boolean_argument("compare-packing",
+                                       "Report the packing of every clip packing strategy",
                                        None,
-                                       0,
-                                       16,
-                                       0,
+                                       False,
                                        GObject.ParamFlags.READWRITE)
 
-        procedure.add_boolean_aux_argument("invert-order",
-                                           "Export in inverted order",
-                                           None,
-                                           False,
-                                           GObject.ParamFlags.READWRITE)
+        add_export_arguments(procedure)
 
         return procedure
 
-Gimp.main(Spritify.__gtype__, sys.argv)
+if __name__ == "__main__":
+    Gimp.main(Spritify.__gtype__, sys.argv)
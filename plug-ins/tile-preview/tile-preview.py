@@ -10,7 +10,15 @@ from gi.repository import GObject
 from gi.repository import GLib
 from gi.repository import Gtk
 from gi.repository import Gegl
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf
 import sys
+import os
+import collections
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pixel-art-common"))
+import instrumentation
+import change_detection
 
 plug_in_proc = "plug-in-nerudaj-tile-preview"
 plug_in_binary = "py3-tile-preview"
@@ -21,6 +29,10 @@ plug_in_docs = "Plugin for previewing how layers appear when tiled."
 plug_in_name = "Tile Preview"
 plug_in_path = "<Image>/Pixel Art"
 
+TILE_FORMAT = "R'G'B'A u8"
+BYTES_PER_PIXEL = 4
+TILE_CACHE_LIMIT_MB = 64
+
 class GtkBuilder:
     @staticmethod
     def create_window(title: str) -> Gtk.Window:
@@ -91,18 +103,98 @@ class GtkContext:
         self.window = None
         self.display_box = None
         self.preview_box = None
-        self.temp_img = None
         self.bottom_control_vbox = None
         self.layer_select_combos = [ None, None ]
 
+def render_tile(layer: Gimp.Layer, width: int, height: int) -> GdkPixbuf.Pixbuf:
+    (_, x, y) = layer.get_offsets()
+
+    # Read in image coordinates, areas not covered by the layer come out transparent
+    pixels = layer.get_buffer().get(Gegl.Rectangle.new(-x, -y, width, height),
+                                    1.0,
+                                    TILE_FORMAT,
+                                    Gegl.AbyssPolicy.NONE)
+    return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(pixels),
+                                           GdkPixbuf.Colorspace.RGB,
+                                           True,
+                                           8,
+                                           width,
+                                           height,
+                                           width * BYTES_PER_PIXEL)
+
+class TileCache:
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 change_poller: change_detection.ChangePoller | None = None,
+                 memory_limit: int = TILE_CACHE_LIMIT_MB * 1024 * 1024):
+        self.width = width
+        self.height = height
+        self.change_poller = change_poller
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        # Least recently used first, tiles of layers that are no longer previewed drop out eventually
+        self.tiles: collections.OrderedDict[int, GdkPixbuf.Pixbuf] = collections.OrderedDict()
+
+    def get_tile(self, layer: Gimp.Layer) -> GdkPixbuf.Pixbuf:
+        layer_id = layer.get_id()
+        if layer_id in self.tiles:
+            self.tiles.move_to_end(layer_id)
+            return self.tiles[layer_id]
+
+        # Checksum of what is being rendered, later edits are detected against it
+        if self.change_poller is not None:
+            self.change_poller.remember(layer)
+        tile = render_tile(layer, self.width, self.height)
+        self.tiles[layer_id] = tile
+        self.memory_used += tile.get_byte_length()
+        self.evict()
+        return tile
+
+    def evict(self):
+        # Both previewed tiles always stay
+        while self.memory_used > self.memory_limit and len(self.tiles) > 2:
+            (_, tile) = self.tiles.popitem(last=False)
+            self.memory_used -= tile.get_byte_length()
+
+    def invalidate_tile(self, layer_id: int):
+        if layer_id in self.tiles:
+            self.memory_used -= self.tiles.pop(layer_id).get_byte_length()
+
+    def invalidate(self):
+        self.tiles.clear()
+        self.memory_used = 0
+
+class TileCanvas:
+    def __init__(self, dim: Dim, tile_cache: TileCache):
+        self.tile_cache = tile_cache
+        self.pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, dim.width, dim.height)
+        self.pixbuf.fill(0)
+
+    def paste(self, layer: Gimp.Layer, x: int, y: int):
+        if layer is None:
+            return
+
+        # Tiles reaching past the canvas are clipped
+        tile = self.tile_cache.get_tile(layer)
+        width = min(tile.get_width(), self.pixbuf.get_width() - x)
+        height = min(tile.get_height(), self.pixbuf.get_height() - y)
+        if width <= 0 or height <= 0:
+            return
+
+        tile.composite(self.pixbuf, x, y, width, height, x, y, 1.0, 1.0, GdkPixbuf.InterpType.NEAREST, 255)
+
 class PluginContext:
     def __init__(self, image: Gimp.Image):
         self.mode = RenderMode.BLOCK
         self.layer_names = ["", ""]
+        self.layers: list[Gimp.Layer | None] = [None, None]
         self.zoom_level = 1.0
         self.skip_next_update = False
         self.gtk_ctx = GtkContext()
         self.image_ref = image
+        self.change_poller = change_detection.ChangePoller()
+        self.tile_cache = TileCache(image.get_width(), image.get_height(), self.change_poller)
 
     def __str__(self):
         return "PreviewContext(mode = {}, zoom = {}, names = {})".format(self.mode, self.zoom_level, self.layer_names)
@@ -111,16 +203,8 @@ class PluginContext:
         return self.__str__()
 
 class RenderStrategyInterface:
-    def copy_layer_to(self, source: Gimp.Layer, destination: Gimp.Image, x: int, y: int):
-        def make_layer_visible_with_alpha(layer):
-            if len(layer.get_children()) == 0: # Cannot add alpha for layer group
-                layer.add_alpha()
-            layer.set_visible(True)
-
-        temp_layer = Gimp.Layer.new_from_drawable(source, destination)
-        make_layer_visible_with_alpha(temp_layer)
-        destination.insert_layer(temp_layer, None, 0)
-        temp_layer.transform_translate(x, y)
+    def copy_layer_to(self, source: Gimp.Layer, destination: TileCanvas, x: int, y: int):
+        destination.paste(source, x, y)
 
     def construct_preview(self, target, dim: Dim, layer1, layer2):
         pass
@@ -236,7 +320,7 @@ class ZoomHandler:
     @staticmethod
     def zoom_to_fit(_: Gtk.Widget, context: PluginContext):
         if not context.gtk_ctx.display_box or not context.image_ref:
-            log("DEBUG: Zoom to fit called but display box or image reference is not set.")
+            instrumentation.debug("Zoom to fit called but display box or image reference is not set.")
             return
         
         img_w = context.image_ref.get_width() * 3
@@ -253,40 +337,26 @@ class ZoomHandler:
         context.zoom_level = max(0.1, context.zoom_level)
         update_preview(context, force=True)
 
-def get_preview_image(image_type,
-                      dim: Dim,
-                      zoom: int,
-                      mode: RenderMode,
-                      layer1: Gimp.Layer,
-                      layer2: Gimp.Layer,
-                      gtk_ctx: GtkContext,
-                      render_strategy):
+def get_preview_pixbuf(dim: Dim,
+                       zoom: float,
+                       layer1: Gimp.Layer,
+                       layer2: Gimp.Layer,
+                       tile_cache: TileCache,
+                       render_strategy) -> GdkPixbuf.Pixbuf:
 
     # Compute base image size
     new_image_dim = render_strategy.get_image_dim(dim, layer2)
 
-    # Create temp image that will accomodate new layers
-    if gtk_ctx.temp_img:
-        #gimp.delete(gtk_ctx.temp_img)
-        pass
-
-    gtk_ctx.temp_img = Gimp.Image.new(
-        new_image_dim.width,
-        new_image_dim.height,
-        image_type)
-    gtk_ctx.temp_img.undo_disable()
+    # Tiles are composed from cached pixbufs, only layers that changed are read from GIMP
+    canvas = TileCanvas(new_image_dim, tile_cache)
+    render_strategy.construct_preview(canvas, dim, layer1, layer2)
 
-    render_strategy.construct_preview(gtk_ctx.temp_img, dim, layer1, layer2)
+    # Zoom without interpolation
+    return canvas.pixbuf.scale_simple(max(1, int(new_image_dim.width * zoom)),
+                                      max(1, int(new_image_dim.height * zoom)),
+                                      GdkPixbuf.InterpType.NEAREST)
 
-    # Disable interpolation and zoom the image by scaling
-    Gimp.context_set_interpolation(Gimp.InterpolationType.NONE)
-    final_layer = gtk_ctx.temp_img.flatten()
-    gtk_ctx.temp_img.scale(new_image_dim.width * zoom,
-                           new_image_dim.height * zoom)
-
-    return final_layer
-
-def update_preview(context: PluginContext, force: bool = False):
+def render_preview(context: PluginContext):
 
     def get_layer_from_image(image: Gimp.Image, name: str) -> Gimp.Layer | None:
         for layer in image.get_layers():
@@ -294,38 +364,47 @@ def update_preview(context: PluginContext, force: bool = False):
                 return layer
         return None
 
-    def redraw_preview(gtk_ctx: GtkContext, drawable: Gimp.Drawable):
-        if gtk_ctx.preview_box:
-            gtk_ctx.display_box.remove(gtk_ctx.preview_box)
-
-        gtk_ctx.preview_box = GimpUi.DrawablePreview.new_from_drawable(drawable)
-        gtk_ctx.display_box.pack_start(gtk_ctx.preview_box, False, True, 0)
-
-        gtk_ctx.window.show_all()
-
-    if context.skip_next_update:
-        context.skip_next_update = False
-        return
-
     layer1 = get_layer_from_image(context.image_ref, context.layer_names[0])
     layer2 = get_layer_from_image(context.image_ref, context.layer_names[1])
+    context.layers = [layer1, layer2]
 
     if not layer1 and not layer2:
         log("No layers to render!")
         return
 
-    layer_to_draw = get_preview_image(
-        context.image_ref.get_base_type(),
+    preview = get_preview_pixbuf(
         Dim(context.image_ref.get_width(),
             context.image_ref.get_height()),
         context.zoom_level,
-        context.mode,
         layer1,
         layer2,
-        context.gtk_ctx,
+        context.tile_cache,
         RenderStrategyFactory.get_strategy(context.mode))
 
-    redraw_preview(context.gtk_ctx, layer_to_draw)
+    context.gtk_ctx.preview_box.set_from_pixbuf(preview)
+
+def update_preview(context: PluginContext, force: bool = False):
+    if context.skip_next_update:
+        context.skip_next_update = False
+        return
+
+    render_preview(context)
+
+def poll_changes(context: PluginContext) -> bool:
+    layers = [layer for layer in context.layers if layer is not None]
+    if len(layers) == 0:
+        return GLib.SOURCE_CONTINUE
+
+    changed = context.change_poller.poll(layers)
+    if len(changed) == 0:
+        return GLib.SOURCE_CONTINUE
+
+    instrumentation.debug("Tiles changed: %d", len(changed))
+    for layer in changed:
+        context.tile_cache.invalidate_tile(layer.get_id())
+    # Skipping is meant for the updates triggered by rebuilding the combos, the poller must not consume it
+    render_preview(context)
+    return GLib.SOURCE_CONTINUE
 
 def create_layer_select_combo(context: PluginContext, index: int, name_to_select=None):
 
@@ -381,6 +460,7 @@ def refresh_combos(_: Gtk.Widget, context: PluginContext, count: int):
         context.gtk_ctx.bottom_control_vbox.remove(
             context.gtk_ctx.layer_select_combos[index])
 
+    context.tile_cache.invalidate()
     context.skip_next_update = True
     for index in range(count):
         create_layer_select_combo(context, index, name_to_select=names_to_select[index])
@@ -415,6 +495,8 @@ def tile_preview_run(procedure, run_mode: Gimp.RunMode, image: Gimp.Image, drawa
     zoom_to_fit_btn.connect("clicked", ZoomHandler.zoom_to_fit, context)
 
     context.gtk_ctx.display_box = GtkBuilder.create_hbox(window_box, fill=True)
+    context.gtk_ctx.preview_box = Gtk.Image.new()
+    context.gtk_ctx.display_box.pack_start(context.gtk_ctx.preview_box, False, True, 0)
     bottom_wrap_hbox = GtkBuilder.create_hbox(window_box)
     bottom_label_vbox = GtkBuilder.create_vbox(bottom_wrap_hbox)
     context.gtk_ctx.bottom_control_vbox = GtkBuilder.create_vbox(bottom_wrap_hbox)
@@ -450,7 +532,10 @@ def tile_preview_run(procedure, run_mode: Gimp.RunMode, image: Gimp.Image, drawa
 
     window_box.show_all()
     context.gtk_ctx.window.show()
+    # Edits of the previewed layers show up without pressing Refresh
+    poll_source_id = GLib.timeout_add(change_detection.POLL_INTERVAL_MS, poll_changes, context)
     Gtk.main()
+    GLib.source_remove(poll_source_id)
 
     return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
@@ -465,7 +550,7 @@ class TilePreview (Gimp.PlugIn):
         procedure = Gimp.ImageProcedure.new(self,
                                             name,
                                             Gimp.PDBProcType.PLUGIN,
-                                            tile_preview_run,
+                                            instrumentation.instrument_run(plug_in_name, tile_preview_run),
                                             None)
 
         procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.DRAWABLE |
@@ -477,4 +562,5 @@ class TilePreview (Gimp.PlugIn):
 
         return procedure
 
-Gimp.main(TilePreview.__gtype__, sys.argv)
+if __name__ == "__main__":
+    Gimp.main(TilePreview.__gtype__, sys.argv)
@@ -0,0 +1,151 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plug-ins", "spritesheetize"))
+from annotation_format import BinaryAnnotations, encode_annotations, write_binary_annotations
+
+# Annotations below have the same shape as the ones written by export_*_annotations in spritesheetize.py
+
+def box(left: int, top: int, width: int, height: int) -> dict:
+    return { "left": left, "top": top, "width": width, "height": height }
+
+def offset(horizontal: int, vertical: int) -> dict:
+    return { "horizontal": horizontal, "vertical": vertical }
+
+FRAME = { "width": 16, "height": 24 }
+SPACING = offset(2, 3)
+
+GRID_TILESET = {
+    "frame": FRAME,
+    "spacing": SPACING,
+    "upscale": 2,
+    "bounds": box(4, 4, 70, 78)
+}
+
+PAGED_GRID_TILESET = {
+    "frame": FRAME,
+    "spacing": SPACING,
+    "upscale": 2,
+    "bounds": box(4, 4, 34, 24),
+    "tiles": [
+        { "name": "grass", "bounds": box(4, 4, 16, 24), "offset": offset(0, 0), "page": 0 },
+        { "name": "water", "bounds": box(22, 4, 16, 24), "offset": offset(0, 0), "page": 0 },
+        { "name": "rock", "bounds": box(4, 4, 16, 24), "offset": offset(0, 0), "page": 1 }
+    ],
+    "pages": ["sheet.png", "sheet-1.png"]
+}
+
+PACKED_TILESET = {
+    "frame": FRAME,
+    "spacing": SPACING,
+    "upscale": 2,
+    "tiles": [
+        { "name": "tree", "bounds": box(0, 0, 12, 20), "offset": offset(2, 4) },
+        { "name": "bush", "bounds": box(14, 0, 9, 7), "offset": offset(3, 17) },
+        { "name": "ünïcode", "bounds": box(0, 23, 16, 24), "offset": offset(0, 0) }
+    ]
+}
+
+PAGED_PACKED_TILESET = {
+    "frame": FRAME,
+    "spacing": SPACING,
+    "upscale": 2,
+    "tiles": [
+        { "name": "tree", "bounds": box(0, 0, 12, 20), "offset": offset(2, 4), "page": 0 },
+        { "name": "bush", "bounds": box(0, 0, 9, 7), "offset": offset(3, 17), "page": 1 }
+    ],
+    "pages": ["atlas.png", "atlas-1.png"]
+}
+
+SPRITESHEET = {
+    "defaults": { "frame": FRAME, "spacing": SPACING, "upscale": 2 },
+    "states": [
+        { "name": "idle", "bounds": box(0, 0, 70, 24), "nframes": 4 },
+        { "name": "walk", "bounds": box(0, 27, 106, 24), "nframes": 6 },
+        { "name": "jump", "bounds": box(72, 0, 16, 24), "nframes": 1 }
+    ]
+}
+
+PAGED_SPRITESHEET = {
+    "defaults": { "frame": FRAME, "spacing": SPACING, "upscale": 2 },
+    "states": [
+        { "name": "idle", "bounds": box(0, 0, 70, 24), "nframes": 4, "page": 0 },
+        { "name": "walk", "bounds": box(0, 0, 106, 24), "nframes": 6, "page": 1 }
+    ],
+    "pages": ["hero.png", "hero-1.png"]
+}
+
+OPTIMIZED_SPRITESHEET = {
+    "defaults": { "frame": FRAME, "spacing": SPACING, "upscale": 2 },
+    "frames": [box(0, 0, 10, 20), box(12, 0, 8, 22), box(0, 22, 16, 24)],
+    "states": [
+        { "name": "idle", "nframes": 3, "frames": [
+            { "index": 0, "offset": offset(3, 4) },
+            { "index": 1, "offset": offset(4, 2) },
+            { "index": 0, "offset": offset(3, 4) }
+        ] },
+        { "name": "blink", "nframes": 2, "frames": [
+            { "index": 2, "offset": offset(0, 0) },
+            { "index": -1, "offset": offset(0, 0) }
+        ] }
+    ]
+}
+
+PAGED_OPTIMIZED_SPRITESHEET = {
+    "defaults": { "frame": FRAME, "spacing": SPACING, "upscale": 2 },
+    "frames": [dict(box(0, 0, 10, 20), page=0), dict(box(0, 0, 8, 22), page=1)],
+    "states": [
+        { "name": "idle", "nframes": 2, "frames": [
+            { "index": 0, "offset": offset(3, 4) },
+            { "index": 1, "offset": offset(4, 2) }
+        ] }
+    ],
+    "pages": ["hero.png", "hero-1.png"]
+}
+
+ANNOTATIONS = {
+    "grid-tileset": GRID_TILESET,
+    "paged-grid-tileset": PAGED_GRID_TILESET,
+    "packed-tileset": PACKED_TILESET,
+    "paged-packed-tileset": PAGED_PACKED_TILESET,
+    "spritesheet": SPRITESHEET,
+    "paged-spritesheet": PAGED_SPRITESHEET,
+    "optimized-spritesheet": OPTIMIZED_SPRITESHEET,
+    "paged-optimized-spritesheet": PAGED_OPTIMIZED_SPRITESHEET
+}
+
+@pytest.mark.parametrize("name", list(ANNOTATIONS))
+def test_round_trip(name: str):
+    annotation = ANNOTATIONS[name]
+    assert BinaryAnnotations(encode_annotations(annotation)).to_json() == annotation
+
+@pytest.mark.parametrize("name", list(ANNOTATIONS))
+def test_round_trip_through_file(name: str, tmp_path):
+    annotation = ANNOTATIONS[name]
+    filename = str(tmp_path / "sheet.png.bin")
+    write_binary_annotations(annotation, filename)
+    assert BinaryAnnotations.open(filename).to_json() == annotation
+
+def test_upscale_defaults_to_one():
+    annotation = { "frame": FRAME, "spacing": SPACING, "bounds": box(0, 0, 16, 24) }
+    assert BinaryAnnotations(encode_annotations(annotation)).upscale == 1
+
+def test_records_are_indexed_directly():
+    annotations = BinaryAnnotations(encode_annotations(OPTIMIZED_SPRITESHEET))
+    idx = annotations.find_state("blink")
+    (name, _, _, _, _, _, nframes, first_frame_ref) = annotations.get_state(idx)
+    assert (name, nframes) == ("blink", 2)
+    assert annotations.get_frame_ref(first_frame_ref) == (2, 0, 0)
+    assert annotations.get_frame_ref(first_frame_ref + 1)[0] == -1
+    assert annotations.find_state("missing") == -1
+
+def test_rejects_other_files():
+    with pytest.raises(ValueError):
+        BinaryAnnotations(b"\x89PNG\r\n\x1a\n" + bytes(64))
+
+def test_rejects_truncated_file():
+    data = encode_annotations(PACKED_TILESET)
+    with pytest.raises(ValueError):
+        BinaryAnnotations(data[:-4])
@@ -0,0 +1,227 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plug-ins", "spritesheetize"))
+from layout import (Vector2d,
+                    ExportOptions,
+                    RECT_PACKING_STRATEGIES,
+                    PACKING_STRATEGIES,
+                    MAXRECTS_MAX_FRAMES,
+                    get_atlas_size_limit,
+                    get_frame_packing_strategy,
+                    get_power_of_two,
+                    find_rect_pages,
+                    fit_groups,
+                    layout_spritesheet,
+                    layout_tileset,
+                    pack_rects_maxrects,
+                    pack_rects_skyline)
+
+SEEDS = range(20)
+RECT_STRATEGIES = [strategy for (strategy, (_, pack)) in RECT_PACKING_STRATEGIES.items() if pack is not None]
+
+def create_options(rng: random.Random, **kwargs) -> ExportOptions:
+    options = {
+        "offset": Vector2d(rng.randint(0, 4), rng.randint(0, 4)),
+        "spacing": Vector2d(rng.randint(0, 3), rng.randint(0, 3)),
+        "upscale_factor": rng.choice([1, 1, 2, 3]),
+        "invert_order": False,
+        "enforce_tiles_per_row": False,
+        "enforced_column_count": 0,
+        "power_of_two": rng.random() < 0.5,
+        "max_atlas_size": rng.choice([0, 0, 200, 256, 300, 512])
+    }
+    options.update(kwargs)
+    return ExportOptions(**options)
+
+def random_sizes(rng: random.Random, count: int, max_size: int) -> list[tuple[int, int]]:
+    return [(rng.randint(1, max_size), rng.randint(1, max_size)) for _ in range(count)]
+
+def overlaps(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def assert_no_overlap(rects: list[tuple[int, int, int, int]]):
+    for i in range(len(rects)):
+        for j in range(i + 1, len(rects)):
+            assert not overlaps(rects[i], rects[j]), f"{rects[i]} overlaps {rects[j]}"
+
+def assert_page_fits(size: Vector2d, options: ExportOptions):
+    if options.max_atlas_size <= 0:
+        return
+
+    scaled = size.get_scaled(options.scaling_factor)
+    if options.power_of_two:
+        scaled = Vector2d(get_power_of_two(scaled.x), get_power_of_two(scaled.y))
+    assert scaled.x <= options.max_atlas_size and scaled.y <= options.max_atlas_size
+
+def fits_on_page(width: int, height: int, options: ExportOptions) -> bool:
+    limit = get_atlas_size_limit(options)
+    return limit <= 0 or (width + 2 * options.offset.x <= limit and height + 2 * options.offset.y <= limit)
+
+@pytest.mark.parametrize("pack", [pack_rects_maxrects, pack_rects_skyline])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_pack_rects(pack, seed: int):
+    rng = random.Random(seed)
+    sizes = random_sizes(rng, rng.randint(1, 60), 40)
+    (bin_width, bin_height) = (rng.randint(20, 120), rng.randint(20, 120))
+
+    positions = pack(sizes, bin_width, bin_height)
+
+    assert len(positions) == len(sizes)
+    placed = []
+    for (position, (width, height)) in zip(positions, sizes):
+        if width > bin_width or height > bin_height:
+            assert position is None
+        if position is not None:
+            assert 0 <= position[0] and position[0] + width <= bin_width
+            assert 0 <= position[1] and position[1] + height <= bin_height
+            placed.append((position[0], position[1], width, height))
+    assert_no_overlap(placed)
+
+@pytest.mark.parametrize("pack", [pack_rects_maxrects, pack_rects_skyline])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_pack_rects_places_everything_into_tall_bin(pack, seed: int):
+    rng = random.Random(seed)
+    sizes = random_sizes(rng, rng.randint(1, 60), 40)
+    bin_width = max(width for (width, _) in sizes)
+
+    positions = pack(sizes, bin_width, sum(height for (_, height) in sizes))
+
+    assert None not in positions
+
+@pytest.mark.parametrize("strategy", RECT_STRATEGIES)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_find_rect_pages(strategy: str, seed: int):
+    rng = random.Random(seed)
+    options = create_options(rng)
+    sizes = random_sizes(rng, rng.randint(1, 80), 48)
+
+    pages = find_rect_pages(sizes, options, strategy)
+
+    if not all(fits_on_page(width, height, options) for (width, height) in sizes):
+        assert pages is None
+        return
+    assert pages is not None
+    if options.max_atlas_size <= 0:
+        assert len(pages) == 1
+
+    placed_indices = []
+    for (indices, positions, page_size) in pages:
+        assert len(indices) == len(positions)
+        assert_page_fits(page_size, options)
+
+        padded_rects = []
+        for (idx, position) in zip(indices, positions):
+            (width, height) = sizes[idx]
+            assert position.x >= options.offset.x and position.y >= options.offset.y
+            assert position.x + width <= page_size.x - options.offset.x
+            assert position.y + height <= page_size.y - options.offset.y
+            padded_rects.append((position.x, position.y, width + options.spacing.x, height + options.spacing.y))
+        assert_no_overlap(padded_rects)
+        placed_indices += indices
+
+    assert sorted(placed_indices) == list(range(len(sizes)))
+
+def test_find_rect_pages_rejects_rect_bigger_than_page():
+    options = ExportOptions(Vector2d(0, 0), Vector2d(0, 0), 1, False, False, 0, max_atlas_size=64)
+    assert find_rect_pages([(16, 16), (65, 8)], options, "maxrects") is None
+    assert find_rect_pages([(16, 16), (64, 8)], options, "maxrects") is not None
+
+def test_frame_packing_strategy():
+    grid = ExportOptions(Vector2d(0, 0), Vector2d(0, 0), 1, False, False, 0, tileset_packing="grid")
+    assert get_frame_packing_strategy(MAXRECTS_MAX_FRAMES, grid) == "maxrects"
+    assert get_frame_packing_strategy(MAXRECTS_MAX_FRAMES + 1, grid) == "skyline"
+
+    maxrects = ExportOptions(Vector2d(0, 0), Vector2d(0, 0), 1, False, False, 0, tileset_packing="maxrects")
+    assert get_frame_packing_strategy(MAXRECTS_MAX_FRAMES + 1, maxrects) == "maxrects"
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_layout_tileset(seed: int):
+    rng = random.Random(seed)
+    options = create_options(rng)
+    frame_size = Vector2d(rng.randint(1, 64), rng.randint(1, 64))
+    tile_count = rng.randint(1, 200)
+
+    layout = layout_tileset(tile_count, frame_size, options)
+
+    if not fits_on_page(frame_size.x, frame_size.y, options):
+        assert layout is None
+        return
+    assert layout is not None
+
+    (page_sizes, cells, _, _) = layout
+    assert len(cells) == tile_count
+    for page_size in page_sizes:
+        assert_page_fits(page_size, options)
+
+    page_rects: dict[int, list[tuple[int, int, int, int]]] = {}
+    for cell in cells:
+        assert 0 <= cell.page < len(page_sizes)
+        page_size = page_sizes[cell.page]
+        assert cell.position.x >= options.offset.x and cell.position.y >= options.offset.y
+        assert cell.position.x + frame_size.x <= page_size.x - options.offset.x
+        assert cell.position.y + frame_size.y <= page_size.y - options.offset.y
+        page_rects.setdefault(cell.page, []).append((cell.position.x,
+                                                     cell.position.y,
+                                                     frame_size.x + options.spacing.x,
+                                                     frame_size.y + options.spacing.y))
+
+    assert sorted(page_rects) == list(range(len(page_sizes)))
+    for rects in page_rects.values():
+        assert_no_overlap(rects)
+
+@pytest.mark.parametrize("strategy", list(PACKING_STRATEGIES))
+@pytest.mark.parametrize("seed", SEEDS)
+def test_layout_spritesheet(strategy: str, seed: int):
+    rng = random.Random(seed)
+    options = create_options(rng, packing_strategy=strategy)
+    frame_size = Vector2d(rng.randint(1, 32), rng.randint(1, 32))
+    group_lengths = [rng.randint(1, 12) for _ in range(rng.randint(1, 30))]
+
+    layout = layout_spritesheet(group_lengths, frame_size, options)
+
+    longest = max(group_lengths)
+    if not fits_on_page(longest * frame_size.x + (longest - 1) * options.spacing.x, frame_size.y, options):
+        assert layout is None
+        return
+    assert layout is not None
+
+    (page_sizes, rows, clip_cells) = layout
+    assert sorted(idx for row in rows for idx in row) == list(range(len(group_lengths)))
+    for page_size in page_sizes:
+        assert_page_fits(page_size, options)
+
+    page_rects: dict[int, list[tuple[int, int, int, int]]] = {}
+    for (cell, length) in zip(clip_cells, group_lengths):
+        assert cell is not None
+        assert 0 <= cell.page < len(page_sizes)
+        page_size = page_sizes[cell.page]
+        clip_width = length * frame_size.x + (length - 1) * options.spacing.x
+        assert cell.position.x >= options.offset.x and cell.position.y >= options.offset.y
+        assert cell.position.x + clip_width <= page_size.x - options.offset.x
+        assert cell.position.y + frame_size.y <= page_size.y - options.offset.y
+        page_rects.setdefault(cell.page, []).append((cell.position.x,
+                                                     cell.position.y,
+                                                     clip_width + options.spacing.x,
+                                                     frame_size.y + options.spacing.y))
+
+    for rects in page_rects.values():
+        assert_no_overlap(rects)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_fit_groups(seed: int):
+    rng = random.Random(seed)
+    group_lengths = [rng.randint(1, 20) for _ in range(rng.randint(1, 40))]
+    capacity = max(group_lengths)
+
+    row_counts = {}
+    for strategy in PACKING_STRATEGIES:
+        rows = fit_groups(group_lengths, strategy)
+        assert sorted(idx for row in rows for idx in row) == list(range(len(group_lengths)))
+        assert all(sum(group_lengths[idx] for idx in row) <= capacity for row in rows)
+        row_counts[strategy] = len(rows)
+
+    assert row_counts["optimal"] <= min(row_counts.values())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Exports every project listed in a manifest from a single headless GIMP session.
+#
+# Manifest is a JSON list of entries, paths are relative to the manifest:
+#
+#   [
+#       { "input": "hero.xcf", "output": "out/hero.png" },
+#       { "input": "tiles.xcf", "output": "out/tiles.png", "options": { "groups-are-animations": false } }
+#   ]
+#
+# Options given on the command line apply to every entry unless the entry overrides them.
+# With --jobs, the entries are split between several GIMP processes running in parallel.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+batch_proc = "plug-in-nerudaj-spritesheetize-batch"
+
+def build_batch_script(manifest: str, report: str | None, compare_packing: bool, properties: dict[str, object]) -> str:
+    lines = [
+        "from gi.repository import Gimp, Gio",
+        f"procedure = Gimp.get_pdb().lookup_procedure({batch_proc!r})",
+        "config = procedure.create_config()",
+        "config.set_property('run-mode', Gimp.RunMode.NONINTERACTIVE)",
+        f"config.set_property('manifest', Gio.File.new_for_path({manifest!r}))"
+    ]
+
+    if report is not None:
+        lines.append(f"config.set_property('report', Gio.File.new_for_path({report!r}))")
+
+    lines.append(f"config.set_property('compare-packing', {compare_packing!r})")
+
+    for name, value in properties.items():
+        lines.append(f"config.set_property({name!r}, {value!r})")
+
+    lines.append("result = procedure.run(config)")
+    lines.append("if result.index(0) != Gimp.PDBStatusType.SUCCESS: raise RuntimeError('Batch export failed')")
+    return "\n".join(lines)
+
+def get_gimp_command(gimp: str, script: str) -> list[str]:
+    return [gimp,
+            "-i",
+            "--quit",
+            "--batch-interpreter=python-fu-eval",
+            "-b", script]
+
+def split_manifest(manifest: str, job_count: int, directory: str) -> list[str]:
+    fp = open(manifest, "rt")
+    entries = json.load(fp)
+    fp.close()
+
+    # Split manifests live elsewhere, so paths are made absolute first
+    manifest_dir = os.path.dirname(os.path.abspath(manifest))
+    for entry in entries:
+        entry["input"] = os.path.join(manifest_dir, entry["input"])
+        entry["output"] = os.path.join(manifest_dir, entry["output"])
+
+    manifests = []
+    for job in range(min(job_count, len(entries))):
+        filename = os.path.join(directory, f"manifest-{job}.json")
+        fp = open(filename, "wt")
+        json.dump(entries[job::job_count], fp)
+        fp.close()
+        manifests.append(filename)
+    return manifests
+
+def run_parallel(args, properties: dict[str, object]) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        manifests = split_manifest(args.manifest, args.jobs, directory)
+        reports = [os.path.join(directory, f"report-{job}.json") for job in range(len(manifests))]
+        processes = [subprocess.Popen(get_gimp_command(args.gimp,
+                                                       build_batch_script(manifest, report, args.compare_packing, properties)))
+                     for (manifest, report) in zip(manifests, reports)]
+        result = 0
+        for process in processes:
+            result = process.wait() or result
+
+        if args.report:
+            merged = []
+            for report in reports:
+                if os.path.exists(report):
+                    fp = open(report, "rt")
+                    merged += json.load(fp)
+                    fp.close()
+            fp = open(args.report, "wt")
+            json.dump(merged, fp, indent=4)
+            fp.close()
+
+    return result
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export many .xcf files with Spritesheetize in one GIMP session")
+    parser.add_argument("manifest", help="JSON manifest with input and output files")
+    parser.add_argument("--report", help="Write per-file timings as JSON to this file")
+    parser.add_argument("--compare-packing", action="store_true", help="Report the packing of every clip packing strategy")
+    parser.add_argument("--gimp", default="gimp-console", help="GIMP executable to use")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of GIMP processes exporting in parallel")
+    parser.add_argument("--groups-are-animations", action="store_true")
+    parser.add_argument("--upscale-factor", type=int, default=1)
+    parser.add_argument("--xoffset", type=int, default=0)
+    parser.add_argument("--yoffset", type=int, default=0)
+    parser.add_argument("--xspacing", type=int, default=0)
+    parser.add_argument("--yspacing", type=int, default=0)
+    parser.add_argument("--enforced-tiles-per-row", type=int, default=0)
+    parser.add_argument("--invert-order", action="store_true")
+    parser.add_argument("--worker-count", type=int, default=1)
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--packing-strategy", default="greedy", choices=["greedy", "first-fit", "best-fit", "optimal"])
+    parser.add_argument("--tileset-packing", default="grid", choices=["grid", "maxrects", "skyline"])
+    parser.add_argument("--trim-tiles", action="store_true")
+    parser.add_argument("--power-of-two", action="store_true")
+    parser.add_argument("--max-atlas-size", type=int, default=0)
+    parser.add_argument("--optimize-frames", action="store_true")
+    parser.add_argument("--streaming-png", action="store_true")
+    parser.add_argument("--binary-annotations", action="store_true")
+    args = parser.parse_args()
+
+    properties = {
+        "groups-are-animations": args.groups_are_animations,
+        "upscale-factor": args.upscale_factor,
+        "xoffset": args.xoffset,
+        "yoffset": args.yoffset,
+        "xspacing": args.xspacing,
+        "yspacing": args.yspacing,
+        "enforce-row-count": args.enforced_tiles_per_row > 0,
+        "enforced-tiles-per-row": args.enforced_tiles_per_row,
+        "invert-order": args.invert_order,
+        "worker-count": args.worker_count,
+        "incremental": args.incremental,
+        "packing-strategy": args.packing_strategy,
+        "tileset-packing": args.tileset_packing,
+        "trim-tiles": args.trim_tiles,
+        "power-of-two": args.power_of_two,
+        "max-atlas-size": args.max_atlas_size,
+        "optimize-frames": args.optimize_frames,
+        "streaming-png": args.streaming_png,
+        "binary-annotations": args.binary_annotations
+    }
+
+    if args.jobs > 1:
+        return run_parallel(args, properties)
+
+    script = build_batch_script(os.path.abspath(args.manifest),
+                                os.path.abspath(args.report) if args.report else None,
+                                args.compare_packing,
+                                properties)
+
+    return subprocess.call(get_gimp_command(args.gimp, script))
+
+if __name__ == "__main__":
+    sys.exit(main())